@@ -0,0 +1,132 @@
+"""AIMD concurrency limit per downstream service.
+
+call_with_policy takes a slot from the service's limiter for every attempt. While calls
+succeed with a latency below adaptive_latency_tolerance times the running average, the
+limit grows by about one per limit's worth of successes (additive increase). A 429 or a
+deadline timeout multiplies it by adaptive_backoff (multiplicative decrease), at most once
+per averaged latency so one burst of 429s counts as a single signal. Stage concurrency
+still caps each stage, so it should leave the limiter room to grow.
+"""
+import asyncio
+import collections
+import logging
+import time
+from typing import Dict, List
+
+from settings import get_settings
+
+# 每个服务保留最近多少次 limit 变化
+HISTORY_SIZE = 200
+# 延迟均值的平滑系数
+LATENCY_ALPHA = 0.05
+
+# 每个进程每个服务一个 limiter
+LIMITERS: Dict[str, "AdaptiveLimiter"] = {}
+
+
+class AdaptiveLimiter:
+    def __init__(self, service: str, initial_limit: int, min_limit: int, max_limit: int, backoff: float, latency_tolerance: float):
+        self.service = service
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff = backoff
+        self.latency_tolerance = latency_tolerance
+        self.in_flight = 0
+        self.waiters = collections.deque()
+        self.latency_average = None
+        self.last_decrease = 0.0
+        self.successes = 0
+        self.overloads = 0
+        self.history = collections.deque(maxlen=HISTORY_SIZE)
+
+    async def acquire(self):
+        while self.in_flight >= int(self.limit):
+            waiter = asyncio.get_running_loop().create_future()
+            self.waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    # 已经被唤醒但调用方被取消了，把名额让给下一个
+                    self._wake()
+                else:
+                    self.waiters.remove(waiter)
+                raise
+        self.in_flight += 1
+
+    def release(self):
+        self.in_flight -= 1
+        self._wake()
+
+    def _wake(self):
+        # 唤醒的等待者会重新检查 limit，limit 变小时多唤醒的会回到队列
+        free = int(self.limit) - self.in_flight
+        while free > 0 and self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                free -= 1
+
+    def on_success(self, latency: float):
+        self.successes += 1
+        healthy = self.latency_average is None or latency <= self.latency_average * self.latency_tolerance
+        self.latency_average = latency if self.latency_average is None else \
+            (1 - LATENCY_ALPHA) * self.latency_average + LATENCY_ALPHA * latency
+        if healthy and self.limit < self.max_limit:
+            self._set_limit(min(self.limit + 1 / self.limit, self.max_limit), "increase")
+
+    def on_overload(self, reason: str):
+        self.overloads += 1
+        now = time.monotonic()
+        if now - self.last_decrease < (self.latency_average or 1.0):
+            # 同一批在途请求的 429 只算一次
+            return
+        self.last_decrease = now
+        self._set_limit(max(self.limit * self.backoff, self.min_limit), reason)
+
+    def _set_limit(self, limit: float, reason: str):
+        previous = int(self.limit)
+        self.limit = limit
+        if int(limit) != previous:
+            self.history.append({"time": time.time(), "limit": int(limit), "reason": reason})
+            logging.info("Concurrency limit for %s: %s -> %s (%s)", self.service, previous, int(limit), reason)
+            self._wake()
+
+    def snapshot(self) -> dict:
+        return {
+            "service": self.service,
+            "limit": int(self.limit),
+            "in_flight": self.in_flight,
+            "waiting": len(self.waiters),
+            "successes": self.successes,
+            "overloads": self.overloads,
+            "latency_average_ms": round(self.latency_average * 1000, 1) if self.latency_average is not None else None,
+            "history": list(self.history),
+        }
+
+
+def is_rate_limited(error: Exception) -> bool:
+    # azure SDK 的 HttpResponseError 和 openai 的 RateLimitError 有 status_code，aiohttp 的 ClientResponseError 有 status
+    # 不匹配错误文本，文本里的 "429" 可能只是 id 或者字节数；包装过的错误沿 __cause__ 查找
+    while error is not None:
+        if getattr(error, "status_code", None) == 429 or getattr(error, "status", None) == 429:
+            return True
+        error = error.__cause__
+    return False
+
+def is_overload(error: Exception) -> bool:
+    if isinstance(error, (TimeoutError, asyncio.TimeoutError)):
+        return True
+    return is_rate_limited(error)
+
+def get_adaptive_limiter(service: str) -> AdaptiveLimiter:
+    if service not in LIMITERS:
+        settings = get_settings()
+        LIMITERS[service] = AdaptiveLimiter(service, settings.adaptive_initial_limit, settings.adaptive_min_limit, settings.adaptive_max_limit,
+                                            settings.adaptive_backoff, settings.adaptive_latency_tolerance)
+    return LIMITERS[service]
+
+def limiter_metrics() -> List[Dict]:
+    # 只包含本进程里调用过的服务
+    return [LIMITERS[service].snapshot() for service in sorted(LIMITERS)]
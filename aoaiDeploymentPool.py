@@ -0,0 +1,125 @@
+"""Quota-weighted routing and failover across several Azure OpenAI deployments."""
+import asyncio
+import json
+import logging
+import random
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, List, Optional
+
+from openai import APIConnectionError, APIStatusError, AsyncAzureOpenAI
+
+# 没有 Retry-After 头时的冷却时间（秒）
+DEFAULT_COOLDOWN = 10
+
+
+@dataclass
+class AzureOpenAIDeployment:
+    endpoint: str
+    api_key: str
+    deployment: str
+    # 权重按配额配置，例如 TPM（千）
+    weight: float = 1.0
+    api_version: str = "2024-02-01"
+    client: AsyncAzureOpenAI = field(init=False, repr=False)
+    cooldown_until: float = 0.0
+    remaining_requests: Optional[int] = None
+    remaining_tokens: Optional[int] = None
+    max_remaining_tokens: int = 0
+
+    def __post_init__(self):
+        # 关闭 SDK 自带的重试，429 时直接切换到其他部署，而不是在同一个部署上等 40 秒
+        self.client = AsyncAzureOpenAI(
+            api_key=self.api_key,
+            api_version=self.api_version,
+            azure_endpoint=self.endpoint,
+            max_retries=0
+        )
+
+    def effective_weight(self) -> float:
+        # 剩余 token 越少，分到的流量越少
+        if self.remaining_tokens is None or self.max_remaining_tokens == 0:
+            return self.weight
+        return self.weight * max(self.remaining_tokens / self.max_remaining_tokens, 0.05)
+
+
+def load_deployments(config: Optional[str], endpoint: str, api_key: str, deployment: str, api_version: str) -> List[AzureOpenAIDeployment]:
+    # config 的格式:
+    # [{"endpoint": "https://eastus.openai.azure.com/", "api_key": "...", "deployment": "gpt-4o", "weight": 450}, ...]
+    # 没有配置时退回到单个部署
+    if not config:
+        return [AzureOpenAIDeployment(endpoint=endpoint, api_key=api_key, deployment=deployment, api_version=api_version)]
+    return [AzureOpenAIDeployment(api_version=item.pop("api_version", api_version), **item) for item in json.loads(config)]
+
+def get_retry_after(headers) -> float:
+    if headers is None:
+        return DEFAULT_COOLDOWN
+    if headers.get("retry-after-ms"):
+        return float(headers["retry-after-ms"]) / 1000
+    if headers.get("retry-after"):
+        try:
+            return float(headers["retry-after"])
+        except ValueError:
+            pass
+    return DEFAULT_COOLDOWN
+
+
+class DeploymentPool:
+    def __init__(self, name: str, deployments: List[AzureOpenAIDeployment], max_attempts: Optional[int] = None):
+        if not deployments:
+            raise ValueError(f"Deployment pool {name} is empty")
+        self.name = name
+        self.deployments = deployments
+        self.max_attempts = max_attempts or len(deployments) * 3
+
+    def _update_from_headers(self, deployment: AzureOpenAIDeployment, headers):
+        remaining_requests = headers.get("x-ratelimit-remaining-requests")
+        remaining_tokens = headers.get("x-ratelimit-remaining-tokens")
+        if remaining_requests is not None:
+            deployment.remaining_requests = int(remaining_requests)
+            if deployment.remaining_requests == 0:
+                deployment.cooldown_until = time.monotonic() + 1
+        if remaining_tokens is not None:
+            deployment.remaining_tokens = int(remaining_tokens)
+            deployment.max_remaining_tokens = max(deployment.max_remaining_tokens, deployment.remaining_tokens)
+
+    async def _choose(self, tried: set) -> AzureOpenAIDeployment:
+        while True:
+            now = time.monotonic()
+            available = [d for d in self.deployments if d.cooldown_until <= now and id(d) not in tried]
+            if not available:
+                # 本轮都试过了，重新允许所有部署
+                available = [d for d in self.deployments if d.cooldown_until <= now]
+                tried.clear()
+            if available:
+                return random.choices(available, weights=[d.effective_weight() for d in available])[0]
+
+            wait_time = min(d.cooldown_until for d in self.deployments) - now
+            logging.warning("All deployments in pool %s are throttled. Waiting %.1f seconds...", self.name, wait_time)
+            await asyncio.sleep(wait_time)
+
+    async def call(self, operation: Callable[[AsyncAzureOpenAI, str], Awaitable[Any]]) -> Any:
+        # operation 需要使用 with_raw_response，这样才能读取限流相关的响应头
+        tried = set()
+        last_error = None
+        for _ in range(self.max_attempts):
+            deployment = await self._choose(tried)
+            tried.add(id(deployment))
+            try:
+                raw_response = await operation(deployment.client, deployment.deployment)
+                self._update_from_headers(deployment, raw_response.headers)
+                return raw_response.parse()
+            except APIStatusError as e:
+                if e.status_code != 429 and e.status_code < 500:
+                    raise
+                retry_after = get_retry_after(e.response.headers)
+                deployment.cooldown_until = time.monotonic() + retry_after
+                logging.warning("Deployment %s at %s returned %s, cooling down %s seconds", deployment.deployment, deployment.endpoint, e.status_code, retry_after)
+                last_error = e
+            except APIConnectionError as e:
+                deployment.cooldown_until = time.monotonic() + 1
+                logging.warning("Deployment %s at %s connection error: %s", deployment.deployment, deployment.endpoint, e)
+                last_error = e
+
+        # 保留最后一次的错误，callPolicy 从 __cause__ 读取状态码
+        raise Exception(f"All {self.max_attempts} attempts in deployment pool {self.name} failed: {last_error}") from last_error
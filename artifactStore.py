@@ -0,0 +1,178 @@
+"""On-disk store of enriched documents, so an index can be rebuilt without calling any model again.
+
+Every dataProcess run writes one shard directory:
+
+    <artifact_dir>/<shard>/records.ndjson     text fields, one JSON object per document
+    <artifact_dir>/<shard>/<vectorField>.f32  float32 rows, one per document that has the vector
+    <artifact_dir>/<shard>/manifest.json      row counts and dimensions, written last
+
+A shard is written under a temporary name and renamed when complete, so readers never see
+half-written shards. Vector files are plain float32 blocks and are memory-mapped on read.
+When the same id appears in several shards the newest shard wins. Caption-only changes from
+incremental runs are stored as patch shards and applied on top of the newest full record.
+Ids removed from the input file are stored as tombstone shards; a tombstone hides every
+older record of the id, a full record written after it brings the id back.
+"""
+import array
+import dataclasses
+import json
+import os
+import shutil
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from objectDefinition import Document
+from settings import get_settings
+from vectorFieldOptions import DOCUMENT_VECTOR_FIELDS
+
+MANIFEST_FILE = "manifest.json"
+RECORDS_FILE = "records.ndjson"
+
+
+class ArtifactStore:
+    def __init__(self, root: str = None):
+        self.root = root or get_settings().artifact_dir
+        os.makedirs(self.root, exist_ok=True)
+
+    def save(self, documents: List[Document], shard_name: str) -> Optional[str]:
+        if not documents:
+            return None
+        shard_path = os.path.join(self.root, shard_name)
+        temp_path = f"{shard_path}.tmp-{os.getpid()}"
+        os.makedirs(temp_path)
+
+        vector_files = {}
+        vectors = {}
+        try:
+            with open(os.path.join(temp_path, RECORDS_FILE), "w", encoding="utf-8") as records_file:
+                for document in documents:
+                    d = dataclasses.asdict(document)
+                    rows = {}
+                    for vector_field in DOCUMENT_VECTOR_FIELDS:
+                        vector = d.pop(vector_field, None)
+                        if vector is None:
+                            continue
+                        info = vectors.setdefault(vector_field, {"dimensions": len(vector), "rows": 0})
+                        if len(vector) != info["dimensions"]:
+                            raise ValueError(f"{vector_field} of {document.id} has {len(vector)} dimensions, expected {info['dimensions']}")
+                        if vector_field not in vector_files:
+                            vector_files[vector_field] = open(os.path.join(temp_path, f"{vector_field}.f32"), "wb")
+                        array.array("f", vector).tofile(vector_files[vector_field])
+                        rows[vector_field] = info["rows"]
+                        info["rows"] += 1
+                    # 向量在 .f32 文件里的行号
+                    d["vectorRows"] = rows
+                    records_file.write(json.dumps(d, ensure_ascii=False) + "\n")
+        finally:
+            for f in vector_files.values():
+                f.close()
+
+        with open(os.path.join(temp_path, MANIFEST_FILE), "w", encoding="utf-8") as f:
+            json.dump({"count": len(documents), "created_at": time.time(), "vectors": vectors}, f, indent=2)
+
+        # 同名 shard 说明同一个 chunk 重新处理过，新结果替换旧结果
+        if os.path.exists(shard_path):
+            shutil.rmtree(shard_path)
+        os.rename(temp_path, shard_path)
+        return shard_path
+
+    def save_patches(self, patches: List[dict], shard_name: str) -> Optional[str]:
+        # 增量模式下只改了 caption 的记录没有重新 enrichment，只记录要覆盖的字段
+        return self._save_markers([{**patch, "patch": True} for patch in patches], shard_name)
+
+    def save_tombstones(self, ids: List[str], shard_name: str) -> Optional[str]:
+        # 从输入文件删除的记录，reindex 时不能再上传
+        return self._save_markers([{"id": str(record_id), "deleted": True} for record_id in ids], shard_name)
+
+    def _save_markers(self, records: List[dict], shard_name: str) -> Optional[str]:
+        # patch 和 tombstone 都没有向量，只写 records.ndjson
+        if not records:
+            return None
+        shard_path = os.path.join(self.root, shard_name)
+        temp_path = f"{shard_path}.tmp-{os.getpid()}"
+        os.makedirs(temp_path)
+        with open(os.path.join(temp_path, RECORDS_FILE), "w", encoding="utf-8") as records_file:
+            for record in records:
+                records_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        with open(os.path.join(temp_path, MANIFEST_FILE), "w", encoding="utf-8") as f:
+            json.dump({"count": len(records), "created_at": time.time(), "vectors": {}}, f, indent=2)
+        if os.path.exists(shard_path):
+            shutil.rmtree(shard_path)
+        os.rename(temp_path, shard_path)
+        return shard_path
+
+    def shards(self) -> List[str]:
+        # 只返回写完的 shard，按创建时间排序
+        shards = []
+        for name in os.listdir(self.root):
+            manifest_path = os.path.join(self.root, name, MANIFEST_FILE)
+            if ".tmp-" in name or not os.path.exists(manifest_path):
+                continue
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                shards.append((json.load(f)["created_at"], name))
+        return [name for _, name in sorted(shards)]
+
+    def open_vectors(self, shard_name: str):
+        # numpy 只在读取时需要，worker 写入时不加载
+        import numpy as np
+
+        with open(os.path.join(self.root, shard_name, MANIFEST_FILE), "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        return {
+            vector_field: np.memmap(os.path.join(self.root, shard_name, f"{vector_field}.f32"), dtype=np.float32, mode="r",
+                                    shape=(info["rows"], info["dimensions"]))
+            for vector_field, info in manifest["vectors"].items()
+        }
+
+    def _iter_records(self, shard_name: str) -> Iterator[dict]:
+        with open(os.path.join(self.root, shard_name, RECORDS_FILE), "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    def _build_id_index(self) -> Tuple[Dict[str, str], Dict[str, dict]]:
+        # 返回 (id -> 最新的完整记录所在 shard, id -> 比完整记录更新的 patch)
+        latest = {}
+        patches = {}
+        for shard_name in self.shards():
+            for record in self._iter_records(shard_name):
+                if record.get("deleted"):
+                    # 之前的完整记录和 patch 都作废
+                    latest.pop(record["id"], None)
+                    patches.pop(record["id"], None)
+                elif record.pop("patch", False):
+                    patches[record["id"]] = record
+                else:
+                    latest[record["id"]] = shard_name
+                    patches.pop(record["id"], None)
+        return latest, patches
+
+    def iter_documents(self) -> Iterator[Document]:
+        latest, patches = self._build_id_index()
+        for shard_name in self.shards():
+            vectors = None
+            for record in self._iter_records(shard_name):
+                if record.get("patch") or record.get("deleted") or latest.get(record["id"]) != shard_name:
+                    continue
+                if vectors is None:
+                    vectors = self.open_vectors(shard_name)
+                rows = record.pop("vectorRows")
+                for vector_field in DOCUMENT_VECTOR_FIELDS:
+                    record[vector_field] = vectors[vector_field][rows[vector_field]].tolist() if vector_field in rows else None
+                record.update(patches.get(record["id"], {}))
+                yield Document(**record)
+
+    def count(self) -> int:
+        return len(self._build_id_index()[0])
+
+
+def shard_name_for(file_path: str, start_line: int = 0, end_line: Optional[int] = None) -> str:
+    # 同一个文件的同一段行范围对应同一个 shard
+    base_name = os.path.splitext(os.path.basename(file_path))[0]
+    return f"{base_name}-{start_line}-{end_line if end_line is not None else 'end'}"
+
+
+if __name__ == "__main__":
+    # 示例调用
+    store = ArtifactStore()
+    print(f"{len(store.shards())} shards, {store.count()} documents in {store.root}")
@@ -0,0 +1,237 @@
+"""Azure OpenAI Batch API mode for bulk gpt-4o descriptions and embeddings."""
+import asyncio
+import functools
+import json
+import logging
+import os
+from typing import Dict, List
+
+from openai import AsyncAzureOpenAI
+
+from embeddingBackend import get_embedding_backend
+from fusedTextVector import build_fused_text
+from gamePartition import get_game_classifier
+from indexState import compute_fingerprint
+from multiModelsPictureProcess import build_multi_model_messages
+from objectDefinition import Document, ImageData, RecordResult
+from pictureFormatProcess import download_and_save_as_pdf
+from pictureOcrProcess import analyze_document, get_image_caption_byCV
+from settings import configure_logging, get_settings
+from structuredLogging import Truncated
+from vectorFieldOptions import FUSED_TEXT_VECTOR_FIELD, get_text_vector_fields
+
+
+@functools.lru_cache(maxsize=None)
+def get_batch_client() -> AsyncAzureOpenAI:
+    # Batch API 需要 Global-Batch 类型的部署，和在线部署的配额互不影响
+    settings = get_settings()
+    return AsyncAzureOpenAI(
+        api_key = settings.azure_openai_api_key,
+        api_version = settings.batch_api_version,
+        azure_endpoint = settings.azure_openai_endpoint
+    )
+
+
+def write_description_batch_file(image_data_list: List[ImageData], batch_file_path: str) -> str:
+    logging.info("Writing %s description requests to %s", len(image_data_list), batch_file_path)
+
+    with open(batch_file_path, "w", encoding="utf-8") as batch_file:
+        for item in image_data_list:
+            request = {
+                "custom_id": item.id,
+                "method": "POST",
+                "url": "/chat/completions",
+                "body": {
+                    "model": get_settings().batch_deployment,
+                    "seed": 99,
+                    "messages": build_multi_model_messages(item.imageUrl),
+                    "max_tokens": 500
+                }
+            }
+            batch_file.write(json.dumps(request, ensure_ascii=False) + "\n")
+    return batch_file_path
+
+def write_embedding_batch_file(texts: Dict[str, str], batch_file_path: str) -> str:
+    logging.info("Writing %s embedding requests to %s", len(texts), batch_file_path)
+
+    with open(batch_file_path, "w", encoding="utf-8") as batch_file:
+        for custom_id, text in texts.items():
+            request = {
+                "custom_id": custom_id,
+                "method": "POST",
+                "url": "/embeddings",
+                "body": {
+                    "model": get_settings().batch_embedding_deployment,
+                    "input": text
+                }
+            }
+            batch_file.write(json.dumps(request, ensure_ascii=False) + "\n")
+    return batch_file_path
+
+def parse_batch_output(content: str) -> Dict[str, dict]:
+    # 按 custom_id 返回成功请求的 response body，失败的请求只记录日志
+    results = {}
+    for line in content.splitlines():
+        if not line.strip():
+            continue
+        item = json.loads(line)
+        response = item.get("response") or {}
+        if item.get("error") or response.get("status_code") != 200:
+            logging.error("Batch request %s failed: %s", item.get('custom_id'), Truncated(item.get('error') or response.get('body'), 500))
+            continue
+        results[item["custom_id"]] = response["body"]
+    return results
+
+async def submit_batch_job(batch_file_path: str, endpoint: str) -> str:
+    logging.info("Submitting batch file %s to %s", batch_file_path, endpoint)
+
+    with open(batch_file_path, "rb") as batch_file:
+        uploaded_file = await get_batch_client().files.create(file=batch_file, purpose="batch")
+
+    batch_job = await get_batch_client().batches.create(
+        input_file_id=uploaded_file.id,
+        endpoint=endpoint,
+        completion_window="24h"
+    )
+    logging.info("Batch job %s created for %s", batch_job.id, batch_file_path)
+    return batch_job.id
+
+async def wait_for_batch_job(batch_id: str, poll_interval: int = None) -> Dict[str, dict]:
+    poll_interval = poll_interval or get_settings().batch_poll_interval
+    while True:
+        batch_job = await get_batch_client().batches.retrieve(batch_id)
+        logging.info("Batch job %s status: %s", batch_id, batch_job.status)
+        if batch_job.status == "completed":
+            break
+        if batch_job.status in ("failed", "expired", "cancelled"):
+            raise Exception(f"Batch job {batch_id} ended with status {batch_job.status}: {batch_job.errors}")
+        await asyncio.sleep(poll_interval)
+
+    results = {}
+    if batch_job.output_file_id:
+        output = await get_batch_client().files.content(batch_job.output_file_id)
+        results = parse_batch_output(output.text)
+    if batch_job.error_file_id:
+        errors = await get_batch_client().files.content(batch_job.error_file_id)
+        parse_batch_output(errors.text)
+    return results
+
+async def run_batch_job(batch_file_path: str, endpoint: str) -> Dict[str, dict]:
+    batch_id = await submit_batch_job(batch_file_path, endpoint)
+    return await wait_for_batch_job(batch_id)
+
+async def run_embedding_requests(texts: Dict[str, str], batch_file_path: str) -> Dict[str, dict]:
+    backend = get_embedding_backend()
+    if backend.name == "local":
+        # 本地模型没有 Batch API，直接编码，向量要和在线流水线、查询在同一个空间
+        vectors = await backend.embed_texts(list(texts.values()))
+        return {custom_id: {"data": [{"embedding": vector}]} for custom_id, vector in zip(texts, vectors)}
+    embedding_file = write_embedding_batch_file(texts, batch_file_path)
+    return await run_batch_job(embedding_file, "/embeddings")
+
+def get_batch_embedding(vectors: Dict[str, dict], field: str) -> List[float]:
+    if vectors.get(field) is None:
+        return None
+    return vectors[field]["data"][0]["embedding"]
+
+def build_stage_slots() -> Dict[str, asyncio.Semaphore]:
+    # 和在线流水线一样，每个 stage 的并发不超过 stage_concurrency
+    stage_concurrency = get_settings().stage_concurrency
+    return {stage_name: asyncio.Semaphore(stage_concurrency[stage_name]) for stage_name in ("download", "caption", "image_vector", "ocr")}
+
+async def run_in_slot(slot: asyncio.Semaphore, call):
+    async with slot:
+        return await call()
+
+async def get_cv_enrichment(item: ImageData, pdf_dir: str, slots: Dict[str, asyncio.Semaphore]) -> dict:
+    # Computer Vision 和 Document Intelligence 没有 Batch API，仍然在线调用
+    pdfFileLocalPath, captionByCV, imageVector = await asyncio.gather(
+        run_in_slot(slots["download"], lambda: download_and_save_as_pdf(item.imageUrl, pdf_dir)),
+        run_in_slot(slots["caption"], lambda: get_image_caption_byCV(item.imageUrl)),
+        run_in_slot(slots["image_vector"], lambda: get_embedding_backend().embed_image(item.imageUrl)),
+    )
+    ocrContent = await run_in_slot(slots["ocr"], lambda: analyze_document(pdfFileLocalPath))
+
+    return {"captionByCV": captionByCV, "ocrContent": ocrContent, "imageVector": imageVector}
+
+async def process_images_records_by_batch(image_data_list: List[ImageData], pdf_dir: str) -> RecordResult:
+    documents = []
+    errorRecords = []
+    recordResult = RecordResult(documentList=documents, failedImageList=errorRecords, totalRecords=len(image_data_list))
+    if not image_data_list:
+        return recordResult
+
+    batch_dir = get_settings().batch_dir
+    os.makedirs(batch_dir, exist_ok=True)
+    batch_name = f"{image_data_list[0].id}_{len(image_data_list)}"
+
+    # 1. 先提交 gpt-4o 描述的 batch 任务，等待期间在线完成 CV/OCR
+    description_file = write_description_batch_file(image_data_list, os.path.join(batch_dir, f"{batch_name}_description.jsonl"))
+    description_job = asyncio.create_task(run_batch_job(description_file, "/chat/completions"))
+
+    enrichments = {}
+    slots = build_stage_slots()
+
+    async def enrich(item: ImageData):
+        try:
+            enrichments[item.id] = await get_cv_enrichment(item, pdf_dir, slots)
+        except Exception as e:
+            logging.error("Error processing record %s: %s", item.id, e)
+
+    # 所有记录同时进行，每个服务的并发由 slots 和 callPolicy 的 limiter 控制
+    await asyncio.gather(*(enrich(item) for item in image_data_list))
+
+    descriptions = await description_job
+
+    # 2. 再把文本字段一起提交 embedding batch 任务，custom_id 为 "<id>|<向量字段名>"
+    texts = {}
+    for item in image_data_list:
+        if item.id not in enrichments or item.id not in descriptions:
+            continue
+        enrichment = enrichments[item.id]
+        content = descriptions[item.id]["choices"][0]["message"]["content"]
+        enrichment["content"] = content
+        if get_settings().text_vector_mode == "fused":
+            texts[f"{item.id}|{FUSED_TEXT_VECTOR_FIELD}"] = build_fused_text(enrichment["captionByCV"], content, enrichment["ocrContent"])
+        else:
+            texts[f"{item.id}|captionVector"] = enrichment["captionByCV"]
+            texts[f"{item.id}|contentVector"] = content
+            texts[f"{item.id}|ocrContentVecotor"] = enrichment["ocrContent"] + enrichment["captionByCV"]
+
+    embeddings = {}
+    if texts:
+        embeddings = await run_embedding_requests(texts, os.path.join(batch_dir, f"{batch_name}_embedding.jsonl"))
+
+    # 3. 按 custom_id 合并结果
+    for item in image_data_list:
+        vectors = {field: embeddings.get(f"{item.id}|{field}") for field in get_text_vector_fields()}
+        if item.id not in enrichments or "content" not in enrichments[item.id] or None in vectors.values():
+            logging.error("Error processing record %s: missing batch output", item.id)
+            errorRecords.append(item)
+            continue
+
+        enrichment = enrichments[item.id]
+        document = Document(id=item.id,
+                            imageUrl=item.imageUrl,
+                            caption=item.caption,
+                            content=enrichment["content"],
+                            ocrContent=enrichment["ocrContent"],
+                            captionVector=get_batch_embedding(vectors, "captionVector"),
+                            contentVector=get_batch_embedding(vectors, "contentVector"),
+                            ocrContentVecotor=get_batch_embedding(vectors, "ocrContentVecotor"),
+                            imageVecotor=enrichment["imageVector"],
+                            fingerprint=compute_fingerprint(item),
+                            fusedTextVector=get_batch_embedding(vectors, FUSED_TEXT_VECTOR_FIELD),
+                            game=get_game_classifier().classify(item.caption))
+        documents.append(document)
+
+    return recordResult
+
+if __name__ == "__main__":
+    configure_logging()
+    # 示例调用
+    from data_utils import parse_image_records
+
+    image_data_list = parse_image_records("multi-models/image_captions/ima_files_2_test.txt")
+    recordResult = asyncio.run(process_images_records_by_batch(image_data_list, "docs/pdf"))
+    print("recordResult: {}",recordResult)
@@ -1,21 +1,121 @@
+import argparse
+import logging
 import os
+import socket
 import subprocess
 from concurrent.futures import ProcessPoolExecutor
 
+from profiling import merge_profiles, new_profile_dir
+from settings import configure_logging, get_settings
+from workCoordinator import build_chunk_ranges, create_coordinator
 
-def call_process_data_file(file_path):
-    subprocess.run(["python3", "dataProcess.py", file_path])
 
-def process_multiple_files(directory, max_workers):
+def build_command(file_path, start_line=None, end_line=None, profile_dir=None):
+    command = ["python3", "dataProcess.py", file_path]
+    if start_line is not None:
+        command += ["--start-line", str(start_line), "--end-line", str(end_line)]
+    if profile_dir:
+        # 每个 worker 写自己的 profile，全部结束后合并
+        command += ["--profile-dir", profile_dir]
+    return command
+
+def call_process_data_file(file_path, start_line=None, end_line=None, profile_dir=None):
+    subprocess.run(build_command(file_path, start_line, end_line, profile_dir))
+
+def process_multiple_files(directory, max_workers, profile_dir=None):
     file_paths = [os.path.join(directory, f) for f in os.listdir(directory) if os.path.isfile(os.path.join(directory, f))]
     
     with ProcessPoolExecutor(max_workers=max_workers) as executor:
-        futures = [executor.submit(call_process_data_file, file_path) for file_path in file_paths]
+        futures = [executor.submit(call_process_data_file, file_path, None, None, profile_dir) for file_path in file_paths]
         
         for future in futures:
             future.result()  # 等待所有任务完成
 
+def process_file_shards(file_path, lines_per_chunk, max_workers, profile_dir=None):
+    # 每个 worker 处理主文件的一个行范围，通过行偏移索引直接定位，不需要临时 chunk 文件
+    shard_ranges = build_chunk_ranges(file_path, lines_per_chunk)
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(call_process_data_file, file_path, start_line, end_line, profile_dir) for start_line, end_line in shard_ranges]
+
+        for future in futures:
+            future.result()  # 等待所有任务完成
+
+def run_coordinated_worker(coordinator_url, job_id, worker_id, lease_seconds=300, profile_dir=None):
+    coordinator = create_coordinator(coordinator_url)
+    file_path = coordinator.get_job_file(job_id)
+    heartbeat_interval = lease_seconds / 3
+
+    while True:
+        lease = coordinator.claim(job_id, worker_id, lease_seconds)
+        if lease is None:
+            break
+
+        logging.info("Worker %s claimed chunk %s [%s, %s)", worker_id, lease.chunk_id, lease.start_line, lease.end_line)
+        process = subprocess.Popen(build_command(file_path, lease.start_line, lease.end_line, profile_dir))
+        lease_lost = False
+        while True:
+            try:
+                process.wait(timeout=heartbeat_interval)
+                break
+            except subprocess.TimeoutExpired:
+                if not coordinator.heartbeat(lease, lease_seconds):
+                    # lease 已经过期并被其他 worker 领取，停止处理避免重复
+                    logging.warning("Worker %s lost lease on chunk %s, stopping", worker_id, lease.chunk_id)
+                    process.terminate()
+                    process.wait()
+                    lease_lost = True
+                    break
+
+        if lease_lost:
+            continue
+        if process.returncode == 0 and coordinator.complete(lease):
+            logging.info("Worker %s completed chunk %s", worker_id, lease.chunk_id)
+            continue
+        state = coordinator.release(lease, f"dataProcess.py exited with {process.returncode}")
+        if state == "failed":
+            logging.error("Chunk %s failed %s times, marked failed", lease.chunk_id, get_settings().coordinator_max_attempts)
+        elif state == "pending":
+            logging.warning("Worker %s released chunk %s after exit code %s", worker_id, lease.chunk_id, process.returncode)
+
+def process_job(coordinator_url, job_id, max_workers, lease_seconds=300, profile_dir=None):
+    # 每台机器启动 max_workers 个 worker，从同一个 coordinator 领取 chunk
+    worker_prefix = f"{socket.gethostname()}-{os.getpid()}"
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(run_coordinated_worker, coordinator_url, job_id, f"{worker_prefix}-{i}", lease_seconds, profile_dir)
+                   for i in range(max_workers)]
+
+        for future in futures:
+            future.result()  # 等待所有任务完成
+
+    print(f"Job {job_id} progress: {create_coordinator(coordinator_url).progress(job_id)}")
+
 # Example usage
 if __name__ == "__main__":
-    directory = os.getenv("temp_dir")
-    process_multiple_files(directory, max_workers=16)
\ No newline at end of file
+    configure_logging()
+
+    parser = argparse.ArgumentParser(description="Process line-range shards of the input file locally, or share one job across machines through a coordinator.")
+    parser.add_argument("--coordinator", help="coordinator url, e.g. sqlite:///docs/coordinator.db")
+    parser.add_argument("--job-id", help="job to work on when using a coordinator")
+    parser.add_argument("--create-job", metavar="FILE", help="register FILE as --job-id, split into lines_per_chunk line ranges")
+    parser.add_argument("--file", help="input file to shard locally, defaults to multi_models_file_path")
+    parser.add_argument("--directory", help="process every file in this directory as a whole instead")
+    parser.add_argument("--max-workers", type=int, default=16)
+    parser.add_argument("--lease-seconds", type=int, default=300)
+    parser.add_argument("--profile", action="store_true", help="profile every worker and write merged collapsed stacks to profile_dir")
+    args = parser.parse_args()
+    profile_dir = new_profile_dir() if args.profile else None
+
+    if args.coordinator:
+        if args.create_job:
+            chunk_ranges = build_chunk_ranges(args.create_job, get_settings().lines_per_chunk)
+            create_coordinator(args.coordinator).create_job(args.job_id, os.path.abspath(args.create_job), chunk_ranges)
+            print(f"Job {args.job_id} created with {len(chunk_ranges)} chunks")
+        process_job(args.coordinator, args.job_id, args.max_workers, args.lease_seconds, profile_dir)
+    elif args.directory:
+        process_multiple_files(args.directory, max_workers=args.max_workers, profile_dir=profile_dir)
+    else:
+        settings = get_settings()
+        process_file_shards(args.file or settings.multi_models_file_path, settings.lines_per_chunk, args.max_workers, profile_dir)
+
+    if profile_dir:
+        merge_profiles(profile_dir)
@@ -0,0 +1,113 @@
+"""Per-service deadlines and hedged requests for the service wrappers.
+
+Every wrapper passes a zero-argument `attempt` that picks its own endpoint (CV round-robin,
+deployment pool), so a hedge normally lands on a different endpoint than the first try.
+A hedge is started once the first attempt has been running longer than the observed
+latency percentile of that service; the first successful response wins and the other
+attempt is cancelled. The whole call, including the hedge, is bounded by the deadline. Every attempt also takes a
+slot from the service's adaptive concurrency limiter (adaptiveConcurrency).
+"""
+import asyncio
+import collections
+import functools
+import logging
+import time
+from typing import Awaitable, Callable, Optional, TypeVar
+
+from adaptiveConcurrency import get_adaptive_limiter, is_overload
+from settings import get_settings
+
+T = TypeVar("T")
+
+# 统计最近多少次成功调用的耗时
+LATENCY_WINDOW = 500
+# 样本少于这个数时使用 hedge_initial_delay_ms
+MIN_LATENCY_SAMPLES = 20
+
+
+class LatencyTracker:
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self.samples = collections.deque(maxlen=window)
+
+    def record(self, seconds: float):
+        self.samples.append(seconds)
+
+    def percentile(self, p: float) -> Optional[float]:
+        if len(self.samples) < MIN_LATENCY_SAMPLES:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(int(len(ordered) * p / 100), len(ordered) - 1)]
+
+    def hedge_delay(self) -> float:
+        settings = get_settings()
+        observed = self.percentile(settings.hedge_percentile)
+        if observed is None:
+            return settings.hedge_initial_delay_ms / 1000
+        return max(observed, settings.hedge_min_delay_ms / 1000)
+
+
+@functools.lru_cache(maxsize=None)
+def get_latency_tracker(service: str) -> LatencyTracker:
+    return LatencyTracker()
+
+async def limited(service: str, attempt: Callable[[], Awaitable[T]]) -> T:
+    if not get_settings().adaptive_concurrency:
+        return await attempt()
+    limiter = get_adaptive_limiter(service)
+    await limiter.acquire()
+    start_time = time.monotonic()
+    try:
+        result = await attempt()
+    except asyncio.CancelledError:
+        # 对冲输掉或者超过截止时间被取消，不算成功也不算过载
+        raise
+    except Exception as e:
+        if is_overload(e):
+            limiter.on_overload("429" if not isinstance(e, (TimeoutError, asyncio.TimeoutError)) else "timeout")
+        raise
+    else:
+        limiter.on_success(time.monotonic() - start_time)
+        return result
+    finally:
+        limiter.release()
+
+async def call_with_policy(service: str, attempt: Callable[[], Awaitable[T]]) -> T:
+    settings = get_settings()
+    deadline = settings.service_deadlines.get(service)
+    tracker = get_latency_tracker(service)
+    hedge_delay = tracker.hedge_delay() if service in settings.hedge_services else None
+
+    start_time = time.monotonic()
+    tasks = {asyncio.ensure_future(limited(service, attempt))}
+    first_error = None
+    try:
+        while True:
+            elapsed = time.monotonic() - start_time
+            if deadline is not None and elapsed >= deadline:
+                if settings.adaptive_concurrency:
+                    get_adaptive_limiter(service).on_overload("timeout")
+                raise TimeoutError(f"{service} call exceeded its deadline of {deadline} seconds")
+
+            timeout = None if deadline is None else deadline - elapsed
+            if hedge_delay is not None:
+                until_hedge = max(hedge_delay - elapsed, 0)
+                timeout = until_hedge if timeout is None else min(timeout, until_hedge)
+
+            done, tasks = await asyncio.wait(tasks, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    tracker.record(time.monotonic() - start_time)
+                    return task.result()
+                first_error = first_error or task.exception()
+            if not tasks:
+                # 失败不在这里重试，由各个 wrapper 自己的重试逻辑处理
+                raise first_error
+
+            if hedge_delay is not None and time.monotonic() - start_time >= hedge_delay:
+                # 只发一个重复请求，避免在服务整体变慢时把请求量翻倍
+                logging.info("Hedging %s call after %.2f seconds", service, hedge_delay)
+                tasks.add(asyncio.ensure_future(limited(service, attempt)))
+                hedge_delay = None
+    finally:
+        for task in tasks:
+            task.cancel()
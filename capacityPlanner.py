@@ -0,0 +1,403 @@
+"""Dry-run capacity plan for an ingestion job: wall-clock time, bottleneck and settings, without calling any service.
+
+Per record the pipeline sends:
+
+    download   1 image download
+    chat       1 / describe_images_per_request gpt-4o requests (prompt + image + max_tokens count against TPM)
+    cv         1 dense caption, plus 1 image vectorization with the azure embedding backend
+    ocr        1 Document Intelligence read
+    embedding  3 requests (separate) or 1 (fused) with the azure backend
+
+Text-post files are tokenized exactly as textPostProcess chunks them. Image records only send
+their image, so their token needs come from the prompt, the image and the output/OCR sizes below.
+
+Quotas are read from limitation_error/limitation.info and multiplied by the number of configured
+deployments/endpoints. Latencies are DEFAULT_LATENCIES unless --latencies points at measured ones,
+either {"chat": 7.5, ...} in seconds or the JSON of queryService's /metrics. The model:
+
+    quota rate    records/s a service allows: quota * QUOTA_HEADROOM / demand per record
+    stage rate    records/s a stage allows: stage concurrency * workers / (latency * requests per record)
+    item rate     records/s the in-flight cap allows: max_items_in_flight * workers / critical path latency
+
+The slowest of these is the predicted rate and names the bottleneck. The recommended settings
+run every stage just fast enough for the best quota rate. --mock runs one worker's share of the
+recommended plan through the real stage graph against simulated services (latency and 429s,
+with time scaled by --time-scale) to check the prediction.
+"""
+import argparse
+import asyncio
+import collections
+import json
+import math
+import random
+import re
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+from data_utils import build_record_scheduler
+from embeddingBackend import get_embedding_backend
+from fusedTextVector import get_encoding
+from lineIndex import LineIndex, read_line_range
+from multiModelsPictureProcess import DESCRIBE_PROMPT, MAX_TOKENS_PER_IMAGE, MULTI_IMAGE_PROMPT, SYSTEM_PROMPT
+from settings import get_settings
+from stageScheduler import Stage, StageScheduler
+from textPostProcess import build_text_chunks, parse_text_posts
+
+# 默认的单次调用耗时（秒），可以用 --latencies 换成实测值
+DEFAULT_LATENCIES = {
+    "download": 0.5,
+    "chat": 8.0,
+    "cv": 1.0,
+    "ocr": 4.0,
+    "embedding": 0.3,
+    "local": 0.05,
+}
+# callPolicy 里分开统计的服务共用同一个资源的配额，规划时合并成一个服务
+METRIC_SERVICES = {"cv_vectorize": "cv", "cv_caption": "cv"}
+# limitation.info 里 Document Intelligence 只写了训练接口的限制，read 接口按 S0 默认的 15 TPS
+DEFAULT_QUOTAS = {"ocr": {"requests_per_second": 15.0}}
+# limitation.info 的标题 -> 服务
+QUOTA_SECTIONS = [("gpt-4o", "chat"), ("embedding", "embedding"), ("computer vision", "cv"), ("document intelligence", "ocr")]
+# 只用配额的 90%，留出突发的余量
+QUOTA_HEADROOM = 0.9
+
+# gpt-4o 高清模式下一张 1024x1024 图片: 85 + 170 * 4 个 tile
+IMAGE_TOKENS = 765
+# gpt-4o 描述、CV caption、OCR 文本的平均 token 数，用于估算 embedding 输入
+DESCRIBE_OUTPUT_TOKENS = 350
+CV_CAPTION_TOKENS = 20
+OCR_TOKENS = 150
+
+# 一个 worker 进程里所有 stage 加起来的并发上限，超过了就加 worker
+MAX_CONCURRENCY_PER_WORKER = 64
+# 每个 chunk 处理大约多少秒，同时保证 chunk 数至少是 worker 数的 4 倍
+CHUNK_TARGET_SECONDS = 120
+# 模拟 429 后的等待时间和配额桶的容量（秒，未缩放）
+MOCK_RETRY_AFTER = 1.0
+MOCK_BURST_SECONDS = 1.0
+
+
+@dataclass
+class Quota:
+    requests_per_second: Optional[float] = None
+    tokens_per_second: Optional[float] = None
+
+
+@dataclass
+class ServiceDemand:
+    # 每条记录
+    requests: float = 0.0
+    tokens: float = 0.0
+
+
+def parse_limitation_info(path: str) -> Dict[str, Quota]:
+    quotas = {service: Quota(**values) for service, values in DEFAULT_QUOTAS.items()}
+    with open(path, "r", encoding="utf-8") as f:
+        sections = re.split(r"^\s*\d+\.\s*", f.read(), flags=re.M)
+    for section in sections[1:]:
+        header = section.splitlines()[0].lower()
+        service = next((service for key, service in QUOTA_SECTIONS if key in header), None)
+        if service is None:
+            continue
+        quota = quotas.setdefault(service, Quota())
+        for line in section.splitlines():
+            if "training" in line.lower():
+                continue
+            tpm = re.search(r"Tokens per Minute.*?\(thousands\)\s*:?\s*([\d.]+)", line, re.I)
+            rpm = re.search(r"Requests per minute\)?\s*:?\s*([\d.]+)", line, re.I)
+            cps = re.search(r"([\d.]+)\s*Calls per second", line, re.I)
+            if tpm:
+                quota.tokens_per_second = float(tpm.group(1)) * 1000 / 60
+            if rpm:
+                quota.requests_per_second = float(rpm.group(1)) / 60
+            if cps:
+                quota.requests_per_second = float(cps.group(1))
+    return quotas
+
+def count_deployments(config: Optional[str]) -> int:
+    return len(json.loads(config)) if config else 1
+
+def scale_quotas(quotas: Dict[str, Quota]) -> Dict[str, Quota]:
+    # limitation.info 是单个部署/资源的配额
+    settings = get_settings()
+    copies = {"chat": count_deployments(settings.chat_deployments_json),
+              "embedding": count_deployments(settings.embedding_deployments_json),
+              "cv": max(len(settings.cv_endpoints), 1)}
+    scaled = {}
+    for service, quota in quotas.items():
+        n = copies.get(service, 1)
+        scaled[service] = Quota(quota.requests_per_second and quota.requests_per_second * n,
+                                quota.tokens_per_second and quota.tokens_per_second * n)
+    return scaled
+
+def load_latencies(path: Optional[str]) -> Dict[str, float]:
+    latencies = dict(DEFAULT_LATENCIES)
+    if not path:
+        return latencies
+    with open(path, "r", encoding="utf-8") as f:
+        measured = json.load(f)
+    if "concurrency" in measured:
+        # queryService /metrics: 每个服务 limiter 的平均延迟
+        grouped = collections.defaultdict(list)
+        for entry in measured["concurrency"]:
+            if entry["latency_average_ms"]:
+                grouped[METRIC_SERVICES.get(entry["service"], entry["service"])].append(entry["latency_average_ms"] / 1000)
+        # 每条记录 cv_vectorize 和 cv_caption 各调用一次，取平均作为 cv 的单次耗时
+        measured = {service: sum(values) / len(values) for service, values in grouped.items()}
+    latencies.update({service: float(seconds) for service, seconds in measured.items()})
+    return latencies
+
+
+def is_text_post_file(file_path: str) -> bool:
+    first_lines = read_line_range(file_path, 0, 1)
+    return bool(first_lines) and "'imageUrl'" not in first_lines[0]
+
+def service_for_stage(stage_name: str) -> str:
+    local = get_embedding_backend().name == "local"
+    if stage_name == "download":
+        return "download"
+    if stage_name == "describe":
+        return "chat"
+    if stage_name == "caption":
+        return "cv"
+    if stage_name == "image_vector":
+        return "local" if local else "cv"
+    if stage_name == "ocr":
+        return "ocr"
+    # *_vector 和 text_embedding
+    return "local" if local else "embedding"
+
+def stage_requests_per_record(stage_name: str, demand: Dict[str, ServiceDemand]) -> float:
+    if stage_name == "describe":
+        return 1 / get_settings().describe_images_per_request
+    if stage_name == "text_embedding":
+        # 每个请求是一批 chunk
+        return demand[service_for_stage(stage_name)].requests
+    return 1.0
+
+def estimate_image_demand() -> Dict[str, ServiceDemand]:
+    settings = get_settings()
+    encoding = get_encoding()
+    images_per_request = settings.describe_images_per_request
+    prompt = DESCRIBE_PROMPT if images_per_request == 1 else MULTI_IMAGE_PROMPT
+    prompt_tokens = len(encoding.encode(SYSTEM_PROMPT)) + len(encoding.encode(prompt))
+    demand = {service: ServiceDemand() for service in DEFAULT_LATENCIES}
+    demand["download"].requests = 1
+    demand["chat"].requests = 1 / images_per_request
+    demand["chat"].tokens = prompt_tokens / images_per_request + IMAGE_TOKENS + MAX_TOKENS_PER_IMAGE
+    demand["ocr"].requests = 1
+    embedding_tokens = CV_CAPTION_TOKENS + DESCRIBE_OUTPUT_TOKENS + OCR_TOKENS + CV_CAPTION_TOKENS
+    text_vector_requests = 1 if settings.text_vector_mode == "fused" else 3
+    for stage_name in ("caption", "image_vector"):
+        demand[service_for_stage(stage_name)].requests += 1
+    demand[service_for_stage("content_vector")].requests += text_vector_requests
+    demand[service_for_stage("content_vector")].tokens += min(embedding_tokens, settings.fused_text_max_tokens)
+    return demand
+
+def estimate_text_post_demand(file_path: str, sample_lines: int) -> Dict[str, ServiceDemand]:
+    settings = get_settings()
+    posts = parse_text_posts(file_path, 0, sample_lines)
+    chunks = build_text_chunks(posts, settings.text_chunk_tokens, settings.text_chunk_overlap)
+    encoding = get_encoding()
+    tokens = sum(len(encoding.encode(f"{chunk.title}\n{chunk.content}")) for chunk in chunks)
+    demand = {service: ServiceDemand() for service in DEFAULT_LATENCIES}
+    service = service_for_stage("text_embedding")
+    demand[service].requests = math.ceil(len(chunks) / settings.text_embedding_batch_size) / max(len(posts), 1)
+    demand[service].tokens = tokens / max(len(posts), 1)
+    return demand
+
+def build_plan_scheduler(text_posts: bool) -> StageScheduler:
+    # 和真实运行同一个 stage 依赖图
+    if text_posts:
+        return StageScheduler([Stage("text_embedding", None, concurrency=get_settings().stage_concurrency["text_embedding"])])
+    return build_record_scheduler()
+
+
+def quota_rates(demand: Dict[str, ServiceDemand], quotas: Dict[str, Quota]) -> Dict[str, float]:
+    rates = {}
+    for service, need in demand.items():
+        quota = quotas.get(service)
+        if quota is None or need.requests == 0:
+            continue
+        limits = []
+        if quota.requests_per_second:
+            limits.append(quota.requests_per_second / need.requests)
+        if quota.tokens_per_second and need.tokens:
+            limits.append(quota.tokens_per_second / need.tokens)
+        if limits:
+            rates[service] = min(limits) * QUOTA_HEADROOM
+    return rates
+
+def critical_path_seconds(scheduler: StageScheduler, latencies: Dict[str, float]) -> float:
+    finish = {}
+    for stage in scheduler.order:
+        start = max((finish[dependency] for dependency in stage.dependencies), default=0.0)
+        finish[stage.name] = start + latencies[service_for_stage(stage.name)]
+    return max(finish.values())
+
+def predict(scheduler: StageScheduler, demand: Dict[str, ServiceDemand], latencies: Dict[str, float], rates: Dict[str, float],
+            stage_concurrency: Dict[str, int], workers: int) -> Dict[str, float]:
+    # 每个限制对应的记录吞吐（条/秒），最小的就是瓶颈
+    limits = {f"quota:{service}": rate for service, rate in rates.items()}
+    for stage in scheduler.order:
+        latency = latencies[service_for_stage(stage.name)] * stage_requests_per_record(stage.name, demand)
+        limits[f"stage:{stage.name}"] = stage_concurrency[stage.name] * workers / latency
+    limits["items_in_flight"] = scheduler.max_items_in_flight * workers / critical_path_seconds(scheduler, latencies)
+    return limits
+
+def recommend(scheduler: StageScheduler, demand: Dict[str, ServiceDemand], latencies: Dict[str, float], rates: Dict[str, float],
+              record_count: int, max_workers: int) -> dict:
+    target_rate = min(rates.values()) if rates else None
+    if target_rate is None:
+        # 没有任何配额限制（全部本地），按当前设置的并发跑满 max_workers
+        return {"workers": max_workers, "stage_concurrency": dict(get_settings().stage_concurrency), "target_rate": None,
+                "lines_per_chunk": max(math.ceil(record_count / (4 * max_workers)), 1)}
+    # Little 定律: 在途请求数 = 吞吐 * 每条记录的请求数 * 延迟
+    totals = {stage.name: max(math.ceil(target_rate * stage_requests_per_record(stage.name, demand) * latencies[service_for_stage(stage.name)]), 1)
+              for stage in scheduler.order}
+    workers = max(math.ceil(sum(totals.values()) / MAX_CONCURRENCY_PER_WORKER),
+                  math.ceil(target_rate * critical_path_seconds(scheduler, latencies) / scheduler.max_items_in_flight), 1)
+    workers = min(workers, max_workers)
+    stage_concurrency = {name: max(math.ceil(total / workers), 1) for name, total in totals.items()}
+    lines_per_chunk = max(min(math.ceil(target_rate / workers * CHUNK_TARGET_SECONDS), math.ceil(record_count / (4 * workers))), 1)
+    return {"workers": workers, "stage_concurrency": stage_concurrency, "target_rate": target_rate, "lines_per_chunk": lines_per_chunk}
+
+
+class MockService:
+    """Sleeps for the service latency and returns 429 when the request or token bucket is empty."""
+
+    def __init__(self, latency: float, quota: Optional[Quota], burst_seconds: float):
+        self.latency = latency
+        self.requests_per_second = quota.requests_per_second if quota else None
+        self.tokens_per_second = quota.tokens_per_second if quota else None
+        # 桶的容量是 burst_seconds 的配额
+        self.request_capacity = max((self.requests_per_second or 0.0) * burst_seconds, 1.0)
+        self.token_capacity = (self.tokens_per_second or 0.0) * burst_seconds
+        self.request_bucket = self.request_capacity
+        self.token_bucket = self.token_capacity
+        self.refilled = time.monotonic()
+        self.throttled = 0
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self.refilled
+        self.refilled = now
+        if self.requests_per_second:
+            self.request_bucket = min(self.request_bucket + elapsed * self.requests_per_second, self.request_capacity)
+        if self.tokens_per_second:
+            self.token_bucket = min(self.token_bucket + elapsed * self.tokens_per_second, self.token_capacity)
+
+    async def call(self, tokens: float, time_scale: float):
+        while True:
+            self._refill()
+            if (self.requests_per_second and self.request_bucket < 1) or (self.tokens_per_second and self.token_bucket < min(tokens, self.token_capacity)):
+                self.throttled += 1
+                await asyncio.sleep(MOCK_RETRY_AFTER * time_scale)
+                continue
+            self.request_bucket -= 1
+            # 比桶还大的请求在桶满时放行，桶变成负数
+            self.token_bucket -= tokens
+            break
+        await asyncio.sleep(self.latency * random.uniform(0.5, 1.5) * time_scale)
+
+async def run_mock(plan: dict, text_posts: bool, demand: Dict[str, ServiceDemand], quotas: Dict[str, Quota],
+                   latencies: Dict[str, float], record_count: int, time_scale: float) -> dict:
+    # 模拟一个 worker: 配额按 worker 数平分，时间按 time_scale 缩放（配额相应放大）
+    workers = plan["workers"]
+    services = {}
+    for service, latency in latencies.items():
+        quota = quotas.get(service)
+        if quota is not None:
+            quota = Quota(quota.requests_per_second and quota.requests_per_second / workers / time_scale,
+                          quota.tokens_per_second and quota.tokens_per_second / workers / time_scale)
+        services[service] = MockService(latency, quota, MOCK_BURST_SECONDS * time_scale)
+
+    def mock_stage(stage_name: str):
+        service = service_for_stage(stage_name)
+        # 每个请求的平均 token 数
+        tokens = demand[service].tokens / demand[service].requests if demand[service].requests else 0.0
+
+        async def call(item, **inputs):
+            # describe 多图合并时，只有一部分记录真正发请求
+            if random.random() < stage_requests_per_record(stage_name, demand):
+                await services[service].call(tokens, time_scale)
+        return call
+
+    stages = list(build_plan_scheduler(text_posts).stages.values())
+    for stage in stages:
+        stage.func = mock_stage(stage.name)
+        stage.concurrency = plan["stage_concurrency"][stage.name]
+    scheduler = StageScheduler(stages)
+    start = time.monotonic()
+    await scheduler.run(list(range(record_count)))
+    seconds = (time.monotonic() - start) / time_scale
+    return {"records": record_count, "seconds": seconds, "rate": record_count / seconds,
+            "throttled": {service: mock.throttled for service, mock in services.items() if mock.throttled}}
+
+
+def format_seconds(seconds: float) -> str:
+    return time.strftime("%H:%M:%S", time.gmtime(seconds)) if seconds < 86400 else f"{seconds / 86400:.1f} days"
+
+def plan_job(file_path: str, limitation_path: str, latencies_path: Optional[str], workers: int, max_workers: int,
+             sample_lines: int, mock_records: int, time_scale: float):
+    settings = get_settings()
+    record_count = LineIndex.load_or_build(file_path).line_count
+    text_posts = is_text_post_file(file_path)
+    demand = estimate_text_post_demand(file_path, sample_lines) if text_posts else estimate_image_demand()
+    quotas = scale_quotas(parse_limitation_info(limitation_path))
+    latencies = load_latencies(latencies_path)
+    scheduler = build_plan_scheduler(text_posts)
+    rates = quota_rates(demand, quotas)
+
+    print(f"{file_path}: {record_count} {'text posts' if text_posts else 'image records'}, embedding backend {get_embedding_backend().name}")
+    print(f"{'service':<10} {'req/rec':>8} {'tok/rec':>8} {'quota rps':>10} {'quota tps':>10} {'latency':>8} {'max rec/s':>10}")
+    for service, need in demand.items():
+        if need.requests == 0:
+            continue
+        quota = quotas.get(service, Quota())
+        print(f"{service:<10} {need.requests:>8.2f} {need.tokens:>8.0f} {quota.requests_per_second or 0:>10.1f} "
+              f"{quota.tokens_per_second or 0:>10.0f} {latencies[service]:>7.2f}s {rates.get(service, float('inf')):>10.2f}")
+
+    current = predict(scheduler, demand, latencies, rates, settings.stage_concurrency, workers)
+    bottleneck = min(current, key=current.get)
+    print(f"\nCurrent settings ({workers} workers, lines_per_chunk={settings.lines_per_chunk}): "
+          f"{current[bottleneck]:.2f} records/s, {format_seconds(record_count / current[bottleneck])}, bottleneck {bottleneck}")
+    for service, rate in rates.items():
+        # 当前并发下每秒最多发出的请求数和配额比较，超出太多时 AIMD 会把并发降下来，但开始阶段会有大量 429
+        offered = sum(settings.stage_concurrency[stage.name] * workers / latencies[service] for stage in scheduler.order if service_for_stage(stage.name) == service)
+        allowed = rate / QUOTA_HEADROOM * demand[service].requests
+        if offered > 2 * allowed:
+            print(f"  {service} stages can send {offered / allowed:.0f}x its request quota, expect 429s")
+
+    plan = recommend(scheduler, demand, latencies, rates, record_count, max_workers)
+    planned = predict(scheduler, demand, latencies, rates, plan["stage_concurrency"], plan["workers"])
+    bottleneck = min(planned, key=planned.get)
+    print(f"Recommended ({plan['workers']} workers, lines_per_chunk={plan['lines_per_chunk']}): "
+          f"{planned[bottleneck]:.2f} records/s, {format_seconds(record_count / planned[bottleneck])}, bottleneck {bottleneck}")
+    print(f"  stage_concurrency=\"{','.join(f'{name}={value}' for name, value in plan['stage_concurrency'].items())}\"")
+    print(f"  lines_per_chunk={plan['lines_per_chunk']}")
+    print(f"  python batchDataProcess.py --file {file_path} --max-workers {plan['workers']}")
+
+    if mock_records:
+        result = asyncio.run(run_mock(plan, text_posts, demand, quotas, latencies, mock_records, time_scale))
+        expected = planned[bottleneck] / plan["workers"]
+        print(f"\nMock run, one worker, {result['records']} records: {result['rate']:.2f} records/s "
+              f"(predicted {expected:.2f}, {result['rate'] / expected - 1:+.0%}), 429s: {result['throttled'] or 'none'}")
+    return plan
+
+
+if __name__ == "__main__":
+    # 示例调用: python capacityPlanner.py multiModelGameTestData/img_files.txt --mock 300
+    parser = argparse.ArgumentParser(description="Estimate wall-clock time, bottleneck and worker/concurrency settings for an ingestion job.")
+    parser.add_argument("file_path", help="input file, image records or text posts")
+    parser.add_argument("--limitation", default="limitation_error/limitation.info", help="service quotas")
+    parser.add_argument("--latencies", help="measured latencies: {service: seconds} or the JSON of queryService /metrics")
+    parser.add_argument("--workers", type=int, default=16, help="worker count of the current settings")
+    parser.add_argument("--max-workers", type=int, default=64, help="upper bound for the recommended worker count")
+    parser.add_argument("--sample-lines", type=int, default=2000, help="text posts to tokenize for the per-record estimate")
+    parser.add_argument("--mock", type=int, default=0, metavar="RECORDS", help="validate the plan with a simulated run of one worker")
+    parser.add_argument("--time-scale", type=float, default=0.01, help="mock run time factor, 0.01 runs 100x faster")
+    args = parser.parse_args()
+
+    plan_job(args.file_path, args.limitation, args.latencies, args.workers, args.max_workers, args.sample_lines, args.mock, args.time_scale)
@@ -0,0 +1,25 @@
+"""Round-robin over the Computer Vision endpoints shared by image embedding and captioning."""
+import functools
+from typing import List
+
+from settings import CvEndpoint, get_settings
+
+
+class CvEndpointPool:
+    def __init__(self, endpoints: List[CvEndpoint]):
+        if not endpoints:
+            raise ValueError("No Computer Vision endpoints configured (AZURE_COMPUTER_VISION_ENDPOINT1..3)")
+        self.endpoints = list(endpoints)
+        # 当前使用的索引，初始为0
+        self.endpoint_index = 0
+
+    def next_endpoint(self) -> CvEndpoint:
+        # 事件循环是单线程的，这里没有 await，不需要加锁
+        endpoint = self.endpoints[self.endpoint_index]
+        self.endpoint_index = (self.endpoint_index + 1) % len(self.endpoints)  # 轮询下一个端点
+        return endpoint
+
+
+@functools.lru_cache(maxsize=None)
+def get_cv_endpoint_pool() -> CvEndpointPool:
+    return CvEndpointPool(get_settings().cv_endpoints)
@@ -1,64 +1,147 @@
 import argparse
 import asyncio
 import dataclasses
-import os
 import sys
+import time
 
 from azure.core.credentials import AzureKeyCredential
 from azure.identity import AzureDeveloperCliCredential
 from azure.search.documents.aio import SearchClient
 from azure.search.documents.indexes import SearchIndexClient
-from dotenv import load_dotenv
 from tqdm import tqdm
 
-# 加载 .env 文件中的环境变量
-load_dotenv()
-
-from data_utils import process_images_records
-
-
-async def process_data_file(file_path:str,search_client:SearchClient):
-    recordResult = await process_images_records(file_path= file_path)
-
-    if len(recordResult.documentList) == 0:
+from adaptiveConcurrency import limiter_metrics
+from artifactStore import ArtifactStore, shard_name_for
+from batchApiProcess import process_images_records_by_batch
+from data_utils import enrich_image_records, parse_image_records
+from gamePartition import get_game_classifier
+from indexState import IndexStateStore, compute_fingerprint, plan_incremental
+from profiling import create_profiler, merge_profiles, run_profiled
+from searchUpload import SearchUploader
+from settings import configure_logging, get_settings
+from vectorFieldOptions import round_vector_for_upload
+
+
+async def process_data_file(file_path:str,search_client:SearchClient,use_batch_api:bool=False,incremental:bool=False,start_line:int=0,end_line:int=None):
+    image_data_list = parse_image_records(file_path, start_line, end_line)
+
+    if incremental:
+        # 只处理新增或者变化的记录
+        state_store = IndexStateStore()
+        plan = plan_incremental(image_data_list, state_store)
+        image_data_list = plan.to_enrich
+
+    if use_batch_api:
+        # 离线模式：gpt-4o 描述和 embedding 走 Batch API 的配额和价格
+        recordResult = await process_images_records_by_batch(image_data_list, get_settings().pdf_dir)
+    else:
+        recordResult = await enrich_image_records(image_data_list)
+
+    if len(recordResult.documentList) == 0 and not incremental:
         raise Exception("No records found. Please check the data path and records.")
 
     print(f"Processed file {file_path}")
     print(f"Processed {recordResult.totalRecords} records")
     print(f"records with errors: {len(recordResult.failedImageList)} records")
     print(f"valid records: {len(recordResult.documentList)} documents")
+    for metrics in limiter_metrics():
+        print(f"{metrics['service']}: concurrency limit {metrics['limit']}, average latency {metrics['latency_average_ms']} ms, {metrics['overloads']} overloads")
+
+    # 先保存 enrichment 结果，上传失败或者以后重建索引时不需要重新调用模型
+    if get_settings().artifact_dir:
+        save_artifacts(recordResult.documentList, plan.to_patch if incremental else [], shard_name_for(file_path, start_line, end_line), incremental)
 
     # upload documents to index
     print("Uploading documents to index...")
-    await upload_documents_to_index(recordResult.documentList, search_client)
+    await upload_documents_to_index(recordResult.documentList, search_client, action="mergeOrUpload" if incremental else "upload")
 
-    return recordResult
-
-async def upload_documents_to_index(docs, search_client:SearchClient, upload_batch_size=50):
-    to_upload_dicts = []
-
-    for document in docs:
-        d = dataclasses.asdict(document)
-        # add id to documents
-        d.update({"@search.action": "upload", "id": str(d["id"])})
+    if incremental:
+        print(f"caption only changes: {len(plan.to_patch)} records, unchanged: {len(plan.unchanged)} records")
+        await patch_captions_in_index(plan.to_patch, search_client)
+        # 失败的记录不写入状态，下次运行会重新处理
+        failed_ids = {item.id for item in recordResult.failedImageList}
+        state_store.upsert([item for item in image_data_list if item.id not in failed_ids] + plan.to_patch)
+        state_store.close()
 
-        if "captionVector" in d and d["captionVector"] is None:
-            del d["captionVector"]
-        if "contentVector" in d and d["contentVector"] is None:
-            del d["contentVector"]
-        if "ocrContentVecotor" in d and d["ocrContentVecotor"] is None:
-            del d["ocrContentVecotor"]
-        if "imageVecotor" in d and d["imageVecotor"] is None:
-            del d["imageVecotor"]
-
-        to_upload_dicts.append(d)
+    return recordResult
 
+def save_artifacts(documents, patched_items, shard_name:str, incremental:bool=False):
+    store = ArtifactStore()
+    if incremental:
+        # 增量结果只包含变化的记录，不能覆盖这个 chunk 之前的完整结果
+        shard_name = f"{shard_name}-{int(time.time())}"
+    shard_path = store.save(documents, shard_name)
+    store.save_patches([caption_patch(item) for item in patched_items],
+                       f"{shard_name}-patch")
+    if shard_path:
+        print(f"Saved {len(documents)} enriched documents to {shard_path}")
+
+async def upload_documents_to_index(docs, search_client:SearchClient, upload_batch_size=50, action="upload"):
+    to_upload_dicts = [document_to_upload_dict(document, action) for document in docs]
+    await index_documents_in_batches(to_upload_dicts, search_client, upload_batch_size)
+
+def document_to_upload_dict(document, action="upload") -> dict:
+    d = dataclasses.asdict(document)
+    # add id to documents
+    d.update({"@search.action": action, "id": str(d["id"])})
+
+    if "captionVector" in d and d["captionVector"] is None:
+        del d["captionVector"]
+    if "contentVector" in d and d["contentVector"] is None:
+        del d["contentVector"]
+    if "ocrContentVecotor" in d and d["ocrContentVecotor"] is None:
+        del d["ocrContentVecotor"]
+    if "imageVecotor" in d and d["imageVecotor"] is None:
+        del d["imageVecotor"]
+    if "fingerprint" in d and d["fingerprint"] is None:
+        del d["fingerprint"]
+    if "fusedTextVector" in d and d["fusedTextVector"] is None:
+        del d["fusedTextVector"]
+
+    # 和索引里的向量类型保持一致
+    for vector_field in ("captionVector", "contentVector", "ocrContentVecotor", "imageVecotor", "fusedTextVector"):
+        if vector_field in d:
+            d[vector_field] = round_vector_for_upload(d[vector_field])
+
+    return d
+
+def caption_patch(item) -> dict:
+    # game 由 caption 分类得到，caption 变化时一起更新
+    return {"id": str(item.id), "caption": item.caption, "fingerprint": compute_fingerprint(item), "game": get_game_classifier().classify(item.caption)}
+
+async def patch_captions_in_index(items, search_client:SearchClient, upload_batch_size=50):
+    # caption 是普通文本字段，不参与任何向量，merge 即可，不需要重新 enrichment
+    to_merge_dicts = [{"@search.action": "merge", **caption_patch(item)} for item in items]
+    await index_documents_in_batches(to_merge_dicts, search_client, upload_batch_size)
+
+async def delete_documents_from_index(ids, search_client:SearchClient, upload_batch_size=50):
+    to_delete_dicts = [{"@search.action": "delete", "id": str(record_id)} for record_id in ids]
+    await index_documents_in_batches(to_delete_dicts, search_client, upload_batch_size)
+
+async def index_documents_in_batches(to_upload_dicts, search_client:SearchClient, upload_batch_size=50):
+    if get_settings().upload_serializer == "fast":
+        # 自己序列化并压缩请求体，每个文档的 @search.action 由 REST 接口直接处理
+        async with SearchUploader.for_client(search_client) as uploader:
+            await send_batches(to_upload_dicts, uploader.upload, upload_batch_size)
+        if uploader.stats.batches:
+            print(uploader.stats.summary())
+        return
+
+    actions = {
+        "upload": search_client.upload_documents,
+        "mergeOrUpload": search_client.merge_or_upload_documents,
+        "merge": search_client.merge_documents,
+        "delete": search_client.delete_documents,
+    }
+    await send_batches(to_upload_dicts, lambda batch: actions[batch[0]["@search.action"]](documents=batch), upload_batch_size)
+
+async def send_batches(to_upload_dicts, send_batch, upload_batch_size=50):
     # Upload the documents in batches of upload_batch_size
     for i in tqdm(
         range(0, len(to_upload_dicts), upload_batch_size), desc="Indexing Chunks..."
     ):
         batch = to_upload_dicts[i : i + upload_batch_size]
-        results =  await search_client.upload_documents(documents=batch)
+        results =  await send_batch(batch)
         num_failures = 0
         errors = set()
         for result in results:
@@ -75,16 +158,34 @@ async def upload_documents_to_index(docs, search_client:SearchClient, upload_bat
             )
 
 if __name__ == "__main__":
-    file_path = sys.argv[1]  # 获取文件路径参数
-    search_creds = AzureKeyCredential(os.getenv("AZURE_COGNITIVE_SEARCH_KEY"))
-    searchservice = os.getenv("AZURE_SEARCH_SERVICE")
-    index_name = os.getenv("AZURE_SEARCH_INDEX")
+    parser = argparse.ArgumentParser(description="Enrich a records file and upload it to the search index.")
+    parser.add_argument("file_path", help="records file to process")
+    parser.add_argument("--batch-api", action="store_true", help="use Azure OpenAI Batch API for gpt-4o descriptions and embeddings")
+    parser.add_argument("--incremental", action="store_true", help="only enrich and upload new or changed records")
+    parser.add_argument("--start-line", type=int, default=0, help="first line of the chunk to process")
+    parser.add_argument("--end-line", type=int, default=None, help="line after the last line of the chunk to process")
+    parser.add_argument("--profile", action="store_true", help="sample stacks and event-loop lag, write collapsed stacks to profile_dir")
+    parser.add_argument("--profile-dir", help="profile output directory, defaults to profile_dir; batchDataProcess.py merges it at the end")
+    args = parser.parse_args()
+    file_path = args.file_path  # 获取文件路径参数
+    configure_logging()
+    settings = get_settings()
+    search_creds = AzureKeyCredential(settings.search_key)
+    index_name = settings.search_index
     print("Data preparation script started")
-    print("Preparing data for index:", os.getenv("AZURE_SEARCH_INDEX"))
-    search_endpoint = f"https://{searchservice}.search.windows.net/"
+    print("Preparing data for index:", index_name)
+    search_endpoint = settings.search_endpoint
     index_client = SearchIndexClient(endpoint=search_endpoint, credential=search_creds)
 
     search_client = SearchClient(endpoint=search_endpoint, credential=search_creds, index_name=index_name)
 
-    asyncio.run(process_data_file(file_path, search_client))
+    run = process_data_file(file_path, search_client, args.batch_api, args.incremental, args.start_line, args.end_line)
+    if args.profile or args.profile_dir:
+        profiler = create_profiler(f"dataProcess-{args.start_line}", args.profile_dir)
+        asyncio.run(run_profiled(run, profiler))
+        if not args.profile_dir:
+            # 单独运行时直接合并，批量运行由 batchDataProcess.py 合并所有 worker
+            merge_profiles(profiler.output_dir)
+    else:
+        asyncio.run(run)
     print("Data preparation for index", index_name, "completed")
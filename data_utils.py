@@ -1,114 +1,128 @@
-"""Data utilities for index preparation."""
-import asyncio
-
-from multiModelsEmbedding import get_picture_embedding
-from multiModelsPictureProcess import get_content_by_mulit_model
-from objectDefinition import Document, ImageData, RecordResult
-from pictureFormatProcess import download_and_save_as_pdf
-from pictureOcrProcess import analyze_document, get_image_caption_byCV
-from textEmbeddingProcess import get_text_embedding
-from dotenv import load_dotenv
-import os
-
-# 加载 .env 文件中的环境变量
-load_dotenv()
-
-pdf_dir = os.getenv("pdf_dir")
-
-async def process_images_records(file_path: str)->RecordResult:
-    
-    documents = []
-    errorRecords = []
-    image_data_list = []
-
-    try:
-        # Read the file
-        with open(file_path, 'r', encoding='utf-8') as file:
-            for line in file:
-                try:
-                    # Manually parse the line to extract fields
-                    line = line.strip()
-                    id_start = line.find("'id': '") + len("'id': '")
-                    id_end = line.find("',", id_start)
-                    image_id = line[id_start:id_end]
-
-                    image_url_start = line.find("'imageUrl': '") + len("'imageUrl': '")
-                    image_url_end = line.find("',", image_url_start)
-                    image_url = line[image_url_start:image_url_end]
-
-                    caption_start = line.find("'caption': '") + len("'caption': '")
-                    caption_end = line.rfind("'}")
-                    caption = line[caption_start:caption_end]
-
-                    # Escape special characters
-                    image_id = image_id.replace("'", "\\'")
-                    image_url = image_url.replace("'", "\\'")
-                    caption = caption.replace("'", "\\'")
-
-                    # Create an ImageData object
-                    image_data = ImageData(id=image_id, imageUrl=image_url, caption=caption)
-                    # Add the object to the list
-                    image_data_list.append(image_data)
-                except Exception as e:
-                    print(f"Error processing line: {line}")
-                    print(f"Error message: {e}")
-    except Exception as e:
-        print(f"Error processing file: {file_path}")
-        raise e
-    
-    recordResult = RecordResult(documentList=documents, failedImageList=errorRecords, totalRecords=len(image_data_list))
-
-    for item in image_data_list:
-        try:
-            id = item.id
-            url = item.imageUrl
-            caption = item.caption
-
-            # create async tasks 
-            content_task = asyncio.create_task(get_content_by_mulit_model(url))
-            pdf_task = asyncio.create_task(download_and_save_as_pdf(url, pdf_dir))
-            caption_task = asyncio.create_task(get_image_caption_byCV(url))
-            image_embedding_task = asyncio.create_task(get_picture_embedding(url))
-
-            # wait for all tasks to complete
-            content = await content_task
-            pdfFileLocalPath = await pdf_task
-            captionByCV = await caption_task
-            imageVector = await image_embedding_task
-
-            # generate OCR content
-            ocrContent = await analyze_document(pdfFileLocalPath)
-
-            # get text embeddings task
-            captionVector_task = asyncio.create_task(get_text_embedding(captionByCV))
-            contentVector_task = asyncio.create_task(get_text_embedding(content))
-            ocrContentVector_task = asyncio.create_task(get_text_embedding(ocrContent + captionByCV))
-
-            # wait for all tasks to complete
-            captionVector = await captionVector_task
-            contentVector = await contentVector_task
-            ocrContentVector = await ocrContentVector_task
-            
-            # create a Document object and add it to the list
-            document = Document( id=id, 
-                                imageUrl=url, 
-                                caption=caption, 
-                                content=content, 
-                                ocrContent=ocrContent, 
-                                captionVector=captionVector, 
-                                contentVector=contentVector, 
-                                ocrContentVecotor=ocrContentVector, 
-                                imageVecotor=imageVector)
-        
-            documents.append(document)
-        except Exception as e:
-            print(f"Error processing record: {item.id}")
-            print(f"Error message: {e}")
-            errorRecords.append(item)
-
-    return recordResult
-
-if __name__ == "__main__":
-    # 示例调用
-    recordResult = asyncio.run(process_images_records("multi-models/image_captions/ima_files_2_test.txt"))    
+"""Data utilities for index preparation."""
+import asyncio
+import logging
+
+from embeddingBackend import get_embedding_backend
+from fusedTextVector import build_fused_text
+from gamePartition import get_game_classifier
+from indexState import compute_fingerprint
+from lineIndex import read_line_range
+from multiModelsPictureProcess import MultiImageDescriber, get_content_by_mulit_model
+from objectDefinition import Document, ImageData, RecordResult
+from pictureFormatProcess import download_and_save_as_pdf
+from pictureOcrProcess import analyze_document, get_image_caption_byCV
+from settings import get_settings
+from stageScheduler import Stage, StageScheduler
+from structuredLogging import Truncated
+from typing import List, Optional
+
+def build_record_scheduler(image_data_list: Optional[List[ImageData]] = None) -> StageScheduler:
+    # 每个 stage 只等待自己的输入，例如 caption 的 embedding 不需要等 OCR 完成
+    settings = get_settings()
+    backend = get_embedding_backend()
+    describe_stage = Stage("describe", lambda item: get_content_by_mulit_model(item.imageUrl))
+    describer = None
+    if settings.describe_images_per_request > 1 and image_data_list:
+        # 同一帖子的多张图片合并成一个请求，请求并发由 describer 控制；等待同组结果的记录不应该占用请求名额
+        describer = MultiImageDescriber(image_data_list, settings.describe_images_per_request, settings.stage_concurrency["describe"])
+        describe_stage = Stage("describe", describer.describe)
+    stages = [
+        Stage("download", lambda item: download_and_save_as_pdf(item.imageUrl, settings.pdf_dir)),
+        describe_stage,
+        Stage("caption", lambda item: get_image_caption_byCV(item.imageUrl)),
+        Stage("image_vector", lambda item: backend.embed_image(item.imageUrl)),
+        Stage("ocr", lambda item, download: analyze_document(download), ["download"]),
+    ]
+    if settings.text_vector_mode == "fused":
+        # 融合模式每条记录只调用一次 embedding
+        stages.append(Stage("fused_vector", lambda item, caption, describe, ocr: backend.embed_text(build_fused_text(caption, describe, ocr)), ["caption", "describe", "ocr"]))
+    else:
+        stages += [
+            Stage("caption_vector", lambda item, caption: backend.embed_text(caption), ["caption"]),
+            Stage("content_vector", lambda item, describe: backend.embed_text(describe), ["describe"]),
+            Stage("ocr_vector", lambda item, ocr, caption: backend.embed_text(ocr + caption), ["ocr", "caption"]),
+        ]
+    for stage in stages:
+        stage.concurrency = settings.stage_concurrency[stage.name]
+    if describer is not None:
+        describe_stage.concurrency *= settings.describe_images_per_request
+    return StageScheduler(stages, item_id=lambda item: item.id)
+
+def parse_image_records(file_path: str, start_line: int = 0, end_line: Optional[int] = None) -> List[ImageData]:
+    image_data_list = []
+
+    try:
+        # Read the file, only lines in [start_line, end_line) when a range is given (seek through the line index)
+        for line in read_line_range(file_path, start_line, end_line):
+            try:
+                # Manually parse the line to extract fields
+                line = line.strip()
+                id_start = line.find("'id': '") + len("'id': '")
+                id_end = line.find("',", id_start)
+                image_id = line[id_start:id_end]
+
+                image_url_start = line.find("'imageUrl': '") + len("'imageUrl': '")
+                image_url_end = line.find("',", image_url_start)
+                image_url = line[image_url_start:image_url_end]
+
+                caption_start = line.find("'caption': '") + len("'caption': '")
+                caption_end = line.rfind("'}")
+                caption = line[caption_start:caption_end]
+
+                # Escape special characters
+                image_id = image_id.replace("'", "\\'")
+                image_url = image_url.replace("'", "\\'")
+                caption = caption.replace("'", "\\'")
+
+                # Create an ImageData object
+                image_data = ImageData(id=image_id, imageUrl=image_url, caption=caption)
+                # Add the object to the list
+                image_data_list.append(image_data)
+            except Exception as e:
+                logging.error("Error processing line %s: %s", Truncated(line, 200), e)
+    except Exception as e:
+        print(f"Error processing file: {file_path}")
+        raise e
+
+    return image_data_list
+
+async def process_images_records(file_path: str)->RecordResult:
+    return await enrich_image_records(parse_image_records(file_path))
+
+async def enrich_image_records(image_data_list: List[ImageData])->RecordResult:
+    
+    documents = []
+    errorRecords = []
+    
+    recordResult = RecordResult(documentList=documents, failedImageList=errorRecords, totalRecords=len(image_data_list))
+
+    results = await build_record_scheduler(image_data_list).run(image_data_list)
+
+    for item, result in results:
+        if isinstance(result, Exception):
+            logging.error("Error processing record %s: %s", item.id, Truncated(result, 500))
+            errorRecords.append(item)
+            continue
+
+        # create a Document object and add it to the list
+        document = Document( id=item.id, 
+                            imageUrl=item.imageUrl, 
+                            caption=item.caption, 
+                            content=result["describe"], 
+                            ocrContent=result["ocr"], 
+                            captionVector=result.get("caption_vector"), 
+                            contentVector=result.get("content_vector"), 
+                            ocrContentVecotor=result.get("ocr_vector"), 
+                            imageVecotor=result["image_vector"],
+                            fingerprint=compute_fingerprint(item),
+                            fusedTextVector=result.get("fused_vector"),
+                            game=get_game_classifier().classify(item.caption))
+
+        documents.append(document)
+
+    return recordResult
+
+if __name__ == "__main__":
+    # 示例调用
+    recordResult = asyncio.run(process_images_records("multi-models/image_captions/ima_files_2_test.txt"))    
     print("recordResult: {}",recordResult)
\ No newline at end of file
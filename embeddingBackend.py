@@ -0,0 +1,208 @@
+"""Embedding backends: the metered Azure services, or local sentence-transformers models on CPU.
+
+The pipeline needs two vector spaces:
+
+    text   captionVector / contentVector / ocrContentVecotor / fusedTextVector (Azure OpenAI)
+    image  imageVecotor and the text query against it (Computer Vision multimodal)
+
+embedding_backend=local encodes text with the model at local_text_model_path and images with
+the CLIP-style model at local_image_model_path. Text queries against images go through
+local_image_text_model_path when set (e.g. a multilingual text encoder aligned to the CLIP
+image space), otherwise through the CLIP model itself. The models are loaded from disk once
+per worker process; single requests from the pipeline stages are collected into batches of
+local_embedding_batch_size before they are sent to the pool. Index dimensions in prepdocs
+come from the selected backend; the local ones are probed in the pool, so async callers read
+them from a thread. batchApiProcess encodes its text fields with the local models too.
+"""
+import asyncio
+import functools
+import logging
+import multiprocessing
+import os
+from abc import ABC, abstractmethod
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List
+
+from multiModelsEmbedding import get_picture_embedding, get_text_embedding_by_computer_vision
+from pictureFormatProcess import download_image_bytes
+from settings import get_settings
+from textEmbeddingProcess import get_text_embedding, get_text_embeddings
+
+AZURE_TEXT_DIMENSIONS = 1536
+AZURE_IMAGE_DIMENSIONS = 1024
+# 单条请求最多等待多久凑成一批
+BATCH_WAIT_SECONDS = 0.02
+
+# worker 进程里加载的模型: text | image | image_text
+_models = {}
+
+
+class EmbeddingBackend(ABC):
+    name = ""
+    # 索引是否可以配置服务端 vectorizer（Azure OpenAI / Computer Vision）
+    supports_vectorizers = False
+
+    @property
+    @abstractmethod
+    def text_dimensions(self) -> int:
+        ...
+
+    @property
+    @abstractmethod
+    def image_dimensions(self) -> int:
+        ...
+
+    @abstractmethod
+    async def embed_texts(self, texts: List[str]) -> List[List[float]]:
+        ...
+
+    @abstractmethod
+    async def embed_image(self, image_url: str) -> List[float]:
+        ...
+
+    @abstractmethod
+    async def embed_image_space_text(self, text: str) -> List[float]:
+        # 和图片向量在同一个空间的文本向量，用于文本查图片
+        ...
+
+    async def embed_text(self, text: str) -> List[float]:
+        return (await self.embed_texts([text]))[0]
+
+
+class AzureEmbeddingBackend(EmbeddingBackend):
+    name = "azure"
+    supports_vectorizers = True
+
+    @property
+    def text_dimensions(self) -> int:
+        return AZURE_TEXT_DIMENSIONS
+
+    @property
+    def image_dimensions(self) -> int:
+        return AZURE_IMAGE_DIMENSIONS
+
+    async def embed_text(self, text: str) -> List[float]:
+        return await get_text_embedding(text)
+
+    async def embed_texts(self, texts: List[str]) -> List[List[float]]:
+        return await get_text_embeddings(texts)
+
+    async def embed_image(self, image_url: str) -> List[float]:
+        return await get_picture_embedding(image_url)
+
+    async def embed_image_space_text(self, text: str) -> List[float]:
+        return await get_text_embedding_by_computer_vision(text)
+
+
+def load_models(model_paths: Dict[str, str], torch_threads: int):
+    # worker 进程的 initializer，每个进程只加载一次模型
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    torch.set_num_threads(torch_threads)
+    for kind, path in model_paths.items():
+        _models[kind] = SentenceTransformer(path, device="cpu")
+
+def encode_batch(kind: str, payloads: list) -> List[List[float]]:
+    if kind == "image":
+        from io import BytesIO
+
+        from PIL import Image
+        payloads = [Image.open(BytesIO(image_bytes)).convert("RGB") for image_bytes in payloads]
+    vectors = _models[kind].encode(payloads, batch_size=len(payloads), normalize_embeddings=True, convert_to_numpy=True)
+    return vectors.tolist()
+
+def model_dimensions(kind: str) -> int:
+    model = _models[kind]
+    # CLIP 模型的 get_sentence_embedding_dimension 返回 None，编码一段文本得到维度
+    return model.get_sentence_embedding_dimension() or len(model.encode(["dimension probe"])[0])
+
+
+class LocalEmbeddingBackend(EmbeddingBackend):
+    name = "local"
+
+    def __init__(self, text_model_path: str, image_model_path: str, image_text_model_path: str = None, workers: int = 2, batch_size: int = 32):
+        model_paths = {"text": text_model_path, "image": image_model_path, "image_text": image_text_model_path or image_model_path}
+        for path in set(model_paths.values()):
+            if not os.path.exists(path):
+                raise ValueError(f"Local embedding model not found: {path}")
+        torch_threads = max((os.cpu_count() or 1) // workers, 1)
+        # spawn: 父进程里有日志线程和事件循环，fork 不安全
+        self.pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"),
+                                        initializer=load_models, initargs=(model_paths, torch_threads))
+        self.batch_size = batch_size
+        self.pending = {}
+        self.flush_handles = {}
+        self.running = set()
+
+    # 第一次读取时要等 worker 进程加载模型，会阻塞调用线程，事件循环里要通过 run_in_executor 读取
+    @functools.cached_property
+    def text_dimensions(self) -> int:
+        return self.pool.submit(model_dimensions, "text").result()
+
+    @functools.cached_property
+    def image_dimensions(self) -> int:
+        return self.pool.submit(model_dimensions, "image").result()
+
+    async def embed_texts(self, texts: List[str]) -> List[List[float]]:
+        return await self._encode("text", texts)
+
+    async def embed_image(self, image_url: str) -> List[float]:
+        # 和 OCR 共用本地图片缓存
+        image_bytes = await download_image_bytes(image_url)
+        return (await self._encode("image", [image_bytes]))[0]
+
+    async def embed_image_space_text(self, text: str) -> List[float]:
+        return (await self._encode("image_text", [text]))[0]
+
+    async def _encode(self, kind: str, payloads: list) -> List[List[float]]:
+        loop = asyncio.get_running_loop()
+        futures = []
+        for payload in payloads:
+            future = loop.create_future()
+            self.pending.setdefault(kind, []).append((payload, future))
+            futures.append(future)
+        if len(self.pending[kind]) >= self.batch_size:
+            self._flush(kind)
+        elif kind not in self.flush_handles:
+            self.flush_handles[kind] = loop.call_later(BATCH_WAIT_SECONDS, self._flush, kind)
+        return list(await asyncio.gather(*futures))
+
+    def _flush(self, kind: str):
+        handle = self.flush_handles.pop(kind, None)
+        if handle is not None:
+            handle.cancel()
+        batch = self.pending.pop(kind, [])
+        for i in range(0, len(batch), self.batch_size):
+            task = asyncio.ensure_future(self._run_batch(kind, batch[i : i + self.batch_size]))
+            self.running.add(task)
+            task.add_done_callback(self.running.discard)
+
+    async def _run_batch(self, kind: str, batch: list):
+        try:
+            vectors = await asyncio.get_running_loop().run_in_executor(self.pool, encode_batch, kind, [payload for payload, _ in batch])
+        except Exception as e:
+            logging.error("Local %s embedding of %s items failed: %s", kind, len(batch), e)
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), vector in zip(batch, vectors):
+            if not future.done():
+                future.set_result(vector)
+
+
+@functools.lru_cache(maxsize=None)
+def get_embedding_backend() -> EmbeddingBackend:
+    settings = get_settings()
+    if settings.embedding_backend == "local":
+        return LocalEmbeddingBackend(settings.local_text_model_path, settings.local_image_model_path, settings.local_image_text_model_path,
+                                     settings.local_embedding_workers, settings.local_embedding_batch_size)
+    return AzureEmbeddingBackend()
+
+
+if __name__ == "__main__":
+    # 示例调用
+    backend = get_embedding_backend()
+    print(f"{backend.name} backend: text {backend.text_dimensions} dimensions, image {backend.image_dimensions} dimensions")
+    print(asyncio.run(backend.embed_text("hello world!"))[:8])
@@ -0,0 +1,57 @@
+"""Build the fused text that replaces the caption/content/ocr embeddings with a single vector."""
+import math
+from typing import List, Optional
+
+import tiktoken
+
+from settings import get_settings
+
+# 各部分的 token 预算比例，caption 最短也最重要，排在最前面
+FUSED_TEXT_BUDGET = {"caption": 0.2, "content": 0.5, "ocr": 0.3}
+
+_encoding = None
+
+
+def get_encoding():
+    global _encoding
+    if _encoding is None:
+        _encoding = tiktoken.get_encoding("cl100k_base")
+    return _encoding
+
+def decode_tokens(tokens: List[int]) -> str:
+    # 一个汉字常被拆成几个 token，从中间截断时两端是不完整的 UTF-8 字节，丢掉而不是解码成 U+FFFD
+    return get_encoding().decode(tokens, errors="ignore")
+
+def build_fused_text(captionByCV: str, content: str, ocrContent: str, max_tokens: int = None) -> str:
+    # text-embedding-ada-002 最多 8191 个 token，默认 fused_text_max_tokens=8000
+    max_tokens = max_tokens or get_settings().fused_text_max_tokens
+    encoding = get_encoding()
+    parts = {"caption": captionByCV or "", "content": content or "", "ocr": ocrContent or ""}
+    tokens = {name: encoding.encode(text) for name, text in parts.items()}
+
+    # 短的部分用不完的预算按顺序让给后面的部分
+    budget_left = max_tokens
+    fused_parts = []
+    for i, name in enumerate(FUSED_TEXT_BUDGET):
+        share = sum(list(FUSED_TEXT_BUDGET.values())[i:])
+        budget = int(budget_left * FUSED_TEXT_BUDGET[name] / share)
+        part_tokens = tokens[name][:budget]
+        budget_left -= len(part_tokens)
+        if part_tokens:
+            fused_parts.append(decode_tokens(part_tokens))
+    return "\n".join(fused_parts)
+
+def weighted_vector_fusion(vectors: List[Optional[List[float]]], weights: List[float]) -> List[float]:
+    # 已有三个向量时不需要再调用 embedding，直接加权求和后归一化
+    fused = None
+    for vector, weight in zip(vectors, weights):
+        if vector is None:
+            continue
+        if fused is None:
+            fused = [0.0] * len(vector)
+        for i, value in enumerate(vector):
+            fused[i] += weight * value
+    if fused is None:
+        return None
+    norm = math.sqrt(sum(value * value for value in fused)) or 1.0
+    return [value / norm for value in fused]
@@ -0,0 +1,157 @@
+"""Compare the fused text vector layout with the three-field layout on exported documents.
+
+The three-field baseline ranks every question against captionVector, contentVector and
+ocrContentVecotor and merges the per-field rankings with reciprocal rank fusion, the same
+way AI Search merges a multi-field vector query. recall@k is the overlap of the fused
+top-k with the baseline top-k.
+
+The fused side is the vector ingestion writes in text_vector_mode=fused: the embedding of
+build_fused_text(CV caption, content, ocrContent). The index does not store the CV dense
+caption, so --export captions every image again and saves the fused text next to the separate
+vectors. The weighted sum of the three stored vectors is reported as well, as a layout that
+needs no extra embedding call. The export needs an index built in separate mode; an index
+built in fused mode has no per-field vectors to compare against.
+"""
+import argparse
+import asyncio
+import json
+import logging
+from typing import Dict, List
+
+import numpy as np
+from azure.core.credentials import AzureKeyCredential
+from azure.search.documents.aio import SearchClient
+from azure.search.documents.indexes.aio import SearchIndexClient
+
+from embeddingBackend import get_embedding_backend
+from fusedTextVector import build_fused_text, weighted_vector_fusion
+from pictureOcrProcess import get_image_caption_byCV
+from qaDataset import load_qa_records
+from settings import configure_logging, get_settings
+from vectorFieldOptions import SEPARATE_TEXT_VECTOR_FIELDS
+
+RRF_K = 60
+# 导出文件里保存融合文本的字段
+FUSED_TEXT_FIELD = "fusedText"
+
+
+def load_documents(documents_path: str) -> List[dict]:
+    with open(documents_path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def load_questions(qa_path: str) -> List[str]:
+    return [record["question"] for record in load_qa_records(qa_path)]
+
+async def export_documents_from_index(search_client: SearchClient, index_client: SearchIndexClient, documents_path: str):
+    index = await index_client.get_index(search_client._index_name)
+    if not set(SEPARATE_TEXT_VECTOR_FIELDS) <= {field.name for field in index.fields}:
+        raise ValueError(f"Index {index.name} has no {', '.join(SEPARATE_TEXT_VECTOR_FIELDS)}, it was built in fused mode; "
+                         "build a separate-mode index to compare against")
+
+    # 需要向量字段是 retrievable 的（vector_stored=true）
+    fields = ["id", "imageUrl", "content", "ocrContent"] + SEPARATE_TEXT_VECTOR_FIELDS
+    results = await search_client.search(search_text="*", select=fields)
+    documents = [{field: result.get(field) for field in fields} async for result in results]
+
+    # 索引里没有保存 CV dense caption，融合文本要和入库时一样，重新生成一次 caption
+    caption_slots = asyncio.Semaphore(get_settings().stage_concurrency["caption"])
+
+    async def add_fused_text(d: dict):
+        try:
+            async with caption_slots:
+                captionByCV = await get_image_caption_byCV(d["imageUrl"])
+        except Exception as e:
+            logging.error("Caption of %s failed, leaving it out of the comparison: %s", d["id"], e)
+            return
+        d[FUSED_TEXT_FIELD] = build_fused_text(captionByCV, d["content"], d["ocrContent"])
+
+    await asyncio.gather(*(add_fused_text(d) for d in documents))
+    with open(documents_path, "w", encoding="utf-8") as f:
+        for d in documents:
+            f.write(json.dumps(d, ensure_ascii=False) + "\n")
+    print(f"Exported {len(documents)} documents to {documents_path}, {sum(1 for d in documents if FUSED_TEXT_FIELD in d)} with fused text")
+
+def comparable_documents(documents: List[dict]) -> List[dict]:
+    return [d for d in documents if d.get(FUSED_TEXT_FIELD) and all(d.get(field) for field in SEPARATE_TEXT_VECTOR_FIELDS)]
+
+def normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms == 0, 1, norms)
+
+def top_k(query_matrix: np.ndarray, doc_matrix: np.ndarray, k: int) -> np.ndarray:
+    scores = query_matrix @ doc_matrix.T
+    return np.argsort(-scores, axis=1)[:, :k]
+
+def rrf_merge(rankings: List[np.ndarray], k: int) -> List[List[int]]:
+    merged = []
+    for query_index in range(rankings[0].shape[0]):
+        scores: Dict[int, float] = {}
+        for ranking in rankings:
+            for rank, doc_index in enumerate(ranking[query_index]):
+                scores[int(doc_index)] = scores.get(int(doc_index), 0.0) + 1.0 / (RRF_K + rank + 1)
+        merged.append(sorted(scores, key=scores.get, reverse=True)[:k])
+    return merged
+
+def recall_against(baseline: List[List[int]], ranking: np.ndarray, k: int) -> List[float]:
+    return [len(set(baseline[i]) & set(ranking[i].tolist())) / k for i in range(len(baseline))]
+
+def compare_layouts(documents: List[dict], query_vectors: List[List[float]], fused_text_vectors: List[List[float]], k: int,
+                    weights: List[float]) -> dict:
+    # documents 是 comparable_documents 的结果，fused_text_vectors 和它一一对应
+    queries = normalize(np.asarray(query_vectors, dtype=np.float32))
+
+    # 每个字段多取一些候选再做 RRF，和服务端的行为一致
+    field_rankings = []
+    for field in SEPARATE_TEXT_VECTOR_FIELDS:
+        doc_matrix = normalize(np.asarray([d[field] for d in documents], dtype=np.float32))
+        field_rankings.append(top_k(queries, doc_matrix, k * 5))
+    baseline = rrf_merge(field_rankings, k)
+
+    # 入库 fused 模式写入的向量
+    fused = top_k(queries, normalize(np.asarray(fused_text_vectors, dtype=np.float32)), k)
+    recalls = recall_against(baseline, fused, k)
+    # 不调用 embedding，直接把三个向量加权求和
+    weighted_vectors = [weighted_vector_fusion([d[field] for field in SEPARATE_TEXT_VECTOR_FIELDS], weights) for d in documents]
+    weighted_recalls = recall_against(baseline, top_k(queries, normalize(np.asarray(weighted_vectors, dtype=np.float32)), k), k)
+    return {
+        "documents": len(documents),
+        "queries": len(recalls),
+        "k": k,
+        f"recall@{k}": float(np.mean(recalls)),
+        "min_recall": float(np.min(recalls)),
+        f"weighted_fusion_recall@{k}": float(np.mean(weighted_recalls)),
+        "embedding_calls_per_record": {"separate": 3, "fused": 1, "weighted_fusion": 0},
+        "vector_fields_per_query": {"separate": 3, "fused": 1, "weighted_fusion": 1},
+    }
+
+async def embed_questions(questions: List[str]) -> List[List[float]]:
+    return await get_embedding_backend().embed_texts(questions)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report recall of the fused text vector against the three-field layout.")
+    parser.add_argument("--documents", default="docs/documents.jsonl", help="exported documents, one JSON object per line")
+    parser.add_argument("--questions", default="multiModelGameTestData/qa_3.txt")
+    parser.add_argument("--export", action="store_true", help="export the documents from AZURE_SEARCH_INDEX first")
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--weights", default="1,1,1", help="caption,content,ocr weights for the weighted fusion")
+    args = parser.parse_args()
+
+    configure_logging()
+    if args.export:
+        settings = get_settings()
+        search_creds = AzureKeyCredential(settings.search_key)
+
+        async def export():
+            async with SearchClient(endpoint=settings.search_endpoint, credential=search_creds, index_name=settings.search_index) as search_client, \
+                       SearchIndexClient(endpoint=settings.search_endpoint, credential=search_creds) as index_client:
+                await export_documents_from_index(search_client, index_client, args.documents)
+        asyncio.run(export())
+
+    documents = comparable_documents(load_documents(args.documents))
+    if not documents:
+        raise ValueError(f"No document in {args.documents} has the separate vectors and the fused text, export it again with --export")
+    query_vectors = asyncio.run(embed_questions(load_questions(args.questions)))
+    # 和入库时一样，用选定的 embedding 后端编码融合文本
+    fused_text_vectors = asyncio.run(embed_questions([d[FUSED_TEXT_FIELD] for d in documents]))
+    report = compare_layouts(documents, query_vectors, fused_text_vectors, args.k, [float(w) for w in args.weights.split(",")])
+    print(json.dumps(report, indent=2))
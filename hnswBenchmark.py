@@ -0,0 +1,116 @@
+"""Sweep HNSW m / efConstruction / efSearch on exported vectors and write the chosen parameters for prepdocs."""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import tempfile
+import time
+from typing import List
+
+import hnswlib
+import numpy as np
+
+from fusedVectorCompare import embed_questions, load_documents, load_questions, normalize
+from settings import get_settings
+
+# AI Search 允许的范围: m 4-10, efConstruction 100-1000, efSearch 100-1000
+DEFAULT_M = [4, 6, 8, 10]
+DEFAULT_EF_CONSTRUCTION = [100, 200, 400, 800]
+DEFAULT_EF_SEARCH = [100, 200, 500, 1000]
+
+
+def exact_top_k(queries: np.ndarray, vectors: np.ndarray, k: int) -> np.ndarray:
+    scores = queries @ vectors.T
+    return np.argsort(-scores, axis=1)[:, :k]
+
+def benchmark_config(vectors: np.ndarray, queries: np.ndarray, truth: np.ndarray, k: int, m: int, ef_construction: int, ef_search_values: List[int]) -> List[dict]:
+    index = hnswlib.Index(space="cosine", dim=vectors.shape[1])
+    start = time.perf_counter()
+    index.init_index(max_elements=len(vectors), M=m, ef_construction=ef_construction)
+    index.add_items(vectors, np.arange(len(vectors)), num_threads=1)
+    build_seconds = time.perf_counter() - start
+
+    # 用序列化后的大小近似索引内存
+    with tempfile.TemporaryDirectory() as temp_dir:
+        index_path = os.path.join(temp_dir, "index.bin")
+        index.save_index(index_path)
+        index_bytes = os.path.getsize(index_path)
+
+    results = []
+    for ef_search in ef_search_values:
+        index.set_ef(max(ef_search, k))
+        latencies = []
+        hits = 0
+        for query, expected in zip(queries, truth):
+            query_start = time.perf_counter()
+            labels, _ = index.knn_query(query, k=k, num_threads=1)
+            latencies.append((time.perf_counter() - query_start) * 1000)
+            hits += len(set(labels[0].tolist()) & set(expected.tolist()))
+        results.append({
+            "m": m,
+            "efConstruction": ef_construction,
+            "efSearch": ef_search,
+            f"recall@{k}": hits / (len(queries) * k),
+            "build_seconds": round(build_seconds, 3),
+            "index_mb": round(index_bytes / 1024 / 1024, 2),
+            "p50_ms": round(float(np.percentile(latencies, 50)), 4),
+            "p99_ms": round(float(np.percentile(latencies, 99)), 4),
+        })
+    return results
+
+def run_sweep(vectors: np.ndarray, queries: np.ndarray, k: int, m_values, ef_construction_values, ef_search_values) -> List[dict]:
+    truth = exact_top_k(queries, vectors, k)
+    results = []
+    for m, ef_construction in itertools.product(m_values, ef_construction_values):
+        config_results = benchmark_config(vectors, queries, truth, k, m, ef_construction, ef_search_values)
+        for result in config_results:
+            print(json.dumps(result))
+        results += config_results
+    return results
+
+def choose_params(results: List[dict], k: int, target_recall: float) -> dict:
+    # 达到目标召回率的配置里选 p99 最低的，都达不到时选召回率最高的
+    candidates = [r for r in results if r[f"recall@{k}"] >= target_recall]
+    if candidates:
+        return min(candidates, key=lambda r: (r["p99_ms"], r["build_seconds"]))
+    return max(results, key=lambda r: r[f"recall@{k}"])
+
+def save_hnsw_params(params: dict, path: str = None):
+    path = path or get_settings().hnsw_params_path
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"m": params["m"], "efConstruction": params["efConstruction"], "efSearch": params["efSearch"]}, f, indent=2)
+    print(f"Saved HNSW parameters to {path}, prepdocs will use them for new indexes")
+
+def parse_values(value: str) -> List[int]:
+    return [int(v) for v in value.split(",")]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark HNSW parameters against exact search.")
+    parser.add_argument("--documents", default="docs/documents.jsonl", help="exported documents, see fusedVectorCompare.py --export")
+    parser.add_argument("--field", default="contentVector")
+    parser.add_argument("--questions", default="multiModelGameTestData/qa_3.txt", help="questions to embed as queries")
+    parser.add_argument("--sample-queries", type=int, default=0, help="use N document vectors as queries instead of embedding questions")
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--m", default=",".join(map(str, DEFAULT_M)))
+    parser.add_argument("--ef-construction", default=",".join(map(str, DEFAULT_EF_CONSTRUCTION)))
+    parser.add_argument("--ef-search", default=",".join(map(str, DEFAULT_EF_SEARCH)))
+    parser.add_argument("--target-recall", type=float, default=0.95)
+    parser.add_argument("--save", action="store_true", help="write the chosen parameters to hnsw_params_path")
+    args = parser.parse_args()
+
+    documents = [d for d in load_documents(args.documents) if d.get(args.field)]
+    vectors = normalize(np.asarray([d[args.field] for d in documents], dtype=np.float32))
+    if args.sample_queries:
+        rng = np.random.default_rng(99)
+        queries = vectors[rng.choice(len(vectors), size=min(args.sample_queries, len(vectors)), replace=False)]
+    else:
+        queries = normalize(np.asarray(asyncio.run(embed_questions(load_questions(args.questions))), dtype=np.float32))
+
+    results = run_sweep(vectors, queries, args.k, parse_values(args.m), parse_values(args.ef_construction), parse_values(args.ef_search))
+    chosen = choose_params(results, args.k, args.target_recall)
+    print("Chosen parameters:", json.dumps(chosen))
+    if args.save:
+        save_hnsw_params(chosen)
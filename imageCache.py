@@ -0,0 +1,179 @@
+"""On-disk cache of downloaded images, shared by all worker processes on a machine.
+
+CDN urls of the form .../etag/<hash>.<ext> are content-addressed, so a cached copy is
+always valid and is served without any request. Other urls are stored together with their
+ETag / Last-Modified headers and revalidated with a conditional request.
+
+Files live under <image_cache_dir>/<aa>/<bb>/<sha256 of the key>. Writes go to a temporary
+file that is renamed into place, so concurrent processes never read a partial image. A hit
+updates the file's mtime; when the cache grows past image_cache_max_mb the least recently
+used files are deleted under an exclusive lock, so only one process evicts at a time.
+
+The pipeline uses get_async / put_async: file reads and writes run in a worker thread and
+eviction, which walks the whole cache directory, runs as a background task, so neither
+blocks the event loop or the download that triggered it.
+"""
+import asyncio
+import functools
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+from typing import Optional, Tuple
+from urllib.parse import urlparse
+
+from settings import get_settings
+
+try:
+    import fcntl
+except ImportError:
+    # Windows 上没有 fcntl，淘汰时不加锁；删除已经被删的文件会被忽略
+    fcntl = None
+
+ETAG_PATH = re.compile(r"/etag/([A-Za-z0-9_-]+)")
+META_SUFFIX = ".meta"
+LOCK_FILE = ".evict.lock"
+# 淘汰到上限的 90%，避免每次写入都触发一次扫描
+EVICT_TARGET_RATIO = 0.9
+
+
+class ImageCache:
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        # 本进程自上次扫描后写入的字节数，超过上限的 5% 时再扫描一次整个目录
+        self.written_since_scan = 0
+        # put_async 启动的后台淘汰，同一时间只有一个
+        self.eviction = None
+        os.makedirs(self.root, exist_ok=True)
+
+    @staticmethod
+    def etag_of(url: str) -> Optional[str]:
+        match = ETAG_PATH.search(urlparse(url).path)
+        return match.group(1) if match else None
+
+    def path_for(self, url: str) -> str:
+        key = self.etag_of(url) or url
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def get(self, url: str) -> Tuple[Optional[bytes], dict]:
+        # 返回 (图片内容, 校验用的响应头)，未命中时内容为 None
+        path = self.path_for(url)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None, {}
+        meta = {}
+        if os.path.exists(path + META_SUFFIX):
+            with open(path + META_SUFFIX, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+        self.touch(url)
+        return data, meta
+
+    def touch(self, url: str):
+        try:
+            os.utime(self.path_for(url))
+        except FileNotFoundError:
+            # 另一个进程刚刚把它淘汰了
+            pass
+
+    def put(self, url: str, data: bytes, meta: Optional[dict] = None):
+        self.write(url, data, meta)
+        if self.needs_eviction():
+            self.evict()
+
+    def write(self, url: str, data: bytes, meta: Optional[dict] = None):
+        path = self.path_for(url)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if meta:
+            self._write_atomic(path + META_SUFFIX, json.dumps(meta).encode("utf-8"))
+        self._write_atomic(path, data)
+        self.written_since_scan += len(data)
+
+    def needs_eviction(self) -> bool:
+        return self.written_since_scan > self.max_bytes * 0.05
+
+    async def get_async(self, url: str) -> Tuple[Optional[bytes], dict]:
+        return await asyncio.to_thread(self.get, url)
+
+    async def put_async(self, url: str, data: bytes, meta: Optional[dict] = None):
+        await asyncio.to_thread(self.write, url, data, meta)
+        if self.needs_eviction() and (self.eviction is None or self.eviction.done()):
+            # 淘汰要扫描整个缓存目录，放到后台线程，写入方不等待
+            self.written_since_scan = 0
+            self.eviction = asyncio.ensure_future(asyncio.to_thread(self.evict))
+            self.eviction.add_done_callback(self._log_eviction_error)
+
+    @staticmethod
+    def _log_eviction_error(eviction: asyncio.Future):
+        if not eviction.cancelled() and eviction.exception() is not None:
+            logging.error("Image cache eviction failed: %s", eviction.exception())
+
+    def _write_atomic(self, path: str, data: bytes):
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+    def evict(self):
+        self.written_since_scan = 0
+        with open(os.path.join(self.root, LOCK_FILE), "a") as lock:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    # 另一个进程正在淘汰
+                    return
+            entries = []
+            total_bytes = 0
+            for directory, _, files in os.walk(self.root):
+                for name in files:
+                    if name.endswith(META_SUFFIX) or name.startswith("."):
+                        continue
+                    path = os.path.join(directory, name)
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, path))
+                    total_bytes += stat.st_size
+
+            if total_bytes <= self.max_bytes:
+                return
+            target_bytes = self.max_bytes * EVICT_TARGET_RATIO
+            evicted = 0
+            for _, size, path in sorted(entries):
+                if total_bytes <= target_bytes:
+                    break
+                for victim in (path, path + META_SUFFIX):
+                    try:
+                        os.unlink(victim)
+                    except FileNotFoundError:
+                        pass
+                total_bytes -= size
+                evicted += 1
+            logging.info("Evicted %s images from %s, %.0f MB left", evicted, self.root, total_bytes / 1024 / 1024)
+
+
+@functools.lru_cache(maxsize=None)
+def get_image_cache() -> Optional[ImageCache]:
+    settings = get_settings()
+    if not settings.image_cache_dir:
+        return None
+    return ImageCache(settings.image_cache_dir, settings.image_cache_max_mb * 1024 * 1024)
+
+
+if __name__ == "__main__":
+    # 示例调用
+    cache = get_image_cache()
+    if cache is not None:
+        cache.evict()
+        print(f"Image cache at {cache.root}, limit {cache.max_bytes / 1024 / 1024:.0f} MB")
@@ -0,0 +1,118 @@
+"""Per-record fingerprints and the local state used by incremental re-indexing."""
+import hashlib
+import logging
+import os
+import sqlite3
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List
+
+from objectDefinition import ImageData
+from settings import get_settings
+
+
+def _hash(*values: str) -> str:
+    return hashlib.sha256("\x1f".join(values).encode("utf-8")).hexdigest()
+
+def compute_fingerprint(item: ImageData) -> str:
+    # 修改提示词、模型或者向量字段时需要升级 pipeline_version，所有记录都会重新生成
+    return _hash(item.id, item.imageUrl, item.caption, get_settings().pipeline_version)
+
+def compute_image_hash(item: ImageData) -> str:
+    # content/ocrContent 以及所有向量都来自图片本身，caption 只是文本字段
+    return _hash(item.imageUrl, get_settings().pipeline_version)
+
+
+@dataclass
+class IncrementalPlan:
+    # 新记录、图片变化或者 pipeline 版本变化，需要完整的 enrichment
+    to_enrich: List[ImageData] = field(default_factory=list)
+    # 只有 caption 变化，只需要 merge caption 字段，不需要重新调用任何模型
+    to_patch: List[ImageData] = field(default_factory=list)
+    unchanged: List[ImageData] = field(default_factory=list)
+
+
+class IndexStateStore:
+    def __init__(self, db_path: str = None):
+        db_path = db_path or get_settings().index_state_path
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        # 多个进程同时写同一个状态文件，使用 WAL 和忙等待超时
+        self.connection = sqlite3.connect(db_path, timeout=60)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS records ("
+            "id TEXT PRIMARY KEY, fingerprint TEXT NOT NULL, image_hash TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self.connection.commit()
+
+    def get_many(self, ids: List[str]) -> Dict[str, dict]:
+        states = {}
+        # SQLite 默认最多 999 个参数
+        for i in range(0, len(ids), 500):
+            batch = ids[i : i + 500]
+            rows = self.connection.execute(
+                f"SELECT id, fingerprint, image_hash FROM records WHERE id IN ({','.join('?' * len(batch))})", batch
+            )
+            for record_id, fingerprint, image_hash in rows:
+                states[record_id] = {"fingerprint": fingerprint, "image_hash": image_hash}
+        return states
+
+    def all_ids(self) -> List[str]:
+        return [row[0] for row in self.connection.execute("SELECT id FROM records")]
+
+    def upsert(self, items: Iterable[ImageData]):
+        now = time.time()
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO records (id, fingerprint, image_hash, updated_at) VALUES (?, ?, ?, ?)",
+            [(item.id, compute_fingerprint(item), compute_image_hash(item), now) for item in items],
+        )
+        self.connection.commit()
+
+    def upsert_fingerprints(self, fingerprints: Dict[str, str]):
+        # 从索引恢复状态时只有整体 fingerprint，image_hash 置空，变化时按完整 enrichment 处理
+        now = time.time()
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO records (id, fingerprint, image_hash, updated_at) VALUES (?, ?, '', ?)",
+            [(record_id, fingerprint, now) for record_id, fingerprint in fingerprints.items()],
+        )
+        self.connection.commit()
+
+    def delete(self, ids: Iterable[str]):
+        self.connection.executemany("DELETE FROM records WHERE id = ?", [(record_id,) for record_id in ids])
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+
+def plan_incremental(image_data_list: List[ImageData], store: IndexStateStore) -> IncrementalPlan:
+    plan = IncrementalPlan()
+    states = store.get_many([item.id for item in image_data_list])
+
+    for item in image_data_list:
+        state = states.get(item.id)
+        if state is None:
+            plan.to_enrich.append(item)
+        elif state["fingerprint"] == compute_fingerprint(item):
+            plan.unchanged.append(item)
+        elif state["image_hash"] == compute_image_hash(item):
+            plan.to_patch.append(item)
+        else:
+            plan.to_enrich.append(item)
+
+    logging.info("Incremental plan: %s to enrich, %s to patch, %s unchanged", len(plan.to_enrich), len(plan.to_patch), len(plan.unchanged))
+    return plan
+
+def find_deleted_ids(image_data_list: List[ImageData], store: IndexStateStore) -> List[str]:
+    current_ids = {item.id for item in image_data_list}
+    return [record_id for record_id in store.all_ids() if record_id not in current_ids]
+
+async def load_fingerprints_from_index(search_client) -> Dict[str, str]:
+    # 本地状态丢失时，从索引里的 fingerprint 字段恢复
+    fingerprints = {}
+    results = await search_client.search(search_text="*", select=["id", "fingerprint"])
+    async for result in results:
+        if result.get("fingerprint"):
+            fingerprints[result["id"]] = result["fingerprint"]
+    return fingerprints
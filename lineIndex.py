@@ -0,0 +1,134 @@
+"""Line-offset index of a large input file, so a worker can read lines [start, end) without scanning from the top.
+
+The index is built with one pass over the file and saved next to it as <file>.lineidx:
+
+    magic (8 bytes) | file size, mtime_ns, line count (3 x uint64) | offsets (line count + 1 x uint64)
+
+offsets[i] is the byte position where line i starts, the last entry is the file size. The
+saved index is only reused while the file's size and mtime match, otherwise it is rebuilt.
+Shards are plain line ranges; a worker maps them to byte ranges with two lookups and reads
+the slice through mmap, so any number of workers can start on the same file at once.
+"""
+import argparse
+import array
+import mmap
+import os
+import struct
+from typing import List, Optional, Tuple
+
+INDEX_SUFFIX = ".lineidx"
+INDEX_MAGIC = b"LINEIDX1"
+HEADER = struct.Struct("<QQQ")
+# 建索引时每次读取的字节数
+SCAN_BLOCK_SIZE = 16 * 1024 * 1024
+
+
+class LineIndex:
+    def __init__(self, file_path: str, offsets: array.array, file_size: int, mtime_ns: int):
+        self.file_path = file_path
+        self.offsets = offsets
+        self.file_size = file_size
+        self.mtime_ns = mtime_ns
+
+    @property
+    def line_count(self) -> int:
+        return len(self.offsets) - 1
+
+    @classmethod
+    def build(cls, file_path: str) -> "LineIndex":
+        stat = os.stat(file_path)
+        offsets = array.array("Q", [0])
+        position = 0
+        with open(file_path, "rb") as f:
+            while True:
+                block = f.read(SCAN_BLOCK_SIZE)
+                if not block:
+                    break
+                newline = block.find(b"\n")
+                while newline != -1:
+                    offsets.append(position + newline + 1)
+                    newline = block.find(b"\n", newline + 1)
+                position += len(block)
+        if offsets[-1] != position:
+            # 最后一行没有换行符
+            offsets.append(position)
+        return cls(file_path, offsets, stat.st_size, stat.st_mtime_ns)
+
+    @classmethod
+    def load(cls, file_path: str) -> Optional["LineIndex"]:
+        index_path = file_path + INDEX_SUFFIX
+        if not os.path.exists(index_path):
+            return None
+        stat = os.stat(file_path)
+        with open(index_path, "rb") as f:
+            if f.read(len(INDEX_MAGIC)) != INDEX_MAGIC:
+                return None
+            file_size, mtime_ns, line_count = HEADER.unpack(f.read(HEADER.size))
+            if file_size != stat.st_size or mtime_ns != stat.st_mtime_ns:
+                # 文件变了，索引作废
+                return None
+            offsets = array.array("Q")
+            offsets.fromfile(f, line_count + 1)
+        return cls(file_path, offsets, file_size, mtime_ns)
+
+    def save(self):
+        index_path = self.file_path + INDEX_SUFFIX
+        temp_path = f"{index_path}.tmp-{os.getpid()}"
+        with open(temp_path, "wb") as f:
+            f.write(INDEX_MAGIC)
+            f.write(HEADER.pack(self.file_size, self.mtime_ns, self.line_count))
+            self.offsets.tofile(f)
+        # 多个 worker 同时建索引时，最后一个 rename 的生效，内容是一样的
+        os.replace(temp_path, index_path)
+
+    @classmethod
+    def load_or_build(cls, file_path: str) -> "LineIndex":
+        index = cls.load(file_path)
+        if index is None:
+            index = cls.build(file_path)
+            try:
+                index.save()
+            except OSError:
+                # 输入目录只读时不保存，下次再扫描一次
+                pass
+        return index
+
+    def byte_range(self, start_line: int, end_line: Optional[int] = None) -> Tuple[int, int]:
+        end_line = self.line_count if end_line is None else min(end_line, self.line_count)
+        start_line = min(start_line, end_line)
+        return self.offsets[start_line], self.offsets[end_line]
+
+    def read_lines(self, start_line: int = 0, end_line: Optional[int] = None) -> List[str]:
+        start, end = self.byte_range(start_line, end_line)
+        if start == end:
+            return []
+        with open(self.file_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            data = mapped[start:end]
+        return split_lines(data)
+
+    def shard_ranges(self, lines_per_chunk: int) -> List[Tuple[int, int]]:
+        return [(start, min(start + lines_per_chunk, self.line_count)) for start in range(0, self.line_count, lines_per_chunk)]
+
+
+def read_line_range(file_path: str, start_line: int = 0, end_line: Optional[int] = None) -> List[str]:
+    if start_line == 0 and end_line is None:
+        # 读整个文件不需要索引
+        with open(file_path, "rb") as f:
+            return split_lines(f.read())
+    return LineIndex.load_or_build(file_path).read_lines(start_line, end_line)
+
+def split_lines(data: bytes) -> List[str]:
+    # 只按 \n 切分，caption 里可能有 \u2028 之类的字符，str.splitlines 会把它们也当成换行
+    lines = data.split(b"\n")
+    if lines[-1] == b"":
+        lines.pop()
+    return [line.decode("utf-8") for line in lines]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build and save the line-offset index of an input file.")
+    parser.add_argument("file_path", help="input file, e.g. multiModelGameTestData/img_files.txt")
+    args = parser.parse_args()
+
+    index = LineIndex.load_or_build(args.file_path)
+    print(f"{index.line_count} lines, {index.file_size} bytes, index saved to {index.file_path + INDEX_SUFFIX}")
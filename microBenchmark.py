@@ -0,0 +1,216 @@
+"""Microbenchmarks for the CPU-side hot paths, on synthetic records shaped like img_files.txt.
+
+    python microBenchmark.py --save benchmarks/baseline.json     # record a baseline
+    python microBenchmark.py --compare benchmarks/baseline.json  # exit 1 on a regression
+
+Each benchmark reports the median time per operation, items per second and, from a
+separate tracemalloc run, the peak allocated bytes and the live memory blocks per operation.
+The timing runs do not trace allocations, so the two numbers do not distort each other.
+"""
+import argparse
+import asyncio
+import dataclasses
+import gzip
+import json
+import os
+import random
+import statistics
+import string
+import tempfile
+import time
+import tracemalloc
+from io import BytesIO
+from typing import Callable, List
+
+from PIL import Image
+
+from data_utils import parse_image_records
+from dataProcess import document_to_upload_dict
+from lineIndex import LineIndex
+from objectDefinition import Document
+from pictureFormatProcess import save_image_as_pdf
+from searchUpload import GZIP_LEVEL, serialize_batch
+
+TEXT_VECTOR_DIMENSIONS = 1536
+IMAGE_VECTOR_DIMENSIONS = 1024
+# 默认和 prepdocs 一致
+UPLOAD_BATCH_SIZE = 50
+LINES_PER_CHUNK = 100
+
+
+@dataclasses.dataclass
+class Benchmark:
+    name: str
+    func: Callable[[], object]
+    # 每次调用处理多少个对象，用来换算每个对象的耗时
+    items_per_call: int = 1
+
+
+def random_caption(rng: random.Random, length: int) -> str:
+    # 中文标题，偶尔带单引号，和真实数据里需要转义的情况一致
+    chars = [chr(rng.randint(0x4E00, 0x9FA5)) for _ in range(length)]
+    if rng.random() < 0.1:
+        chars.insert(rng.randrange(len(chars)), "'")
+    return "".join(chars)
+
+def write_synthetic_records(path: str, count: int, seed: int = 0):
+    rng = random.Random(seed)
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(count):
+            etag = "".join(rng.choices(string.ascii_letters + string.digits + "_-", k=28))
+            record = {
+                "id": f"{rng.randrange(10**17, 10**18)}_{i % 9}",
+                "imageUrl": f"https://img2.tapimg.com/moment/etag/{etag}.png",
+                "caption": random_caption(rng, rng.randint(10, 120)),
+            }
+            f.write(repr(record) + "\n")
+
+def synthetic_documents(count: int, seed: int = 0) -> List[Document]:
+    rng = random.Random(seed)
+
+    def vector(dimensions):
+        return [rng.uniform(-0.1, 0.1) for _ in range(dimensions)]
+
+    return [
+        Document(id=f"{i}_0", imageUrl=f"https://img2.tapimg.com/moment/etag/{i}.png",
+                 caption=random_caption(rng, 60), content=random_caption(rng, 400), ocrContent=random_caption(rng, 100),
+                 captionVector=vector(TEXT_VECTOR_DIMENSIONS), contentVector=vector(TEXT_VECTOR_DIMENSIONS),
+                 ocrContentVecotor=vector(TEXT_VECTOR_DIMENSIONS), imageVecotor=vector(IMAGE_VECTOR_DIMENSIONS))
+        for i in range(count)
+    ]
+
+def synthetic_png(width: int = 1080, height: int = 1920, seed: int = 0) -> bytes:
+    # 截图大多是大块纯色加文字，用随机色块近似真实的压缩比
+    rng = random.Random(seed)
+    image = Image.new("RGB", (width, height))
+    for _ in range(200):
+        x, y = rng.randrange(width), rng.randrange(height)
+        image.paste((rng.randrange(256), rng.randrange(256), rng.randrange(256)), (x, y, min(x + 120, width), min(y + 40, height)))
+    png = BytesIO()
+    image.save(png, format="PNG")
+    return png.getvalue()
+
+def build_benchmarks(work_dir: str, records: int) -> List[Benchmark]:
+    records_path = os.path.join(work_dir, "img_files.txt")
+    write_synthetic_records(records_path, records)
+    line_index = LineIndex.build(records_path)
+
+    documents = synthetic_documents(UPLOAD_BATCH_SIZE)
+    upload_batch = [document_to_upload_dict(document) for document in documents]
+    png_bytes = synthetic_png()
+    decoded = Image.open(BytesIO(png_bytes))
+    decoded.load()
+    pdf_path = os.path.join(work_dir, "image.pdf")
+
+    def decode_png():
+        # 和 download_image 一样用 Image.open，load() 强制真正解码
+        image = Image.open(BytesIO(png_bytes))
+        image.load()
+        return image
+
+    return [
+        Benchmark("parse_image_records", lambda: parse_image_records(records_path), records),
+        Benchmark("document_to_upload_dict", lambda: [document_to_upload_dict(document) for document in documents], len(documents)),
+        Benchmark("upload_batch_json", lambda: json.dumps(upload_batch, ensure_ascii=False), len(upload_batch)),
+        Benchmark("upload_batch_fast", lambda: serialize_batch(upload_batch), len(upload_batch)),
+        Benchmark("upload_batch_fast_gzip", lambda: gzip.compress(serialize_batch(upload_batch), compresslevel=GZIP_LEVEL), len(upload_batch)),
+        Benchmark("line_index_build", lambda: LineIndex.build(records_path), records),
+        Benchmark("read_line_range", lambda: line_index.read_lines(records // 2, records // 2 + LINES_PER_CHUNK), LINES_PER_CHUNK),
+        Benchmark("png_decode", decode_png),
+        Benchmark("pdf_encode", lambda: asyncio.run(save_image_as_pdf(decoded, pdf_path))),
+    ]
+
+def measure(benchmark: Benchmark, rounds: int, min_round_seconds: float) -> dict:
+    benchmark.func()  # 预热
+
+    # 每轮至少跑 min_round_seconds，快的操作会在一轮里重复多次
+    iterations = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(iterations):
+            benchmark.func()
+        if time.perf_counter() - start >= min_round_seconds:
+            break
+        iterations *= 2
+
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for _ in range(iterations):
+            benchmark.func()
+        timings.append((time.perf_counter() - start) / iterations)
+
+    # 内存单独跑一次：峰值字节数，以及操作结束后仍然存活的内存块（包括返回值）
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    before_bytes, _ = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    result = benchmark.func()
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    del result
+    live_blocks = sum(stat.count_diff for stat in after.compare_to(before, "filename"))
+
+    median = statistics.median(timings)
+    return {
+        "median_ms": median * 1000,
+        "stdev_ms": statistics.stdev(timings) * 1000 if len(timings) > 1 else 0.0,
+        "ops_per_second": 1 / median,
+        "items_per_second": benchmark.items_per_call / median,
+        "peak_kb": (peak_bytes - before_bytes) / 1024,
+        "live_blocks": live_blocks,
+        "iterations": iterations,
+    }
+
+def compare(results: dict, baseline: dict, threshold: float) -> List[str]:
+    regressions = []
+    print(f"\n{'benchmark':<26}{'baseline ms':>14}{'current ms':>14}{'change':>10}{'peak KB':>12}")
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            print(f"{name:<26}{'-':>14}{current['median_ms']:>14.3f}{'new':>10}{current['peak_kb']:>12.0f}")
+            continue
+        change = current["median_ms"] / previous["median_ms"] - 1
+        memory_change = current["peak_kb"] / max(previous["peak_kb"], 1) - 1
+        marker = ""
+        if change > threshold or memory_change > threshold:
+            marker = " <- regression"
+            regressions.append(name)
+        print(f"{name:<26}{previous['median_ms']:>14.3f}{current['median_ms']:>14.3f}{change:>+10.1%}{current['peak_kb']:>12.0f}{marker}")
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark parsing, upload serialization, file splitting and image conversion.")
+    parser.add_argument("--records", type=int, default=5000, help="synthetic records in the input file")
+    parser.add_argument("--rounds", type=int, default=7)
+    parser.add_argument("--min-round-seconds", type=float, default=0.2)
+    parser.add_argument("--only", nargs="*", help="run only these benchmarks")
+    parser.add_argument("--save", help="write the results to this baseline file")
+    parser.add_argument("--compare", help="compare against this baseline file")
+    parser.add_argument("--threshold", type=float, default=0.1, help="allowed slowdown or memory growth before failing, 0.1 = 10%%")
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as work_dir:
+        for benchmark in build_benchmarks(work_dir, args.records):
+            if args.only and benchmark.name not in args.only:
+                continue
+            results[benchmark.name] = measure(benchmark, args.rounds, args.min_round_seconds)
+            r = results[benchmark.name]
+            print(f"{benchmark.name:<26} {r['median_ms']:10.3f} ms/op  ±{r['stdev_ms']:.3f}  {r['items_per_second']:12.0f} items/s"
+                  f"  peak {r['peak_kb']:10.0f} KB  {r['live_blocks']} blocks")
+
+    if args.save:
+        os.makedirs(os.path.dirname(args.save) or ".", exist_ok=True)
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Saved baseline to {args.save}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"Regressions: {', '.join(regressions)}")
+            raise SystemExit(1)
@@ -1,39 +1,27 @@
 import asyncio
 import logging
-import os
 from typing import List
 
 import aiohttp
-from dotenv import load_dotenv
 
-# Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-
-load_dotenv(verbose=True)
-
-cvEndpointList = [
-    {"cvEndpoint": os.getenv("AZURE_COMPUTER_VISION_ENDPOINT1"), "cvEndpointKey": os.getenv("AZURE_COMPUTER_VISION_KEY1")},
-    {"cvEndpoint": os.getenv("AZURE_COMPUTER_VISION_ENDPOINT2"), "cvEndpointKey": os.getenv("AZURE_COMPUTER_VISION_KEY2")},
-    {"cvEndpoint": os.getenv("AZURE_COMPUTER_VISION_ENDPOINT3"), "cvEndpointKey": os.getenv("AZURE_COMPUTER_VISION_KEY3")}
-]
-
-# 当前使用的索引，初始为0
-endpoint_index = 0
-endpoint_lock = asyncio.Lock()  # 用于保护 endpoint_index 的锁
+from callPolicy import call_with_policy
+from cvEndpointPool import get_cv_endpoint_pool
+from settings import configure_logging
+from structuredLogging import Truncated
 
 async def get_picture_embedding(image_file_url:str) ->  List[float]:
-    logging.info(f"Getting picture embedding for {image_file_url}")
+    logging.info("Getting picture embedding for %s", image_file_url)
+    # 每次尝试（包括对冲请求）都重新选择 endpoint
+    return await call_with_policy("cv_vectorize", lambda: vectorize_image(image_file_url))
 
-    global endpoint_index
-    async with endpoint_lock:
-        # 选择当前的 cvEndpoint 和 cvEndpointKey（负载均衡）
-        cv_endpoint = cvEndpointList[endpoint_index]
-        endpoint_index = (endpoint_index + 1) % len(cvEndpointList)  # 轮询下一个端点
+async def vectorize_image(image_file_url:str) ->  List[float]:
+    # 选择当前的 cvEndpoint 和 cvEndpointKey（负载均衡）
+    cv_endpoint = get_cv_endpoint_pool().next_endpoint()
 
-    url = cv_endpoint['cvEndpoint'] + "computervision/retrieval:vectorizeImage?api-version=2024-02-01&model-version=2023-04-15"
+    url = cv_endpoint.endpoint + "computervision/retrieval:vectorizeImage?api-version=2024-02-01&model-version=2023-04-15"
     headers = {
         "Content-Type": "application/json",
-        "Ocp-Apim-Subscription-Key": cv_endpoint['cvEndpointKey']
+        "Ocp-Apim-Subscription-Key": cv_endpoint.key
     }
     body = {
         "url": image_file_url
@@ -46,23 +34,24 @@ async def get_picture_embedding(image_file_url:str) ->  List[float]:
                 return data['vector']
             else:
                 error_text = await response.text()
-                logging.error(f"Error getting picture embedding: {response.status} - {error_text}")
-                raise Exception(f"Error getting picture embedding: {response.status} - {error_text}")
+                logging.error("Error getting picture embedding: %s - %s", response.status, Truncated(error_text, 500))
+                # 带上状态码，callPolicy 按 status 判断是否是 429
+                raise aiohttp.ClientResponseError(response.request_info, response.history, status=response.status,
+                                                  message=f"Error getting picture embedding: {error_text}")
                 
 
 async def get_text_embedding_by_computer_vision(text:str)->  List[float]:
-    logging.info(f"Getting text embedding for {text}")
-    
-    global endpoint_index
-    async with endpoint_lock:
-        # 选择当前的 cvEndpoint 和 cvEndpointKey（负载均衡）
-        cv_endpoint = cvEndpointList[endpoint_index]
-        endpoint_index = (endpoint_index + 1) % len(cvEndpointList)  # 轮询下一个端点
+    logging.info("Getting text embedding for %s", Truncated(text))
+    return await call_with_policy("cv_vectorize", lambda: vectorize_text(text))
+
+async def vectorize_text(text:str)->  List[float]:
+    # 选择当前的 cvEndpoint 和 cvEndpointKey（负载均衡）
+    cv_endpoint = get_cv_endpoint_pool().next_endpoint()
 
-    url = cv_endpoint['cvEndpoint'] + "computervision/retrieval:vectorizeText?api-version=2024-02-01&model-version=2023-04-15"
+    url = cv_endpoint.endpoint + "computervision/retrieval:vectorizeText?api-version=2024-02-01&model-version=2023-04-15"
     headers = {
         "Content-Type": "application/json",
-        "Ocp-Apim-Subscription-Key": cv_endpoint['cvEndpointKey']
+        "Ocp-Apim-Subscription-Key": cv_endpoint.key
     }
 
     body = {
@@ -76,10 +65,12 @@ async def get_text_embedding_by_computer_vision(text:str)->  List[float]:
                 return data['vector']
             else:
                 error_text = await response.text()
-                logging.error(f"Error getting picture embedding: {response.status} - {error_text}")
-                raise Exception(f"Error getting text embedding: {response.status} - {error_text}")
+                logging.error("Error getting text embedding: %s - %s", response.status, Truncated(error_text, 500))
+                raise aiohttp.ClientResponseError(response.request_info, response.history, status=response.status,
+                                                  message=f"Error getting text embedding: {error_text}")
 
 if __name__ == "__main__":
+    configure_logging()
     # 示例调用
     textEmbeddingResult = asyncio.run(get_text_embedding_by_computer_vision("hello world!"))
     print("textEmbeddingResult: {}",textEmbeddingResult)
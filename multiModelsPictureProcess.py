@@ -1,38 +1,43 @@
 import asyncio
+import functools
+import json
 import logging
-import os
+from typing import Dict, List, Tuple
 
-from dotenv import load_dotenv
-from openai import AsyncAzureOpenAI
+from aoaiDeploymentPool import DeploymentPool, load_deployments
+from callPolicy import call_with_policy
+from settings import configure_logging, get_settings
 
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+SYSTEM_PROMPT = "You are a helpful assistant and you are a good video player. You know teh video games very well. You can give professional description about video game's screenshot for query or understanding the game."
+DESCRIBE_PROMPT = "Describe this picture in Chinese.Do not say something like: The image appears to be a screenshot from a mobile game featuring a colorful and lively campsite. Here are some elements visible in the picture:\n\n1. **Background and Setting:**\n. Directly output the valid and useful information."
+MULTI_IMAGE_PROMPT = (
+    "Describe each of the following pictures separately in Chinese, following the same rules: " + DESCRIBE_PROMPT +
+    "\nEvery picture is preceded by its image ID. Return a JSON object of the form "
+    '{"descriptions": [{"id": "<image ID>", "description": "<description>"}]} with exactly one entry per image ID.'
+)
 
-load_dotenv(verbose=True)
+# 多图请求里每张图的输出 token 上限和单图请求一致
+MAX_TOKENS_PER_IMAGE = 500
 
-api_base = os.getenv("AZURE_OPENAI_ENDPOINT")
-api_key= os.getenv("AZURE_OPENAI_API_KEY")
-deployment_name = 'gpt-4o'
-api_version = '2024-02-15-preview' # this might change in the future
 
-aAzureOpenclient =  AsyncAzureOpenAI(
-        api_key=api_key,  
-        api_version=api_version,
-        base_url=f"{api_base}/openai/deployments/{deployment_name}"
+@functools.lru_cache(maxsize=None)
+def get_chat_deployment_pool() -> DeploymentPool:
+    # AZURE_OPENAI_CHAT_DEPLOYMENTS 可以配置多个区域/资源的 gpt-4o 部署，按配额加权路由
+    settings = get_settings()
+    return DeploymentPool(
+        "chat",
+        load_deployments(settings.chat_deployments_json, settings.azure_openai_endpoint, settings.azure_openai_api_key, settings.chat_deployment, settings.chat_api_version)
     )
 
 
-async def get_content_by_mulit_model(picture_url:str)->str:
-    logging.info(f"Getting content by muliti model of picture url: {picture_url}")
-
-    response = await aAzureOpenclient.chat.completions.create(
-        model=deployment_name,
-        seed=99,
-        messages=[
-            { "role": "system", "content": "You are a helpful assistant and you are a good video player. You know teh video games very well. You can give professional description about video game's screenshot for query or understanding the game." },
+def build_multi_model_messages(picture_url:str)->list:
+    # 在线调用和 Batch API 共用同一份提示词
+    return [
+            { "role": "system", "content": SYSTEM_PROMPT },
             { "role": "user", "content": [  
                 { 
                     "type": "text", 
-                    "text": "Describe this picture in Chinese.Do not say something like: The image appears to be a screenshot from a mobile game featuring a colorful and lively campsite. Here are some elements visible in the picture:\n\n1. **Background and Setting:**\n. Directly output the valid and useful information." 
+                    "text": DESCRIBE_PROMPT 
                 },
                 { 
                     "type": "image_url",
@@ -41,16 +46,112 @@ async def get_content_by_mulit_model(picture_url:str)->str:
                     }
                 }
             ] } 
-        ],
-        max_tokens=500 
-    )
+        ]
+
+def build_multi_image_messages(images: List[Tuple[str, str]])->list:
+    # images: [(image id, picture url)]，同一个帖子的多张图共用一次请求和一份系统提示词
+    content = [{"type": "text", "text": MULTI_IMAGE_PROMPT}]
+    for image_id, picture_url in images:
+        content.append({"type": "text", "text": f"Image ID: {image_id}"})
+        content.append({"type": "image_url", "image_url": {"url": picture_url}})
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": content},
+    ]
+
+def parse_multi_image_response(content: str, image_ids: List[str]) -> Dict[str, str]:
+    # 只返回 id 在请求里而且描述非空的条目，缺失的由调用方回退到单图请求
+    descriptions = {}
+    for entry in json.loads(content).get("descriptions", []):
+        image_id = str(entry.get("id", ""))
+        if image_id in image_ids and entry.get("description"):
+            descriptions[image_id] = entry["description"]
+    return descriptions
+
+
+async def get_content_by_mulit_model(picture_url:str)->str:
+    logging.info("Getting content by muliti model of picture url: %s", picture_url)
+
+    response = await call_with_policy("chat", lambda: get_chat_deployment_pool().call(
+        lambda client, deployment: client.chat.completions.with_raw_response.create(
+            model=deployment,
+            seed=99,
+            messages=build_multi_model_messages(picture_url),
+            max_tokens=500 
+        )
+    ))
 
     return response.choices[0].message.content
 
+async def get_contents_by_multi_model(images: List[Tuple[str, str]]) -> Dict[str, str]:
+    image_ids = [image_id for image_id, _ in images]
+    logging.info("Getting content by multi model for %s pictures: %s", len(images), image_ids)
+
+    descriptions = {}
+    try:
+        response = await call_with_policy("chat", lambda: get_chat_deployment_pool().call(
+            lambda client, deployment: client.chat.completions.with_raw_response.create(
+                model=deployment,
+                seed=99,
+                messages=build_multi_image_messages(images),
+                response_format={"type": "json_object"},
+                max_tokens=MAX_TOKENS_PER_IMAGE * len(images)
+            )
+        ))
+        descriptions = parse_multi_image_response(response.choices[0].message.content, image_ids)
+    except Exception as e:
+        # JSON 解析失败、输出被截断或者某张图触发内容过滤，整组回退到单图请求
+        logging.warning("Multi image request for %s failed, falling back to single image requests: %s", image_ids, e)
+
+    missing = [(image_id, picture_url) for image_id, picture_url in images if image_id not in descriptions]
+    if missing:
+        logging.info("Falling back to single image requests for %s pictures", len(missing))
+        results = await asyncio.gather(*(get_content_by_mulit_model(picture_url) for _, picture_url in missing))
+        descriptions.update({image_id: result for (image_id, _), result in zip(missing, results)})
+    return descriptions
+
+
+def post_id_of(image_id: str) -> str:
+    return image_id.rsplit("_", 1)[0] if "_" in image_id else image_id
+
+
+class MultiImageDescriber:
+    # 把同一个帖子的图片（id 为 <postid>_0..n）按 images_per_request 分组，每组一次 gpt-4o 请求
+    # 组内第一张图触发请求，其他图等待同一个结果
+    def __init__(self, items: list, images_per_request: int, max_concurrent_requests: int):
+        self.semaphore = asyncio.Semaphore(max_concurrent_requests)
+        self.group_of = {}
+        self.groups = []
+        self.futures = {}
+
+        posts = {}
+        for item in items:
+            posts.setdefault(post_id_of(item.id), []).append(item)
+        for post_items in posts.values():
+            for i in range(0, len(post_items), images_per_request):
+                group = [(item.id, item.imageUrl) for item in post_items[i : i + images_per_request]]
+                for image_id, _ in group:
+                    self.group_of[image_id] = len(self.groups)
+                self.groups.append(group)
+
+    async def _describe_group(self, group_index: int) -> Dict[str, str]:
+        async with self.semaphore:
+            group = self.groups[group_index]
+            if len(group) == 1:
+                return {group[0][0]: await get_content_by_mulit_model(group[0][1])}
+            return await get_contents_by_multi_model(group)
 
+    async def describe(self, item) -> str:
+        group_index = self.group_of[item.id]
+        if group_index not in self.futures:
+            self.futures[group_index] = asyncio.ensure_future(self._describe_group(group_index))
+        # shield: 某条记录的其他 stage 失败被取消时，不能取消同组其他图片共用的请求
+        descriptions = await asyncio.shield(self.futures[group_index])
+        return descriptions[item.id]
 
 
 if __name__ == "__main__":
+    configure_logging()
     # 示例调用
     contentByMulitModel = asyncio.run(get_content_by_mulit_model("https://img2.tapimg.com/moment/etag/lhZEbeJKeI5qOwQxlRSUTsZcYen0.png"))
     print("contentByMulitModel: {}",contentByMulitModel)
\ No newline at end of file
@@ -1,5 +1,5 @@
 from dataclasses import dataclass
-from typing import List
+from typing import List, Optional
 
 
 @dataclass
@@ -13,6 +13,38 @@ class Document:
     contentVector: List[float]
     ocrContentVecotor: List[float]
     imageVecotor: List[float]
+    fingerprint: Optional[str] = None
+    fusedTextVector: Optional[List[float]] = None
+    # caption 分类得到的游戏，查询按它路由；分类不出来时为空
+    game: Optional[str] = None
+
+@dataclass
+class TextPost:
+    # 源数据里有 id 时用它，没有时由 title 和 content 的哈希生成
+    id: str
+    title: str
+    content: str
+
+@dataclass
+class TextChunkDocument:
+    id: str
+    parentId: str
+    chunkIndex: int
+    title: str
+    content: str
+    contentVector: Optional[List[float]] = None
+    game: Optional[str] = None
+
+@dataclass
+class EvalQuery:
+    # 评估集里的一条查询，mode: text | image | text-image
+    query_id: str
+    mode: str
+    question: Optional[str]
+    image_url: Optional[str]
+    answer: str
+    # 带图 QA 集的帖子 id，id 以 "<postId>_" 开头的文档都算命中；为空时按答案文本重合度判断
+    post_id: Optional[str] = None
 
 @dataclass
 class ImageData:
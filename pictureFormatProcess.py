@@ -6,20 +6,44 @@ from io import BytesIO
 import httpx
 from PIL import Image
 
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+from callPolicy import call_with_policy
+from imageCache import get_image_cache
+from settings import configure_logging
 
 
 async def download_image(image_url: str) -> Image.Image:
-    logging.info(f"Downloading image from {image_url}")
-    
+    image_bytes = await download_image_bytes(image_url)
+    return Image.open(BytesIO(image_bytes))
+
+async def download_image_bytes(image_url: str) -> bytes:
+    cache = get_image_cache()
+    cached, meta = await cache.get_async(image_url) if cache is not None else (None, {})
+    if cached is not None and cache.etag_of(image_url):
+        # etag 路径的 url 内容不会变，命中就直接用
+        logging.info("Image cache hit for %s", image_url)
+        return cached
+
+    headers = {}
+    if cached is not None:
+        # 其他 url 用条件请求确认缓存是否还有效
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+
+    logging.info("Downloading image from %s", image_url)
     async with httpx.AsyncClient() as client:
-        response = await client.get(image_url)
+        response = await client.get(image_url, headers=headers)
+        if response.status_code == 304 and cached is not None:
+            return cached
         response.raise_for_status()  # 如果请求失败，则引发异常
-        image = Image.open(BytesIO(response.content))
-        return image
+
+    if cache is not None:
+        await cache.put_async(image_url, response.content, {"etag": response.headers.get("ETag"), "last_modified": response.headers.get("Last-Modified")})
+    return response.content
 
 async def save_image_as_pdf(image: Image.Image, pdf_path: str):
-    logging.info(f"Saving image as PDF to {pdf_path}")
+    logging.info("Saving image as PDF to %s", pdf_path)
 
     pdf_bytes = BytesIO()
     image.save(pdf_bytes, format="PDF")
@@ -30,9 +54,9 @@ async def save_image_as_pdf(image: Image.Image, pdf_path: str):
         pdf_file.write(pdf_bytes.getvalue())
 
 async def download_and_save_as_pdf(image_url: str, pdf_dir: str) -> str:
-    logging.info(f"Downloading image from {image_url} and saving as PDF to {pdf_dir}")
+    logging.info("Downloading image from %s and saving as PDF to %s", image_url, pdf_dir)
 
-    image = await download_image(image_url)
+    image = await call_with_policy("download", lambda: download_image(image_url))
     image_name = os.path.basename(image_url)
     pdf_name = os.path.splitext(image_name)[0] + ".pdf"
     pdf_path = os.path.join(pdf_dir, pdf_name)
@@ -40,6 +64,7 @@ async def download_and_save_as_pdf(image_url: str, pdf_dir: str) -> str:
     return pdf_path
 
 if __name__ == "__main__":
+    configure_logging()
     # 示例调用
     image_url = "https://img2.tapimg.com/moment/etag/FqoXHRQGKEuYj-ViJ-FTcPXHkRbs.png"
     pdf_dir = "docs/pdf"
@@ -2,7 +2,6 @@
 import asyncio
 import base64
 import logging
-import os
 import random
 
 from azure.ai.documentintelligence.aio import DocumentIntelligenceClient
@@ -14,30 +13,21 @@ from azure.ai.documentintelligence.models import (
 from azure.ai.vision.imageanalysis.aio import ImageAnalysisClient
 from azure.ai.vision.imageanalysis.models import VisualFeatures
 from azure.core.credentials import AzureKeyCredential
-from dotenv import load_dotenv
 
-load_dotenv(verbose=True)
+from adaptiveConcurrency import is_rate_limited
+from callPolicy import call_with_policy
+from cvEndpointPool import get_cv_endpoint_pool
+from settings import configure_logging, get_settings
 
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-
-endpoint = os.getenv("FORM_RECOGNIZER_ENDPOINT")
-key = os.getenv("FORM_RECOGNIZER_KEY")
-
-
-cvEndpointList = [
-    {"cvEndpoint": os.getenv("AZURE_COMPUTER_VISION_ENDPOINT1"), "cvEndpointKey": os.getenv("AZURE_COMPUTER_VISION_KEY1")},
-    {"cvEndpoint": os.getenv("AZURE_COMPUTER_VISION_ENDPOINT2"), "cvEndpointKey": os.getenv("AZURE_COMPUTER_VISION_KEY2")},
-    {"cvEndpoint": os.getenv("AZURE_COMPUTER_VISION_ENDPOINT3"), "cvEndpointKey": os.getenv("AZURE_COMPUTER_VISION_KEY3")}
-]
-
-# 当前使用的索引，初始为0
-endpoint_index = 0
-endpoint_lock = asyncio.Lock()  # 用于保护 endpoint_index 的锁
 
 async def analyze_document(document_path: str):
-    logging.info(f"Analyzing document {document_path}")
+    logging.info("Analyzing document %s", document_path)
+    # poller 可能一直不返回，必须有截止时间
+    return await call_with_policy("ocr", lambda: analyze_document_once(document_path))
 
-    async with DocumentIntelligenceClient(endpoint=endpoint, credential=AzureKeyCredential(key)) as document_analysis_client:
+async def analyze_document_once(document_path: str):
+    settings = get_settings()
+    async with DocumentIntelligenceClient(endpoint=settings.form_recognizer_endpoint, credential=AzureKeyCredential(settings.form_recognizer_key)) as document_analysis_client:
         poller = await document_analysis_client.begin_analyze_document(
                 "prebuilt-layout", 
                 AnalyzeDocumentRequest(bytes_source= await convert_pdf_to_base64(document_path)),
@@ -47,7 +37,7 @@ async def analyze_document(document_path: str):
         return result.content
 
 async def convert_pdf_to_base64(pdf_path: str):
-    logging.info(f"Converting PDF to base64: {pdf_path}")
+    logging.info("Converting PDF to base64: %s", pdf_path)
     # Read the PDF file in binary mode, encode it to base64, and decode to string
     with open(pdf_path, "rb") as file:
         base64_encoded_pdf = base64.b64encode(file.read()).decode()
@@ -55,50 +45,56 @@ async def convert_pdf_to_base64(pdf_path: str):
 
 
 async def get_image_caption_byCV(image_url: str, max_retries=5) -> str:
-    logging.info(f"Getting caption of image {image_url}")
+    logging.info("Getting caption of image %s", image_url)
     
     retry_count = 0
     backoff_time = 1  # 初始退避时间为 1 秒
-    global endpoint_index
 
     while retry_count < max_retries:
         try:
-             # 使用锁来保护对 endpoint_index 的访问
-            async with endpoint_lock:
-                cvEndpoint = cvEndpointList[endpoint_index]
-                endpoint_index = (endpoint_index + 1) % len(cvEndpointList)  # 轮询下一个端点
-
-            # 创建 ImageAnalysisClient 实例
-            async with ImageAnalysisClient(endpoint=cvEndpoint['cvEndpoint'], credential=AzureKeyCredential(cvEndpoint["cvEndpointKey"])) as imageAnalysisClient:
-                result = await imageAnalysisClient.analyze_from_url(
-                    image_url=image_url,
-                    visual_features=[VisualFeatures.CAPTION, VisualFeatures.READ, VisualFeatures.DENSE_CAPTIONS],
-                    gender_neutral_caption=False
-                )
-
-            # 处理返回的 dense captions
-            if result.dense_captions["values"] is not None:
-                values_list = result.dense_captions["values"]
-                combined_text = ''.join(item['text'] for item in values_list)
-                return combined_text
-            else:
-                return ""
+            return await call_with_policy("cv_caption", lambda: analyze_image_dense_captions(image_url))
 
         except Exception as e:
-            if "429" in str(e):
+            if is_rate_limited(e):
+                retry_count += 1
+                if get_settings().adaptive_concurrency:
+                    # 自适应并发已经降低了 cv_caption 的并发，重试时在 limiter 队列里等待，不再额外退避
+                    logging.warning("Rate limit exceeded. Retrying through the cv_caption concurrency limiter...")
+                    await asyncio.sleep(random.uniform(0, 0.5))
+                    continue
                 # 捕获限流错误，使用指数退避重试
-                logging.warning(f"Rate limit exceeded. Retrying in {backoff_time} seconds...")
+                logging.warning("Rate limit exceeded. Retrying in %s seconds...", backoff_time)
                 await asyncio.sleep(backoff_time + random.uniform(0, 0.5))  # 增加随机抖动
-                retry_count += 1
                 backoff_time *= 2  # 每次重试后退避时间加倍
             else:
                 # 对于非 429 错误，直接抛出异常
-                logging.error(f"Failed to get caption for image {image_url}: {e}")
+                logging.error("Failed to get caption for image %s: %s", image_url, e)
                 raise
 
     raise Exception(f"Exceeded maximum retries ({max_retries}) for image {image_url}")
 
+async def analyze_image_dense_captions(image_url: str) -> str:
+    # 和 get_picture_embedding 共用同一个轮询，对冲请求会落到下一个 endpoint
+    cvEndpoint = get_cv_endpoint_pool().next_endpoint()
+
+    # 创建 ImageAnalysisClient 实例
+    async with ImageAnalysisClient(endpoint=cvEndpoint.endpoint, credential=AzureKeyCredential(cvEndpoint.key)) as imageAnalysisClient:
+        result = await imageAnalysisClient.analyze_from_url(
+            image_url=image_url,
+            visual_features=[VisualFeatures.CAPTION, VisualFeatures.READ, VisualFeatures.DENSE_CAPTIONS],
+            gender_neutral_caption=False
+        )
+
+    # 处理返回的 dense captions
+    if result.dense_captions["values"] is not None:
+        values_list = result.dense_captions["values"]
+        combined_text = ''.join(item['text'] for item in values_list)
+        return combined_text
+    else:
+        return ""
+
 if __name__ == "__main__":
+    configure_logging()
     # 示例调用
     # document_path = "docs/pdf/lnXUR7aSAmIIRZsSITN9BFxmou0f.pdf"
     # result = asyncio.run(analyze_document(document_path))
@@ -1,5 +1,6 @@
 import argparse
 import asyncio
+import json
 import os
 import time
 
@@ -14,6 +15,9 @@ from azure.search.documents.indexes.models import (
     AzureOpenAIVectorizer,
     CorsOptions,
     HnswAlgorithmConfiguration,
+    HnswParameters,
+    ScalarQuantizationCompressionConfiguration,
+    ScalarQuantizationParameters,
     ScoringProfile,
     SearchableField,
     SearchField,
@@ -28,13 +32,105 @@ from azure.search.documents.indexes.models import (
     VectorSearch,
     VectorSearchProfile,
 )
-from dotenv import load_dotenv
 from tqdm import tqdm
 
-# 加载 .env 文件中的环境变量
-load_dotenv()
+from artifactStore import ArtifactStore
+from data_utils import parse_image_records
+from dataProcess import delete_documents_from_index
+from embeddingBackend import get_embedding_backend
+from indexState import IndexStateStore, find_deleted_ids, load_fingerprints_from_index
+from lineIndex import LineIndex
+from settings import configure_logging, get_settings
+from vectorFieldOptions import FUSED_TEXT_VECTOR_FIELD, VECTOR_FIELD_TYPES
 
 
+def vector_compression_name():
+    vector_compression = get_settings().vector_compression
+    return None if vector_compression == "none" else f"{vector_compression}Compression"
+
+def build_vector_field(name, dimensions, profile_name):
+    settings = get_settings()
+    return SearchField(name=name, 
+                        type=SearchFieldDataType.Collection(VECTOR_FIELD_TYPES[settings.vector_field_type]),
+                        # 不保存原始向量时，字段也不能被检索返回
+                        hidden=not settings.vector_stored, 
+                        stored=settings.vector_stored,
+                        searchable=True, 
+                        filterable=False, 
+                        sortable=False, 
+                        facetable=False,
+                        vector_search_dimensions=dimensions, 
+                        vector_search_profile_name=profile_name)
+
+def build_text_vector_fields():
+    # 维度由 embedding 后端决定
+    dimensions = get_embedding_backend().text_dimensions
+    if get_settings().text_vector_mode == "fused":
+        # one vector of caption + content + ocrContent, token-budgeted
+        return [build_vector_field(FUSED_TEXT_VECTOR_FIELD, dimensions, "azureOpenAIHnswProfile")]
+    return [
+        build_vector_field("captionVector", dimensions, "azureOpenAIHnswProfile"), #  the caption's vector of the picture
+        build_vector_field("contentVector", dimensions, "azureOpenAIHnswProfile"),  # content vector of the picture from gpt-4o
+        build_vector_field("ocrContentVecotor", dimensions, "azureOpenAIHnswProfile"),  # content vector of the picture from document intelligence
+    ]
+
+def build_vectorizer_name(vectorizer_name):
+    # 本地模型的向量和服务端 vectorizer 不在同一个空间，查询向量由 search_utils 计算
+    return vectorizer_name if get_embedding_backend().supports_vectorizers else None
+
+def build_vectorizers(include_computer_vision=True):
+    if not get_embedding_backend().supports_vectorizers:
+        return []
+    settings = get_settings()
+    vectorizers = [
+        AzureOpenAIVectorizer(
+            name="azureOpenAIVectorizer",
+            azure_open_ai_parameters=AzureOpenAIParameters(
+                resource_uri=settings.azure_openai_endpoint,
+                deployment_id="text-embedding-ada-002",
+                model_name="text-embedding-ada-002",
+                api_key=settings.azure_openai_api_key))
+    ]
+    if include_computer_vision:
+        vectorizers.append(
+            AIServicesVisionVectorizer(
+                name="azureComputerVisionVectorizer",
+                ai_services_vision_parameters=AIServicesVisionParameters(
+                    resource_uri=settings.cv_endpoint,
+                    api_key=settings.cv_key,
+                    model_version="2023-04-15")))
+    return vectorizers
+
+def load_hnsw_parameters():
+    # hnswBenchmark.py --save 写入的参数，没有时使用服务端默认值
+    hnsw_params_path = get_settings().hnsw_params_path
+    if not os.path.exists(hnsw_params_path):
+        return None
+    with open(hnsw_params_path, "r", encoding="utf-8") as f:
+        params = json.load(f)
+    print(f"Using HNSW parameters from {hnsw_params_path}: {params}")
+    return HnswParameters(m=params["m"], ef_construction=params["efConstruction"], ef_search=params["efSearch"], metric="cosine")
+
+def build_vector_compressions():
+    # 量化向量负责召回 oversampling 倍候选，再用全精度向量 rescore
+    settings = get_settings()
+    if settings.vector_compression == "scalar":
+        return [ScalarQuantizationCompressionConfiguration(
+                    name=vector_compression_name(),
+                    rerank_with_original_vectors=True,
+                    default_oversampling=settings.vector_oversampling,
+                    parameters=ScalarQuantizationParameters(quantized_data_type="int8"))]
+    # azure-search-documents 11.6.0b4 只有标量量化，没有 binary
+    return []
+
+def build_added_fields():
+    # 第一版索引之后加入的字段，两个索引都有；已有的索引缺少时由 ensure_fields 补上
+    return [
+        SimpleField(name="fingerprint", type=SearchFieldDataType.String, filterable=True), # hash of id, imageUrl, caption and pipeline version for incremental re-indexing
+        SimpleField(name="parentId", type=SearchFieldDataType.String, filterable=True), # post id of a text post chunk, empty for pictures
+        SimpleField(name="game", type=SearchFieldDataType.String, filterable=True, facetable=True), # game classified from the caption or post, queries are routed by it
+    ]
+
 def create_search_index(index_name, index_client):
     print(f"Ensuring search index {index_name} exists")
     if index_name not in index_client.list_index_names():
@@ -58,43 +154,9 @@ def create_search_index(index_name, index_client):
                 SearchableField(name="content", type=SearchFieldDataType.String, analyzer_name="zh-Hans.microsoft"),# context of the picture from gpt-4o
                 SimpleField(name="imageUrl", type=SearchFieldDataType.String,Searchable=False,filterable=False, sortable=True, facetable=True),# url of the picture
                 SearchableField(name="ocrContent", type=SearchFieldDataType.String,analyzer_name="zh-Hans.microsoft"), # context of the picture from document intelligence
-                SearchField(name="captionVector", 
-                            type=SearchFieldDataType.Collection(SearchFieldDataType.Single),
-                            hidden=False, 
-                            searchable=True, 
-                            filterable=False, 
-                            sortable=False, 
-                            facetable=False,
-                            vector_search_dimensions=1536, 
-                            vector_search_profile_name="azureOpenAIHnswProfile"), #  the caption's vector of the picture
-                SearchField(name="contentVector", 
-                            type=SearchFieldDataType.Collection(SearchFieldDataType.Single),
-                            hidden=False, 
-                            searchable=True, 
-                            filterable=False, 
-                            sortable=False, 
-                            facetable=False,
-                            vector_search_dimensions=1536, 
-                            vector_search_profile_name="azureOpenAIHnswProfile"),  # content vector of the picture from gpt-4o
-                SearchField(name="ocrContentVecotor", 
-                            type=SearchFieldDataType.Collection(SearchFieldDataType.Single),
-                            hidden=False, 
-                            searchable=True, 
-                            filterable=False, 
-                            sortable=False, 
-                            facetable=False,
-                            vector_search_dimensions=1536, 
-                            vector_search_profile_name="azureOpenAIHnswProfile"),  # content vector of the picture from document intelligence
-                SearchField(name="imageVecotor", 
-                            type=SearchFieldDataType.Collection(SearchFieldDataType.Single),
-                            hidden=False, 
-                            searchable=True, 
-                            filterable=False, 
-                            sortable=False, 
-                            facetable=False,
-                            vector_search_dimensions=1024, 
-                            vector_search_profile_name="azureComputerVisionHnswProfile")  # content vector of the picture from computer vision
-            ],
+                *build_added_fields(),
+                build_vector_field("imageVecotor", get_embedding_backend().image_dimensions, "azureComputerVisionHnswProfile")  # content vector of the picture from computer vision
+            ] + build_text_vector_fields(),
             semantic_search=SemanticSearch(
                 configurations=[
                     SemanticConfiguration(
@@ -114,38 +176,90 @@ def create_search_index(index_name, index_client):
             vector_search=VectorSearch(
                 algorithms=[
                     HnswAlgorithmConfiguration(
-                        name="myHnsw")
+                        name="myHnsw",
+                        parameters=load_hnsw_parameters())
                 ],
+                compressions=build_vector_compressions(),
                 profiles=[
                     VectorSearchProfile(
                         name="azureOpenAIHnswProfile",
                         algorithm_configuration_name="myHnsw",
-                        vectorizer="azureOpenAIVectorizer"),
+                        compression_configuration_name=vector_compression_name(),
+                        vectorizer=build_vectorizer_name("azureOpenAIVectorizer")),
                     VectorSearchProfile(
                         name="azureComputerVisionHnswProfile",
                         algorithm_configuration_name="myHnsw",
-                        vectorizer="azureComputerVisionVectorizer")],
-                vectorizers=[
-                    AzureOpenAIVectorizer(
-                        name="azureOpenAIVectorizer",
-                        azure_open_ai_parameters=AzureOpenAIParameters(
-                            resource_uri=os.environ.get("AZURE_OPENAI_ENDPOINT"),
-                            deployment_id="text-embedding-ada-002",
-                            model_name="text-embedding-ada-002",
-                            api_key=os.environ.get("AZURE_OPENAI_API_KEY"))),
-                    AIServicesVisionVectorizer(
-                        name="azureComputerVisionVectorizer",
-                        ai_services_vision_parameters=AIServicesVisionParameters(
-                            resource_uri=os.environ.get("AZURE_COMPUTER_VISION_ENDPOINT"),
-                            api_key=os.environ.get("AZURE_COMPUTER_VISION_KEY"),
-                            model_version="2023-04-15"))
-                ]
+                        compression_configuration_name=vector_compression_name(),
+                        vectorizer=build_vectorizer_name("azureComputerVisionVectorizer"))],
+                vectorizers=build_vectorizers()
             )
         )
         print(f"Creating {index_name} search index")
         index_client.create_index(index)
     else:
         print(f"Search index {index_name} already exists")
+        ensure_fields(index_name, index_client, build_added_fields())
+
+def create_text_post_index(index_name, index_client):
+    # 文本帖子的 chunk 索引，字段名和图片索引一致，caption 存帖子标题
+    print(f"Ensuring text post index {index_name} exists")
+    if index_name not in index_client.list_index_names():
+        index = SearchIndex(
+            name=index_name,
+            cors_options = CorsOptions(allowed_origins=["*"], max_age_in_seconds=600),
+            fields=[
+                SimpleField(name="id", type=SearchFieldDataType.String, key=True,searchable=False, filterable=True, sortable=True, facetable=False),
+                SimpleField(name="chunkIndex", type=SearchFieldDataType.Int32, filterable=True, sortable=True),
+                *build_added_fields(),
+                SearchableField(name="caption", type=SearchFieldDataType.String, analyzer_name="zh-Hans.microsoft"), # title of the post
+                SearchableField(name="content", type=SearchFieldDataType.String, analyzer_name="zh-Hans.microsoft"), # text of the chunk
+                build_vector_field("contentVector", get_embedding_backend().text_dimensions, "azureOpenAIHnswProfile"), # vector of title + chunk text
+            ],
+            semantic_search=SemanticSearch(
+                configurations=[
+                    SemanticConfiguration(
+                        name="default",
+                        prioritized_fields=SemanticPrioritizedFields(
+                            title_field=SemanticField(field_name="caption"),
+                            content_fields=[SemanticField(field_name="content")]
+                        ),
+                    )
+                ]
+            ),
+            vector_search=VectorSearch(
+                algorithms=[
+                    HnswAlgorithmConfiguration(
+                        name="myHnsw",
+                        parameters=load_hnsw_parameters())
+                ],
+                compressions=build_vector_compressions(),
+                profiles=[
+                    VectorSearchProfile(
+                        name="azureOpenAIHnswProfile",
+                        algorithm_configuration_name="myHnsw",
+                        compression_configuration_name=vector_compression_name(),
+                        vectorizer=build_vectorizer_name("azureOpenAIVectorizer"))],
+                vectorizers=build_vectorizers(include_computer_vision=False)
+            )
+        )
+        print(f"Creating {index_name} text post index")
+        index_client.create_index(index)
+    else:
+        print(f"Text post index {index_name} already exists")
+        ensure_fields(index_name, index_client, build_added_fields())
+
+def ensure_fields(index_name, index_client, fields):
+    # 旧索引缺少的字段上传时会报 unknown field；已有索引可以加字段（不能改或删），旧文档的新字段为 null
+    index = index_client.get_index(index_name)
+    existing = {field.name for field in index.fields}
+    missing = [field for field in fields if field.name not in existing]
+    if not missing:
+        return
+    index.fields.extend(missing)
+    index_client.create_or_update_index(index)
+    print(f"Added fields {', '.join(field.name for field in missing)} to {index_name}")
+    if any(field.name == "game" for field in missing):
+        print("Run reindex.py to tag the existing documents with their game")
 
 
 def validate_index(index_name, index_client):
@@ -163,64 +277,61 @@ def validate_index(index_name, index_client):
             print(f"The average chunk size of the index is {average_chunk_size} bytes.")
             break
 
-async def create_and_populate_index(index_name:str, index_client:SearchIndexClient,search_client:SearchClient):
+async def create_and_populate_index(index_name:str, index_client:SearchIndexClient,search_client:SearchClient,incremental:bool=False):
     # create or update search index with compatible schema
-    create_search_index(index_name, index_client)
+    # 本地 embedding 后端的维度要等 worker 进程加载完模型，放到线程里执行，不阻塞事件循环
+    await asyncio.get_running_loop().run_in_executor(None, create_search_index, index_name, index_client)
+
+    settings = get_settings()
+    file_path = settings.multi_models_file_path
+    lines_per_chunk = settings.lines_per_chunk
+    # 扫描一次输入文件并保存行偏移索引，worker 按行范围直接读取，不再写临时 chunk 文件
+    line_index = LineIndex.load_or_build(file_path)
+    shard_ranges = line_index.shard_ranges(lines_per_chunk)
 
-    file_path = os.getenv("multi_models_file_path")
-    temp_dir=os.getenv("temp_dir")
-    lines_per_chunk = int(os.getenv("lines_per_chunk"))
-    # process data file
-    small_files = await split_file(file_path, temp_dir, lines_per_chunk)
+    if incremental:
+        # 删除只能基于完整的输入文件判断，不能在每个 chunk 里做
+        await remove_deleted_records(file_path, search_client)
 
-    print("chunk large file into smaller files's count:",len(small_files))
+    print(f"{line_index.line_count} lines in {file_path}, {len(shard_ranges)} shards of {lines_per_chunk} lines")
     print("Validating index...")
     validate_index(index_name, index_client)
 
-# Function to split the large file into smaller chunks
-async def split_file(file_path, temp_dir, lines_per_chunk=100):
-    # Get the base file name without extension
-    file_name = os.path.splitext(os.path.basename(file_path))[0]
-    
-    small_files = []
-    with open(file_path, 'r') as f:
-        chunk = []
-        file_count = 0
-        for line in f:
-            chunk.append(line)
-            # Once we have enough lines, write them to a new small file
-            if len(chunk) == lines_per_chunk:
-                # Include the original file name in the chunk file name
-                small_file_path = os.path.join(temp_dir, f'{file_name}_chunk_{file_count}.txt')
-                with open(small_file_path, 'w') as small_file:
-                    small_file.writelines(chunk)
-                small_files.append(small_file_path)
-                chunk = []
-                file_count += 1
-        
-        # Write any remaining lines as the last chunk
-        if chunk:
-            small_file_path = os.path.join(temp_dir, f'{file_name}_chunk_{file_count}.txt')
-            with open(small_file_path, 'w') as small_file:
-                small_file.writelines(chunk)
-            small_files.append(small_file_path)
-    
-    return small_files
+async def remove_deleted_records(file_path:str, search_client:SearchClient):
+    state_store = IndexStateStore()
+    if not state_store.all_ids():
+        print("Local index state is empty, loading fingerprints from index...")
+        state_store.upsert_fingerprints(await load_fingerprints_from_index(search_client))
+
+    deleted_ids = find_deleted_ids(parse_image_records(file_path), state_store)
+    print(f"records removed from input file: {len(deleted_ids)}")
+    if deleted_ids:
+        await delete_documents_from_index(deleted_ids, search_client)
+        if get_settings().artifact_dir:
+            # 不写 tombstone 的话，从 artifact 重建索引会把删除的记录带回来
+            ArtifactStore().save_tombstones(deleted_ids, f"deleted-{int(time.time())}")
+        state_store.delete(deleted_ids)
+    state_store.close()
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create the search index and index the input file's line offsets for sharding.")
+    parser.add_argument("--incremental", action="store_true", help="delete index documents whose ids disappeared from the input file")
+    args = parser.parse_args()
+
     # Use the current user identity to connect to Azure services unless a key is explicitly set for any of them
-    search_creds = AzureKeyCredential(os.getenv("AZURE_COGNITIVE_SEARCH_KEY"))
-    search_service = os.getenv("AZURE_SEARCH_SERVICE")
-    index_name = os.getenv("AZURE_SEARCH_INDEX")
+    configure_logging()
+    settings = get_settings()
+    search_creds = AzureKeyCredential(settings.search_key)
+    index_name = settings.search_index
 
     print("Data preparation script started")
     print("Preparing data for index:", index_name)
-    search_endpoint = f"https://{search_service}.search.windows.net/"
+    search_endpoint = settings.search_endpoint
     index_client = SearchIndexClient(endpoint=search_endpoint, credential=search_creds)
 
     search_client = SearchClient(
         endpoint=search_endpoint, credential=search_creds, index_name=index_name
     )
 
-    asyncio.run(create_and_populate_index(index_name, index_client,search_client))
+    asyncio.run(create_and_populate_index(index_name, index_client,search_client,args.incremental))
     print("Data preparation for index", index_name, "completed")
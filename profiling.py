@@ -0,0 +1,180 @@
+"""--profile support for dataProcess.py and batchDataProcess.py.
+
+Each profiled process runs a sampling thread that records the event-loop thread's stack
+every profile_interval_ms, and an asyncio task that ticks every LAG_INTERVAL seconds and
+measures how late it wakes up (event-loop lag). While the tick is overdue by more than
+profile_block_threshold_ms the loop is blocked by a sync call, and the sampled stacks are
+also counted as blocking time, which points at the callback that holds the loop.
+
+Every run gets its own directory profile_dir/run-<timestamp>, every process writes to it:
+
+    <name>-<pid>.folded   collapsed stacks ("a;b;c count"), the input of flamegraph.pl / speedscope
+    <name>-<pid>.json     lag percentiles, idle share and the top blocking stacks
+
+merge_profiles() sums the folded files into merged.folded and prints a combined summary.
+Samples whose stack ends in selectors.select are the loop waiting on the network, so a high
+idle share means remote latency, a high lag means blocking sync code, and neither means CPU.
+"""
+import argparse
+import asyncio
+import collections
+import glob
+import json
+import os
+import sys
+import threading
+import time
+from typing import Dict, List
+
+from settings import get_settings
+
+# 事件循环 lag 的检测周期（秒）
+LAG_INTERVAL = 0.05
+# 报告里列出多少个阻塞最久的调用栈
+TOP_BLOCKING_STACKS = 15
+MERGED_FILE = "merged.folded"
+
+
+def fold_stack(frame) -> str:
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * p / 100), len(ordered) - 1)]
+
+
+class Profiler:
+    def __init__(self, output_dir: str, name: str, interval: float, block_threshold: float):
+        self.output_dir = output_dir
+        self.name = name
+        self.interval = interval
+        self.block_threshold = block_threshold
+        self.samples = collections.Counter()
+        # 事件循环被阻塞期间采到的调用栈 -> 阻塞时间（秒）
+        self.blocking = collections.Counter()
+        self.lags = []
+        self.last_tick = None
+        self.loop_thread_id = None
+        self.stopped = threading.Event()
+        self.sampler = None
+        self.start_time = None
+
+    def start(self):
+        # 在事件循环所在的线程调用
+        self.loop_thread_id = threading.get_ident()
+        self.start_time = time.monotonic()
+        self.sampler = threading.Thread(target=self._sample, name="profile-sampler", daemon=True)
+        self.sampler.start()
+
+    def _sample(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.loop_thread_id)
+            if frame is None:
+                continue
+            stack = fold_stack(frame)
+            self.samples[stack] += 1
+            if self.last_tick is not None and time.monotonic() - self.last_tick > self.block_threshold:
+                self.blocking[stack] += self.interval
+
+    async def monitor_loop(self):
+        while True:
+            self.last_tick = time.monotonic()
+            await asyncio.sleep(LAG_INTERVAL)
+            self.lags.append(max(time.monotonic() - self.last_tick - LAG_INTERVAL, 0.0))
+
+    def stop(self) -> str:
+        self.stopped.set()
+        self.sampler.join()
+        os.makedirs(self.output_dir, exist_ok=True)
+        base_path = os.path.join(self.output_dir, f"{self.name}-{os.getpid()}")
+        with open(base_path + ".folded", "w", encoding="utf-8") as f:
+            for stack, count in self.samples.items():
+                f.write(f"{stack} {count}\n")
+        with open(base_path + ".json", "w", encoding="utf-8") as f:
+            json.dump(self.summary(), f, ensure_ascii=False, indent=2)
+        return base_path
+
+    def summary(self) -> dict:
+        total = sum(self.samples.values())
+        idle = sum(count for stack, count in self.samples.items() if stack.endswith("selectors.py:select"))
+        return {
+            "name": self.name,
+            "pid": os.getpid(),
+            "seconds": round(time.monotonic() - self.start_time, 1),
+            "samples": total,
+            "idle_share": round(idle / total, 3) if total else 0.0,
+            "lag_p50_ms": round(percentile(self.lags, 50) * 1000, 1),
+            "lag_p99_ms": round(percentile(self.lags, 99) * 1000, 1),
+            "lag_max_ms": round(max(self.lags, default=0.0) * 1000, 1),
+            "blocked_seconds": round(sum(self.blocking.values()), 2),
+            "blocking_stacks": [{"stack": stack, "seconds": round(seconds, 2)} for stack, seconds in self.blocking.most_common(TOP_BLOCKING_STACKS)],
+        }
+
+
+def new_profile_dir(root: str = None) -> str:
+    # 每次运行一个目录，合并时不会混入之前的 profile
+    path = os.path.join(root or get_settings().profile_dir, time.strftime("run-%Y%m%d-%H%M%S"))
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def create_profiler(name: str, output_dir: str = None) -> Profiler:
+    settings = get_settings()
+    return Profiler(output_dir or new_profile_dir(), name, settings.profile_interval_ms / 1000, settings.profile_block_threshold_ms / 1000)
+
+async def run_profiled(coro, profiler: Profiler):
+    profiler.start()
+    monitor = asyncio.ensure_future(profiler.monitor_loop())
+    try:
+        return await coro
+    finally:
+        monitor.cancel()
+        base_path = profiler.stop()
+        print(f"Profile written to {base_path}.folded and {base_path}.json")
+
+def merge_profiles(output_dir: str) -> Dict[str, int]:
+    merged = collections.Counter()
+    for folded_path in glob.glob(os.path.join(output_dir, "*.folded")):
+        if os.path.basename(folded_path) == MERGED_FILE:
+            continue
+        with open(folded_path, "r", encoding="utf-8") as f:
+            for line in f:
+                stack, _, count = line.rstrip("\n").rpartition(" ")
+                merged[stack] += int(count)
+    with open(os.path.join(output_dir, MERGED_FILE), "w", encoding="utf-8") as f:
+        for stack, count in merged.most_common():
+            f.write(f"{stack} {count}\n")
+
+    summaries = []
+    for summary_path in glob.glob(os.path.join(output_dir, "*.json")):
+        with open(summary_path, "r", encoding="utf-8") as f:
+            summaries.append(json.load(f))
+    blocking = collections.Counter()
+    for summary in summaries:
+        for entry in summary["blocking_stacks"]:
+            blocking[entry["stack"]] += entry["seconds"]
+
+    total = sum(merged.values())
+    print(f"Merged {len(summaries)} profiles, {total} samples, into {os.path.join(output_dir, MERGED_FILE)}")
+    if summaries:
+        print(f"idle share {sum(s['idle_share'] * s['samples'] for s in summaries) / max(total, 1):.1%}, "
+              f"worst lag p99 {max(s['lag_p99_ms'] for s in summaries)} ms, max {max(s['lag_max_ms'] for s in summaries)} ms, "
+              f"blocked {sum(s['blocked_seconds'] for s in summaries):.1f} s")
+    for stack, seconds in blocking.most_common(TOP_BLOCKING_STACKS):
+        # 只显示调用栈最后几层，完整的栈在 json 里
+        print(f"  blocked {seconds:7.2f} s  {';'.join(stack.split(';')[-4:])}")
+    return dict(merged)
+
+
+if __name__ == "__main__":
+    # 示例调用: 重新合并一次运行的 profile
+    parser = argparse.ArgumentParser(description="Merge the per-worker profiles of one run into merged.folded.")
+    parser.add_argument("run_dir", help="e.g. docs/profile/run-20240101-120000")
+    args = parser.parse_args()
+    merge_profiles(args.run_dir)
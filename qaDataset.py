@@ -0,0 +1,33 @@
+"""Read the QA test sets (one {"question": ..., "answer": ...} object per line).
+
+The files are edited by hand and some lines carry trailing garbage, e.g. line 104 of
+qa_3.txt ends with an extra "}". Every line is read with raw_decode, which keeps the first
+complete object and ignores what follows it; a line without any valid object is skipped
+with a warning instead of failing the whole evaluation.
+"""
+import json
+import logging
+from typing import Dict, List
+
+_decoder = json.JSONDecoder()
+
+
+def load_qa_records(qa_path: str) -> List[Dict]:
+    records = []
+    with open(qa_path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record, end = _decoder.raw_decode(line)
+            except json.JSONDecodeError as e:
+                logging.warning("Skipping malformed line %s of %s: %s", line_number, qa_path, e)
+                continue
+            if not isinstance(record, dict) or "question" not in record:
+                logging.warning("Skipping line %s of %s: no question", line_number, qa_path)
+                continue
+            if line[end:].strip():
+                logging.warning("Ignoring trailing characters on line %s of %s: %r", line_number, qa_path, line[end:].strip())
+            records.append(record)
+    return records
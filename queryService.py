@@ -0,0 +1,171 @@
+"""Long-running query service: retrieval plus a GPT-4o answer streamed back as Server-Sent Events.
+
+    POST /api/query/text        {"question": "..."}
+    POST /api/query/image       {"imageUrl": "..."}
+    POST /api/query/text-image  {"question": "...", "imageUrl": "..."}
+
+The stream sends one `context` event with the retrieved documents, a `token` event per
+generated delta and a final `done` event with timings. Send "stream": false to get a
+single JSON response instead. Search, embedding and chat clients are created once per
+process and shared by all requests.
+"""
+import argparse
+import json
+import logging
+import time
+from typing import AsyncIterator, List, Optional
+
+from aiohttp import web
+
+from adaptiveConcurrency import limiter_metrics
+from multiModelsPictureProcess import get_chat_deployment_pool
+from search_utils import (
+    get_search_client,
+    get_search_results_by_image,
+    get_search_results_by_image_and_text,
+    get_search_results_by_text,
+)
+from settings import configure_logging
+
+ANSWER_SYSTEM_PROMPT = """You are a helpful assistant and you are a good video player.
+You know teh video games very well. You can give professional answer about video game's questions or screenshots.
+But you have answer the question or screenshot or enrich the content based on the given context and images.
+The context is a list of entries named context1, context2, ..., each with caption, content, ocrContent and imageUrl.
+You can use the caption, content and ocrContent to answer the question if they are related to the question.
+Answer in Chinese and mention which contexts you used, e.g. [context1]."""
+
+CONTEXT_FIELDS = ["id", "caption", "content", "ocrContent", "imageUrl"]
+
+
+def build_context(results: List[dict]) -> str:
+    context = ""
+    for i, result in enumerate(results, start=1):
+        context += f"context{i}：\n\n"
+        context += f"caption:\n{result['caption']}\n\n"
+        context += f"content:\n{result['content']}\n\n"
+        context += f"ocrContent:\n{result['ocrContent']}\n\n"
+        context += f"imageUrl:\n{result['imageUrl']}\n\n"
+        context += "-------\n\n"
+    return context
+
+def build_answer_messages(question: Optional[str], context: str, image_url: Optional[str]) -> list:
+    user_prompt = f"user question is : {question or '请描述这张图片并回答相关的问题'}\n"
+    if image_url:
+        user_prompt += "and with the image.\n"
+    user_prompt += f"\nanswer the question based the context: {context}"
+
+    content = [{"type": "text", "text": user_prompt}]
+    if image_url:
+        content.append({"type": "image_url", "image_url": {"url": image_url}})
+    return [
+        {"role": "system", "content": ANSWER_SYSTEM_PROMPT},
+        {"role": "user", "content": content},
+    ]
+
+async def stream_answer(messages: list, max_tokens: int = 800) -> AsyncIterator[str]:
+    # 部署池只在拿到流之前做故障切换，开始输出后不再切换
+    stream = await get_chat_deployment_pool().call(
+        lambda client, deployment: client.chat.completions.with_raw_response.create(
+            model=deployment,
+            messages=messages,
+            max_tokens=max_tokens,
+            stream=True
+        )
+    )
+    async for chunk in stream:
+        # Azure 的第一个 chunk 只有内容过滤结果，没有 choices
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+async def retrieve(question: Optional[str], image_url: Optional[str]) -> List[dict]:
+    if question and image_url:
+        return await get_search_results_by_image_and_text(image_url, question)
+    if image_url:
+        return await get_search_results_by_image(image_url)
+    return await get_search_results_by_text(question)
+
+def sse_event(event: str, data) -> bytes:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8")
+
+async def handle_query(request: web.Request, require_question: bool, require_image: bool) -> web.StreamResponse:
+    body = await request.json()
+    question = body.get("question")
+    image_url = body.get("imageUrl")
+    if (require_question and not question) or (require_image and not image_url):
+        raise web.HTTPBadRequest(text="question and/or imageUrl missing")
+
+    start_time = time.perf_counter()
+    results = await retrieve(question if require_question else None, image_url if require_image else None)
+    retrieval_ms = (time.perf_counter() - start_time) * 1000
+    context_docs = [{field: result.get(field) for field in CONTEXT_FIELDS} for result in results]
+    messages = build_answer_messages(question, build_context(results), image_url if require_image else None)
+
+    if not body.get("stream", True):
+        answer = "".join([token async for token in stream_answer(messages)])
+        total_ms = (time.perf_counter() - start_time) * 1000
+        return web.json_response({"answer": answer, "context": context_docs, "retrieval_ms": retrieval_ms, "total_ms": total_ms})
+
+    response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+    await response.prepare(request)
+    await response.write(sse_event("context", context_docs))
+
+    first_token_ms = None
+    try:
+        async for token in stream_answer(messages):
+            if first_token_ms is None:
+                first_token_ms = (time.perf_counter() - start_time) * 1000
+            await response.write(sse_event("token", {"text": token}))
+    except Exception as e:
+        # 响应头已经发出，只能通过事件告诉客户端
+        logging.error("Answer generation failed: %s", e)
+        await response.write(sse_event("error", {"message": str(e)}))
+        await response.write_eof()
+        return response
+
+    total_ms = (time.perf_counter() - start_time) * 1000
+    logging.info("Query answered: retrieval %.0f ms, first token %.0f ms, total %.0f ms", retrieval_ms, first_token_ms or total_ms, total_ms)
+    await response.write(sse_event("done", {"retrieval_ms": retrieval_ms, "first_token_ms": first_token_ms, "total_ms": total_ms}))
+    await response.write_eof()
+    return response
+
+async def query_text(request: web.Request):
+    return await handle_query(request, require_question=True, require_image=False)
+
+async def query_image(request: web.Request):
+    return await handle_query(request, require_question=False, require_image=True)
+
+async def query_text_image(request: web.Request):
+    return await handle_query(request, require_question=True, require_image=True)
+
+async def healthz(request: web.Request):
+    return web.json_response({"status": "ok"})
+
+async def metrics(request: web.Request):
+    # 每个服务当前的并发上限和最近的调整记录
+    return web.json_response({"concurrency": limiter_metrics()})
+
+async def close_clients(app: web.Application):
+    if get_search_client.cache_info().currsize:
+        await get_search_client().close()
+
+def create_app() -> web.Application:
+    app = web.Application()
+    app.add_routes([
+        web.post("/api/query/text", query_text),
+        web.post("/api/query/image", query_image),
+        web.post("/api/query/text-image", query_text_image),
+        web.get("/healthz", healthz),
+        web.get("/metrics", metrics),
+    ])
+    app.on_cleanup.append(close_clients)
+    return app
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve text, image and text+image RAG queries with streamed answers.")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+
+    configure_logging()
+    # 示例调用: curl -N -X POST localhost:8000/api/query/text -d '{"question": "DNF手游伤害为什么是黄字？"}'
+    web.run_app(create_app(), host=args.host, port=args.port)
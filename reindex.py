@@ -0,0 +1,86 @@
+"""Rebuild a search index from the enrichment artifact store without calling any model.
+
+Use it after a schema change, for a new index name or for a quantization experiment:
+
+    python reindex.py --index images-v2 --create
+"""
+import argparse
+import asyncio
+import itertools
+import logging
+import time
+
+from azure.core.credentials import AzureKeyCredential
+from azure.search.documents.aio import SearchClient
+from azure.search.documents.indexes import SearchIndexClient
+
+from artifactStore import ArtifactStore
+from dataProcess import upload_documents_to_index
+from gamePartition import get_game_classifier
+from prepdocs import create_search_index
+from settings import configure_logging, get_settings
+
+
+async def reindex_from_store(store: ArtifactStore, search_client: SearchClient, upload_batch_size: int = 100, concurrency: int = 4) -> int:
+    # 分块读取 store，同时保持 concurrency 个上传请求在途
+    upload_slots = asyncio.Semaphore(concurrency)
+    tasks = []
+    start_time = time.time()
+
+    async def upload_block(block):
+        try:
+            await upload_documents_to_index(block, search_client, upload_batch_size)
+            return len(block)
+        finally:
+            upload_slots.release()
+
+    documents = store.iter_documents()
+    classifier = get_game_classifier()
+    while True:
+        block = list(itertools.islice(documents, upload_batch_size))
+        if not block:
+            break
+        for document in block:
+            # 按当前规则重新分类，修改 game_rules_path 后重建索引即可生效
+            document.game = classifier.classify(document.caption)
+        await upload_slots.acquire()
+        # 保留所有 task，已经结束的块的异常也要取回
+        tasks.append(asyncio.ensure_future(upload_block(block)))
+
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    # 只统计上传成功的文档
+    uploaded = sum(result for result in results if not isinstance(result, BaseException))
+    errors = [result for result in results if isinstance(result, BaseException)]
+
+    elapsed = time.time() - start_time
+    print(f"Uploaded {uploaded} documents in {elapsed:.1f} seconds ({uploaded / max(elapsed, 1e-6):.0f} docs/s)")
+    if errors:
+        for error in errors:
+            logging.error("Reindex block failed: %s", error)
+        raise Exception(f"{len(errors)} of {len(tasks)} upload blocks failed, {uploaded} documents uploaded")
+    return uploaded
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk-load a search index from the enrichment artifact store.")
+    parser.add_argument("--index", help="target index, defaults to AZURE_SEARCH_INDEX")
+    parser.add_argument("--store", help="artifact directory, defaults to artifact_dir")
+    parser.add_argument("--create", action="store_true", help="create the index with the current schema settings first")
+    parser.add_argument("--batch-size", type=int, default=100, help="documents per upload request, keep requests under the 16 MB limit")
+    parser.add_argument("--concurrency", type=int, default=4, help="upload requests in flight")
+    args = parser.parse_args()
+
+    configure_logging()
+    settings = get_settings()
+    search_creds = AzureKeyCredential(settings.search_key)
+    index_name = args.index or settings.search_index
+    store = ArtifactStore(args.store)
+    print(f"Reindexing {store.count()} documents from {store.root} into {index_name}")
+
+    if args.create:
+        create_search_index(index_name, SearchIndexClient(endpoint=settings.search_endpoint, credential=search_creds))
+
+    async def main():
+        async with SearchClient(endpoint=settings.search_endpoint, credential=search_creds, index_name=index_name) as search_client:
+            await reindex_from_store(store, search_client, args.batch_size, args.concurrency)
+
+    asyncio.run(main())
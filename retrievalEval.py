@@ -0,0 +1,270 @@
+"""Retrieval evaluation over the QA test sets, through the same search_utils functions as the query service.
+
+    python retrievalEval.py                                # both sets, all modes, real index
+    python retrievalEval.py --local-store docs/artifacts   # local stand-in built from the artifact store
+
+带图QA测试集.xlsx has the post id (sls_id) of every question, so a result is relevant when its id
+is "<sls_id>_<n>"; each row is run as a text, an image and a text+image query. qa_3.txt has
+only question / answer pairs, so a result counts as relevant when it contains enough of the
+answer's character bigrams. recall@k is the share of queries with a relevant result in the top
+k. Cost per query is estimated from the remote calls each mode makes and the unit prices in
+UNIT_PRICES (override with --prices).
+
+The local stand-in ranks the stored documents with the same hybrid shape as search_index:
+a keyword score with the firstProfile weights plus one cosine ranking per vector field,
+merged with reciprocal rank fusion. There is no semantic reranker, so its absolute numbers are
+lower than the real index; use it to compare two pipeline variants against each other.
+"""
+import argparse
+import asyncio
+import json
+import re
+import time
+import xml.etree.ElementTree as ET
+import zipfile
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from artifactStore import ArtifactStore
+from embeddingBackend import get_embedding_backend
+from fusedTextVector import get_encoding
+from gamePartition import get_game_classifier
+from objectDefinition import EvalQuery
+from qaDataset import load_qa_records
+from search_utils import get_search_results_by_image, get_search_results_by_image_and_text, get_search_results_by_text, search_index
+from settings import configure_logging
+from vectorFieldOptions import get_text_vector_fields
+
+MODES = ["text", "image", "text-image"]
+# 答案的字符 bigram 有多少出现在文档里才算命中
+ANSWER_OVERLAP_THRESHOLD = 0.3
+# 和 prepdocs 里 firstProfile 的权重一致
+KEYWORD_WEIGHTS = {"caption": 5, "content": 1, "ocrContent": 2}
+RRF_K = 60
+# 图片查询的 embedding 输入是 OCR + caption，评估时拿不到，按这个 token 数估算
+IMAGE_QUERY_TOKENS = 200
+
+# 美元单价，写这段代码时的公开价格，实际价格以账单为准
+UNIT_PRICES = {
+    "embedding_per_1k_tokens": 0.0001,  # text-embedding-ada-002
+    "cv_vectorize_text": 0.000014,
+    "cv_vectorize_image": 0.0001,
+    "cv_caption": 0.0015,  # Image Analysis dense captions
+    "ocr_page": 0.0015,  # Document Intelligence read
+}
+
+XLSX_NAMESPACE = {"x": "http://schemas.openxmlformats.org/spreadsheetml/2006/main"}
+
+
+def load_text_qa_set(qa_path: str) -> List[EvalQuery]:
+    return [EvalQuery(query_id=f"qa-{i}", mode="text", question=record["question"], image_url=None, answer=record.get("answer", ""))
+            for i, record in enumerate(load_qa_records(qa_path))]
+
+def read_xlsx_rows(xlsx_path: str) -> List[Dict[str, str]]:
+    # 只有一个简单的 sheet，用标准库解析，不为这个引入 openpyxl
+    with zipfile.ZipFile(xlsx_path) as z:
+        shared_strings = [
+            "".join(t.text or "" for t in si.iter(f"{{{XLSX_NAMESPACE['x']}}}t"))
+            for si in ET.fromstring(z.read("xl/sharedStrings.xml")).findall("x:si", XLSX_NAMESPACE)
+        ]
+        sheet = ET.fromstring(z.read("xl/worksheets/sheet1.xml"))
+
+    rows = []
+    for row in sheet.iter(f"{{{XLSX_NAMESPACE['x']}}}row"):
+        values = {}
+        for cell in row.findall("x:c", XLSX_NAMESPACE):
+            column = re.match(r"[A-Z]+", cell.get("r")).group(0)
+            value = cell.find("x:v", XLSX_NAMESPACE)
+            if value is not None:
+                values[column] = shared_strings[int(value.text)] if cell.get("t") == "s" else value.text
+        rows.append(values)
+    header = rows[0]
+    return [{header[column]: value for column, value in row.items() if column in header} for row in rows[1:]]
+
+def load_image_qa_set(xlsx_path: str, modes: List[str]) -> List[EvalQuery]:
+    queries = []
+    for row in read_xlsx_rows(xlsx_path):
+        if not row.get("question") or not row.get("images"):
+            continue
+        # images 列的格式: [url1, url2]，查询使用第一张图
+        image_url = row["images"].strip("[]").split(",")[0].strip()
+        for mode in modes:
+            queries.append(EvalQuery(query_id=f"{row['sls_id']}-{mode}", mode=mode,
+                                     question=row["question"] if mode != "image" else None,
+                                     image_url=image_url if mode != "text" else None,
+                                     answer=row.get("answer", ""), post_id=row["sls_id"]))
+    return queries
+
+def bigrams(text: str) -> set:
+    text = re.sub(r"\s+", "", text or "")
+    return {text[i : i + 2] for i in range(len(text) - 1)}
+
+def is_relevant(query: EvalQuery, document: dict) -> bool:
+    if query.post_id:
+        return str(document["id"]).startswith(f"{query.post_id}_")
+    answer = bigrams(query.answer)
+    if not answer:
+        return False
+    document_text = bigrams("".join(document.get(field) or "" for field in ("caption", "content", "ocrContent")))
+    return len(answer & document_text) / len(answer) >= ANSWER_OVERLAP_THRESHOLD
+
+def estimate_query_cost(query: EvalQuery, prices: dict) -> float:
+    # 本地 embedding 后端不产生 embedding 和向量化费用
+    remote_embeddings = get_embedding_backend().name == "azure"
+    tokens = len(get_encoding().encode(query.question)) if query.question else IMAGE_QUERY_TOKENS
+    cost = 0.0
+    if remote_embeddings:
+        cost += tokens / 1000 * prices["embedding_per_1k_tokens"]
+        cost += prices["cv_vectorize_image"] if query.image_url else prices["cv_vectorize_text"]
+    if query.mode == "image":
+        # 纯图片查询还要做 OCR 和 CV caption
+        cost += prices["ocr_page"] + prices["cv_caption"]
+    return cost
+
+
+class LocalSearchIndex:
+    def __init__(self, store: ArtifactStore):
+        self.documents = []
+        vectors = {field: [] for field in get_text_vector_fields() + ["imageVecotor"]}
+        for document in store.iter_documents():
+            # 和 reindex 一样按当前规则重新分类，规则改了不需要重新生成 artifact
+            self.documents.append({"id": document.id, "caption": document.caption, "content": document.content,
+                                   "ocrContent": document.ocrContent, "imageUrl": document.imageUrl,
+                                   "game": get_game_classifier().classify(document.caption)})
+            for field in vectors:
+                vectors[field].append(getattr(document, field))
+        self.vectors = {}
+        for field, rows in vectors.items():
+            if any(row is None for row in rows):
+                print(f"Skipping {field}: missing on some stored documents")
+                continue
+            matrix = np.asarray(rows, dtype=np.float32)
+            self.vectors[field] = matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+        self.bigrams = [{field: bigrams(document[field]) for field in KEYWORD_WEIGHTS} for document in self.documents]
+        print(f"Local search index: {len(self.documents)} documents, vector fields {sorted(self.vectors)}")
+
+    def _keyword_ranking(self, search_text: str, candidates: int, allowed: np.ndarray) -> List[int]:
+        query = bigrams(search_text)
+        scores = np.array([sum(weight * len(query & doc[field]) for field, weight in KEYWORD_WEIGHTS.items()) for doc in self.bigrams], dtype=np.float32)
+        scores[~allowed] = 0
+        return [i for i in np.argsort(scores)[::-1][:candidates] if scores[i] > 0]
+
+    def _vector_ranking(self, field: str, vector: List[float], candidates: int, allowed: np.ndarray) -> List[int]:
+        query = np.asarray(vector, dtype=np.float32)
+        scores = self.vectors[field] @ (query / max(np.linalg.norm(query), 1e-12))
+        scores[~allowed] = -np.inf
+        return [i for i in np.argsort(-scores)[:candidates].tolist() if allowed[i]]
+
+    async def search(self, search_text: str, aoai_embedding_query: List[float], cv_embedding_query: List[float], top: int = 3, game: Optional[str] = None) -> List[dict]:
+        # 和 search_index 的参数一致；每路召回 top * 5 个候选再做 RRF
+        candidates = top * 5
+        # 和 build_game_filter 一样: 这个游戏的文档加上没有分类的文档
+        allowed = np.array([game is None or document["game"] in (game, None) for document in self.documents], dtype=bool)
+        rankings = [self._keyword_ranking(search_text, candidates, allowed)]
+        for field in get_text_vector_fields():
+            if field in self.vectors:
+                rankings.append(self._vector_ranking(field, aoai_embedding_query, candidates, allowed))
+        if "imageVecotor" in self.vectors:
+            rankings.append(self._vector_ranking("imageVecotor", cv_embedding_query, candidates, allowed))
+        scores = {}
+        for ranking in rankings:
+            for rank, doc_index in enumerate(ranking):
+                scores[doc_index] = scores.get(doc_index, 0.0) + 1.0 / (RRF_K + rank + 1)
+        return [self.documents[i] for i in sorted(scores, key=scores.get, reverse=True)[:top]]
+
+
+async def run_query(query: EvalQuery, k: int, searcher) -> List[dict]:
+    if query.mode == "text":
+        return await get_search_results_by_text(query.question, k, searcher)
+    if query.mode == "image":
+        return await get_search_results_by_image(query.image_url, k, searcher)
+    return await get_search_results_by_image_and_text(query.image_url, query.question, k, searcher)
+
+async def evaluate(queries: List[EvalQuery], k: int, concurrency: int, searcher, prices: dict) -> dict:
+    slots = asyncio.Semaphore(concurrency)
+    outcomes = {mode: {"latencies": [], "reciprocal_ranks": [], "hits": 0, "errors": 0, "cost": 0.0, "queries": 0} for mode in MODES}
+
+    async def run_one(query: EvalQuery):
+        outcome = outcomes[query.mode]
+        async with slots:
+            start_time = time.perf_counter()
+            try:
+                results = await run_query(query, k, searcher)
+            except Exception as e:
+                print(f"Query {query.query_id} failed: {e}")
+                outcome["errors"] += 1
+                return
+            outcome["latencies"].append((time.perf_counter() - start_time) * 1000)
+        outcome["queries"] += 1
+        outcome["cost"] += estimate_query_cost(query, prices)
+        rank = next((i + 1 for i, document in enumerate(results[:k]) if is_relevant(query, document)), None)
+        outcome["hits"] += rank is not None
+        outcome["reciprocal_ranks"].append(1 / rank if rank else 0.0)
+
+    start_time = time.perf_counter()
+    await asyncio.gather(*(run_one(query) for query in queries))
+    wall_seconds = time.perf_counter() - start_time
+
+    report = {"k": k, "concurrency": concurrency, "wall_seconds": round(wall_seconds, 1), "modes": {}}
+    for mode, outcome in outcomes.items():
+        if not outcome["queries"] and not outcome["errors"]:
+            continue
+        latencies = outcome["latencies"] or [0.0]
+        report["modes"][mode] = {
+            "queries": outcome["queries"],
+            "errors": outcome["errors"],
+            f"recall@{k}": round(outcome["hits"] / max(outcome["queries"], 1), 4),
+            "mrr": round(float(np.mean(outcome["reciprocal_ranks"])) if outcome["reciprocal_ranks"] else 0.0, 4),
+            "p50_ms": round(float(np.percentile(latencies, 50)), 1),
+            "p90_ms": round(float(np.percentile(latencies, 90)), 1),
+            "p99_ms": round(float(np.percentile(latencies, 99)), 1),
+            "cost_per_query_usd": round(outcome["cost"] / max(outcome["queries"], 1), 6),
+        }
+    return report
+
+def print_report(report: dict):
+    k = report["k"]
+    print(f"\n{'mode':<12}{'queries':>8}{'errors':>8}{f'recall@{k}':>11}{'MRR':>8}{'p50 ms':>9}{'p90 ms':>9}{'p99 ms':>9}{'$/query':>11}")
+    for mode, m in report["modes"].items():
+        print(f"{mode:<12}{m['queries']:>8}{m['errors']:>8}{m[f'recall@{k}']:>11.3f}{m['mrr']:>8.3f}"
+              f"{m['p50_ms']:>9.0f}{m['p90_ms']:>9.0f}{m['p99_ms']:>9.0f}{m['cost_per_query_usd']:>11.5f}")
+    print(f"wall time {report['wall_seconds']} s at concurrency {report['concurrency']}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure recall@k, MRR, latency and cost of the retrieval modes on the QA sets.")
+    parser.add_argument("--qa", default="multiModelGameTestData/qa_3.txt", help="text QA set, empty string to skip")
+    parser.add_argument("--xlsx", default="multiModelGameTestData/带图QA测试集.xlsx", help="QA set with images, empty string to skip")
+    parser.add_argument("--modes", nargs="+", default=MODES, choices=MODES)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--limit", type=int, help="only the first N queries")
+    parser.add_argument("--local-store", nargs="?", const="", help="search a local stand-in built from this artifact store instead of the index")
+    parser.add_argument("--prices", help="JSON file overriding UNIT_PRICES")
+    parser.add_argument("--output", help="write the report as JSON")
+    args = parser.parse_args()
+
+    configure_logging()
+    queries = []
+    if args.qa and "text" in args.modes:
+        queries += load_text_qa_set(args.qa)
+    if args.xlsx:
+        queries += load_image_qa_set(args.xlsx, args.modes)
+    if args.limit:
+        queries = queries[: args.limit]
+
+    prices = dict(UNIT_PRICES)
+    if args.prices:
+        with open(args.prices, "r", encoding="utf-8") as f:
+            prices.update(json.load(f))
+
+    searcher = search_index
+    if args.local_store is not None:
+        searcher = LocalSearchIndex(ArtifactStore(args.local_store or None)).search
+    print(f"Evaluating {len(queries)} queries against {'the local stand-in' if searcher is not search_index else 'the search index'}")
+
+    report = asyncio.run(evaluate(queries, args.k, args.concurrency, searcher, prices))
+    print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
@@ -51,7 +51,7 @@ azure_computer_vision_endpoint = "https://cv-hu-test-westus.cognitiveservices.az
 azure_computer_vision_key = "76fd3ae5ca8346dfa266636d8afc5478"
 
 def get_text_embedding_by_computer_vision(text: str) -> List[float]:
-    logging.info(f"Getting text embedding for {text}")
+    logging.info("Getting text embedding for %s", text)
     
     url = azure_computer_vision_endpoint + "computervision/retrieval:vectorizeText?api-version=2024-02-01&model-version=2023-04-15"
     headers = {
@@ -0,0 +1,189 @@
+"""Upload path for search indexing that serializes the batches itself instead of going through the SDK.
+
+The SDK's default encoder prints every vector element at full float64 repr precision, about
+5.6k floats per document. Here vectors are cast to float32 (what an Edm.Single field stores
+anyway), optionally rounded to upload_float_digits significant digits, encoded with orjson
+when it is installed and sent to the docs/index REST endpoint with a gzip-compressed body.
+Bytes sent and serialization CPU are logged per batch and summed in UploadStats.
+
+Failures are handled like the SDK does: 408/429/5xx responses and connection errors are retried
+up to upload_max_retries times, waiting for Retry-After when the service sends it and with an
+exponential backoff otherwise; a 413 splits the batch in half and uploads both halves. Any other
+status raises azure.core.exceptions.HttpResponseError.
+"""
+import asyncio
+import dataclasses
+import gzip
+import json
+import logging
+import time
+from typing import List
+
+import aiohttp
+import numpy as np
+from azure.core.exceptions import HttpResponseError
+
+from settings import get_settings
+from vectorFieldOptions import DOCUMENT_VECTOR_FIELDS
+
+try:
+    import orjson
+except ImportError:
+    # orjson 是可选依赖，没有时退回标准库 json，结果相同只是更慢
+    orjson = None
+
+SEARCH_API_VERSION = "2024-07-01"
+GZIP_LEVEL = 5
+# 和 azure-core RetryPolicy 默认重试的状态码一致
+RETRY_STATUS_CODES = (408, 429, 500, 502, 503, 504)
+RETRY_BACKOFF_SECONDS = 0.8
+
+
+@dataclasses.dataclass
+class IndexingResult:
+    # 和 SDK 返回的 IndexingResult 字段一致，调用方的失败处理不需要区分两条路径
+    key: str
+    succeeded: bool
+    error_message: str
+    status_code: int
+
+
+@dataclasses.dataclass
+class UploadStats:
+    batches: int = 0
+    documents: int = 0
+    json_bytes: int = 0
+    sent_bytes: int = 0
+    serialize_cpu_seconds: float = 0.0
+    compress_cpu_seconds: float = 0.0
+    retries: int = 0
+    splits: int = 0
+
+    def summary(self) -> str:
+        ratio = self.sent_bytes / self.json_bytes if self.json_bytes else 1
+        return (f"Uploaded {self.documents} documents in {self.batches} batches: {self.json_bytes / 1024 / 1024:.1f} MB JSON, "
+                f"{self.sent_bytes / 1024 / 1024:.1f} MB sent ({ratio:.0%}), serialize {self.serialize_cpu_seconds:.2f} s CPU, "
+                f"gzip {self.compress_cpu_seconds:.2f} s CPU, {self.retries} retries, {self.splits} splits")
+
+
+def compact_vector(vector: List[float], digits: int = 0) -> np.ndarray:
+    values = np.asarray(vector, dtype=np.float64)
+    if digits:
+        # 按有效数字取整，embedding 的分量大多在 0.001-0.1 之间，固定小数位会丢掉小分量的精度
+        magnitude = np.floor(np.log10(np.abs(values), where=values != 0, out=np.zeros_like(values)))
+        scale = 10.0 ** (digits - 1 - magnitude)
+        values = np.round(values * scale) / scale
+    return values.astype(np.float32)
+
+def get_retry_delay(headers, attempt: int) -> float:
+    # Retry-After 可能是秒数，也可能是 retry-after-ms
+    for name, scale in (("retry-after-ms", 0.001), ("Retry-After", 1.0)):
+        try:
+            return float(headers[name]) * scale
+        except (KeyError, TypeError, ValueError):
+            continue
+    return RETRY_BACKOFF_SECONDS * 2 ** attempt
+
+def serialize_batch(batch: List[dict], digits: int = 0) -> bytes:
+    documents = []
+    for d in batch:
+        d = dict(d)
+        for vector_field in DOCUMENT_VECTOR_FIELDS:
+            if d.get(vector_field) is not None:
+                d[vector_field] = compact_vector(d[vector_field], digits)
+        documents.append(d)
+
+    if orjson is not None:
+        # orjson 按 float32 的最短表示输出 numpy 数组
+        return orjson.dumps({"value": documents}, option=orjson.OPT_SERIALIZE_NUMPY)
+
+    for d in documents:
+        for vector_field in DOCUMENT_VECTOR_FIELDS:
+            if isinstance(d.get(vector_field), np.ndarray):
+                # str(np.float32) 是 float32 的最短表示，转回 float 后 json 输出同样的数字
+                d[vector_field] = [float(str(value)) for value in d[vector_field]]
+    return json.dumps({"value": documents}, ensure_ascii=False).encode("utf-8")
+
+
+class SearchUploader:
+    def __init__(self, endpoint: str, index_name: str, key: str, compress: bool = True, float_digits: int = 0, max_retries: int = 3):
+        self.url = f"{endpoint.rstrip('/')}/indexes/{index_name}/docs/index?api-version={SEARCH_API_VERSION}"
+        self.key = key
+        self.compress = compress
+        self.float_digits = float_digits
+        self.max_retries = max_retries
+        self.stats = UploadStats()
+        self.session = None
+
+    @classmethod
+    def for_client(cls, search_client) -> "SearchUploader":
+        # 复用调用方 SearchClient 的 endpoint 和索引名，凭据和其他地方一样用 search_key
+        settings = get_settings()
+        return cls(search_client._endpoint, search_client._index_name, settings.search_key,
+                   settings.upload_compression, settings.upload_float_digits, settings.upload_max_retries)
+
+    async def __aenter__(self):
+        self.session = aiohttp.ClientSession(headers={"api-key": self.key})
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.session.close()
+
+    async def upload(self, batch: List[dict]) -> List[IndexingResult]:
+        cpu_start = time.thread_time()
+        body = serialize_batch(batch, self.float_digits)
+        serialize_seconds = time.thread_time() - cpu_start
+        json_bytes = len(body)
+
+        headers = {"Content-Type": "application/json"}
+        compress_seconds = 0.0
+        if self.compress:
+            cpu_start = time.thread_time()
+            body = gzip.compress(body, compresslevel=GZIP_LEVEL)
+            compress_seconds = time.thread_time() - cpu_start
+            headers["Content-Encoding"] = "gzip"
+
+        attempt = 0
+        results = None
+        while True:
+            try:
+                async with self.session.post(self.url, data=body, headers=headers) as response:
+                    # 200 全部成功，207 部分成功，其他状态码说明整个请求没有被处理
+                    if response.status in (200, 207):
+                        results = (await response.json())["value"]
+                        break
+                    if response.status == 413 and len(batch) > 1:
+                        break
+                    if response.status not in RETRY_STATUS_CODES or attempt >= self.max_retries:
+                        error = HttpResponseError(message=f"Upload request failed with HTTP {response.status}: {await response.text()}")
+                        error.status_code = response.status
+                        raise error
+                    delay = get_retry_delay(response.headers, attempt)
+                    reason = f"HTTP {response.status}"
+            except aiohttp.ClientError as e:
+                if attempt >= self.max_retries:
+                    raise
+                delay = get_retry_delay({}, attempt)
+                reason = str(e)
+            attempt += 1
+            self.stats.retries += 1
+            logging.warning("Upload batch of %s documents failed with %s, retry %s/%s in %.1f s", len(batch), reason, attempt, self.max_retries, delay)
+            await asyncio.sleep(delay)
+
+        if results is None:
+            # 请求体超过上限，和 SDK 一样拆成两半分别上传
+            self.stats.splits += 1
+            logging.warning("Upload batch of %s documents (%s bytes) is too large, splitting it", len(batch), len(body))
+            half = len(batch) // 2
+            return await self.upload(batch[:half]) + await self.upload(batch[half:])
+
+        # 只统计成功发送的批次，拆分后的批次按实际发送的请求计算
+        self.stats.batches += 1
+        self.stats.documents += len(batch)
+        self.stats.json_bytes += json_bytes
+        self.stats.sent_bytes += len(body)
+        self.stats.serialize_cpu_seconds += serialize_seconds
+        self.stats.compress_cpu_seconds += compress_seconds
+        logging.info("Upload batch of %s documents: %s JSON bytes, %s sent, serialize %.1f ms CPU, gzip %.1f ms CPU",
+                     len(batch), json_bytes, len(body), serialize_seconds * 1000, compress_seconds * 1000)
+        return [IndexingResult(result["key"], result["status"], result.get("errorMessage"), result["statusCode"]) for result in results]
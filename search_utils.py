@@ -1,145 +1,119 @@
 import asyncio
+import functools
 import logging
-import os
-from typing import List
+from typing import List, Optional
 
 from azure.core.credentials import AzureKeyCredential
-from azure.search.documents import SearchClient
+from azure.search.documents.aio import SearchClient
+from azure.search.documents.indexes.aio import SearchIndexClient
 from azure.search.documents.models import QueryType, VectorizedQuery
-from dotenv import load_dotenv
-from openai import AzureOpenAI
 
-from multiModelsEmbedding import (
-    get_picture_embedding,
-    get_text_embedding_by_computer_vision,
-)
+from embeddingBackend import get_embedding_backend
+from gamePartition import build_game_filter, route_query
 from pictureFormatProcess import download_and_save_as_pdf
 from pictureOcrProcess import analyze_document, get_image_caption_byCV
+from settings import configure_logging, get_settings
+from vectorFieldOptions import get_text_vector_fields
 
-# Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-
-# Configure environment variables  
-load_dotenv()  
-azure_search_service_endpoint = os.getenv("AZURE_SEARCH_SERVICE_ENDPOINT") 
-azure_search_index_name = os.getenv("AZURE_SEARCH_INDEX") 
-azure_search_key = os.getenv("AZURE_COGNITIVE_SEARCH_KEY") 
-azure_search_credential = AzureKeyCredential(azure_search_key)
-
-
-azureOpenAIClient = AzureOpenAI(
-  api_key = os.getenv("AZURE_OPENAI_API_KEY"),  
-  api_version = "2024-02-01",
-  azure_endpoint =os.getenv("AZURE_OPENAI_BASE") 
-)
-
-azure_openAI_embedding_deployment = os.getenv("EMBEDDING_MODEL_DEPLOYMENT")
-azure_computer_vision_endpoint = os.getenv("AZURE_COMPUTER_VISION_ENDPOINT")
-azure_computer_vision_key = os.getenv("AZURE_COMPUTER_VISION_KEY")
 pdf_dir = "docs/pdf"
-
-
-async def get_search_results_by_image(query_image_url:str):
-     # generate ocr content by form recognizer service
-    pdfFileLocalPath =  await download_and_save_as_pdf(query_image_url,pdf_dir)
-    ocrContent = await analyze_document(pdfFileLocalPath)
-    captionByCV = await get_image_caption_byCV(query_image_url)
-
-    query = ocrContent + captionByCV
-    
-    aoaiResponse = azureOpenAIClient.embeddings.create(input = query,model = azure_openAI_embedding_deployment)  
-    aoai_embedding_query = aoaiResponse.data[0].embedding
-    #print(aoai_embedding_query)
-
-    cv_embedding_query = await get_picture_embedding(query_image_url)
-    #print(cv_embedding_query)
-
-    search_client = SearchClient(azure_search_service_endpoint, azure_search_index_name, AzureKeyCredential(azure_search_key))
-
-    aoai_embedding_query = VectorizedQuery(vector=aoai_embedding_query, 
-                                k_nearest_neighbors=3, 
-                                fields="contentVector,captionVector,ocrContentVecotor")
-
-    azure_cv_embedding_query = VectorizedQuery(vector=cv_embedding_query, 
-                                k_nearest_neighbors=3, 
+SEARCH_SELECT_FIELDS = ["id","caption", "content","imageUrl","ocrContent"]
+# 索引里是否有 game 字段，第一次按游戏过滤时检查
+_game_field_available = None
+
+
+@functools.lru_cache(maxsize=None)
+def get_search_client() -> SearchClient:
+    # 异步 client 在第一次查询时创建，整个进程（包括查询服务）共用一个连接池
+    settings = get_settings()
+    return SearchClient(settings.search_endpoint, settings.search_index, AzureKeyCredential(settings.search_key))
+
+async def get_query_embedding(query: str) -> List[float]:
+    # 和入库使用同一个 embedding 后端
+    return await get_embedding_backend().embed_text(query)
+
+async def index_has_game_field() -> bool:
+    # prepdocs.py 之前创建的索引没有 game 字段，filter 会让查询失败，这时退回搜整个索引
+    global _game_field_available
+    if _game_field_available is None:
+        settings = get_settings()
+        async with SearchIndexClient(settings.search_endpoint, AzureKeyCredential(settings.search_key)) as index_client:
+            index = await index_client.get_index(settings.search_index)
+        _game_field_available = any(field.name == "game" for field in index.fields)
+        if not _game_field_available:
+            logging.warning("Index %s has no game field, searching the whole index; run prepdocs.py to add it", settings.search_index)
+    return _game_field_available
+
+async def search_index(search_text: str, aoai_embedding_query: List[float], cv_embedding_query: List[float], top: int = 3, game: Optional[str] = None) -> List[dict]:
+    aoai_vector_query = VectorizedQuery(vector=aoai_embedding_query, 
+                                k_nearest_neighbors=max(3, top), 
+                                fields=",".join(get_text_vector_fields()))
+
+    azure_cv_vector_query = VectorizedQuery(vector=cv_embedding_query, 
+                                k_nearest_neighbors=max(3, top), 
                                 fields="imageVecotor")
 
-    results = search_client.search(  
-        search_text=query,
-        search_fields=["caption","content","ocrContent"],
-        query_language="zh-cn",
-        scoring_profile="firstProfile",   
-        vector_queries=[aoai_embedding_query,azure_cv_embedding_query],
-        query_type=QueryType.SEMANTIC, 
-        semantic_configuration_name='default', 
-        select=["id","caption", "content","imageUrl","ocrContent"],
-        top=3
-    )
-
-    return results
-
-async def get_search_results_by_text(query_text:str):
-    aoaiResponse = azureOpenAIClient.embeddings.create(input = query_text,model = azure_openAI_embedding_deployment)  
-    aoai_embedding_query = aoaiResponse.data[0].embedding
-    cv_embedding_query = await get_text_embedding_by_computer_vision(query_text)
-
-    search_client = SearchClient(azure_search_service_endpoint, azure_search_index_name, AzureKeyCredential(azure_search_key))
-
-    aoai_embedding_query = VectorizedQuery(vector=aoai_embedding_query, 
-                                k_nearest_neighbors=3, 
-                                fields="contentVector,captionVector,ocrContentVecotor")
-
-    azure_cv_embedding_query = VectorizedQuery(vector=cv_embedding_query, 
-                                k_nearest_neighbors=3, 
-                                fields="imageVecotor")
+    if game is not None and not await index_has_game_field():
+        game = None
 
-    results = search_client.search(  
-        search_text=query_text,
+    results = await get_search_client().search(  
+        search_text=search_text,
         search_fields=["caption","content","ocrContent"],
         query_language="zh-cn",
         scoring_profile="firstProfile",   
-        vector_queries=[aoai_embedding_query,azure_cv_embedding_query],
+        vector_queries=[aoai_vector_query,azure_cv_vector_query],
         query_type=QueryType.SEMANTIC, 
         semantic_configuration_name='default', 
-        select=["id","caption", "content","imageUrl","ocrContent"],
-        top=3
+        select=SEARCH_SELECT_FIELDS,
+        filter=build_game_filter(game),
+        top=top
+    )
+    return [result async for result in results]
+
+async def search_routed(searcher, search_text: str, aoai_embedding_query: List[float], cv_embedding_query: List[float], top: int) -> List[dict]:
+    # 查询能分类到一个游戏时只搜这个游戏的分区，分区里没有结果再搜整个索引
+    game = route_query(search_text)
+    if game is not None:
+        results = await searcher(search_text, aoai_embedding_query, cv_embedding_query, top, game)
+        if results:
+            return results
+        logging.info("No results in game partition %s, searching the whole index", game)
+    return await searcher(search_text, aoai_embedding_query, cv_embedding_query, top)
+
+# 三个查询函数的 searcher 默认是 search_index，评估时可以换成本地索引（retrievalEval.LocalSearchIndex.search）
+async def get_search_results_by_image(query_image_url:str, top:int=3, searcher=search_index):
+    # OCR 需要先下载图片，CV caption 和图片向量可以同时进行
+    async def get_ocr_content():
+        # generate ocr content by form recognizer service
+        pdfFileLocalPath = await download_and_save_as_pdf(query_image_url,pdf_dir)
+        return await analyze_document(pdfFileLocalPath)
+
+    ocrContent, captionByCV, cv_embedding_query = await asyncio.gather(
+        get_ocr_content(),
+        get_image_caption_byCV(query_image_url),
+        get_embedding_backend().embed_image(query_image_url),
     )
 
-    return results
-
-async def get_search_results_by_image_and_text(query_image_url:str,query_text:str):
-    aoaiResponse = azureOpenAIClient.embeddings.create(input = query_text,model = azure_openAI_embedding_deployment)  
-    aoai_embedding_query = aoaiResponse.data[0].embedding
-    #print(aoai_embedding_query)
-
-    cv_embedding_query = await get_picture_embedding(query_image_url)
-    #print(cv_embedding_query)
-
-    search_client = SearchClient(azure_search_service_endpoint, azure_search_index_name, AzureKeyCredential(azure_search_key))
-
-    aoai_embedding_query = VectorizedQuery(vector=aoai_embedding_query, 
-                                k_nearest_neighbors=3, 
-                                fields="contentVector,captionVector,ocrContentVecotor")
+    query = ocrContent + captionByCV
+    aoai_embedding_query = await get_query_embedding(query)
 
-    azure_cv_embedding_query = VectorizedQuery(vector=cv_embedding_query, 
-                                k_nearest_neighbors=3, 
-                                fields="imageVecotor")
+    return await search_routed(searcher, query, aoai_embedding_query, cv_embedding_query, top)
 
-    results = search_client.search(  
-        search_text=query_text,
-        search_fields=["caption","content","ocrContent"],
-        query_language="zh-cn",
-        scoring_profile="firstProfile",   
-        vector_queries=[aoai_embedding_query,azure_cv_embedding_query],
-        query_type=QueryType.SEMANTIC, 
-        semantic_configuration_name='default', 
-        select=["id","caption", "content","imageUrl","ocrContent"],
-        top=3
+async def get_search_results_by_text(query_text:str, top:int=3, searcher=search_index):
+    aoai_embedding_query, cv_embedding_query = await asyncio.gather(
+        get_query_embedding(query_text),
+        get_embedding_backend().embed_image_space_text(query_text),
     )
+    return await search_routed(searcher, query_text, aoai_embedding_query, cv_embedding_query, top)
 
-    return results
+async def get_search_results_by_image_and_text(query_image_url:str,query_text:str, top:int=3, searcher=search_index):
+    aoai_embedding_query, cv_embedding_query = await asyncio.gather(
+        get_query_embedding(query_text),
+        get_embedding_backend().embed_image(query_image_url),
+    )
+    return await search_routed(searcher, query_text, aoai_embedding_query, cv_embedding_query, top)
 
 if __name__ == "__main__":
+    configure_logging()
 
     query_image_url="https://img2.tapimg.com/moment/etag/FvhNYMQT78nnCjAvBqHvY40FcH46.jpeg"
 
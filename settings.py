@@ -0,0 +1,307 @@
+"""Typed settings, loaded once from the environment and .env.
+
+Nothing here talks to a service and no credential is required at import time, so worker
+processes and test harnesses can import any module without a configured environment.
+Clients are built lazily by the modules that own them, from get_settings().
+"""
+import functools
+import logging
+import os
+from dataclasses import dataclass, field
+from typing import Dict, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from structuredLogging import setup_logging
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - [%(record_id)s] %(message)s'
+
+# 每类服务调用的默认截止时间（秒），可以通过 service_deadlines="ocr=120,cv_caption=10" 覆盖
+# cv_vectorize 是图片/文本向量，cv_caption 是 dense captions，两者耗时和失败率不同，分开统计
+DEFAULT_SERVICE_DEADLINES = {
+    "download": 30,
+    "cv_vectorize": 20,
+    "cv_caption": 20,
+    "ocr": 60,
+    "chat": 90,
+    "embedding": 30,
+}
+
+# 每个 stage 的默认并发，可以通过 stage_concurrency="describe=16,ocr=4" 覆盖
+DEFAULT_STAGE_CONCURRENCY = {
+    "download": 8,
+    "describe": 8,
+    "caption": 4,
+    "image_vector": 4,
+    "ocr": 2,
+    "caption_vector": 8,
+    "content_vector": 8,
+    "ocr_vector": 8,
+    "fused_vector": 8,
+    # 文本帖子：每个请求是一批 chunk
+    "text_embedding": 4,
+}
+
+
+@dataclass(frozen=True)
+class CvEndpoint:
+    endpoint: str
+    key: str
+
+
+@dataclass(frozen=True)
+class Settings:
+    # Azure OpenAI
+    azure_openai_endpoint: Optional[str] = None
+    azure_openai_api_key: Optional[str] = None
+    chat_deployment: str = "gpt-4o"
+    chat_api_version: str = "2024-02-15-preview"
+    chat_deployments_json: Optional[str] = None
+    embedding_deployment: Optional[str] = None
+    embedding_api_version: str = "2024-02-01"
+    embedding_deployments_json: Optional[str] = None
+
+    # Batch API
+    batch_deployment: str = "gpt-4o-batch"
+    batch_embedding_deployment: Optional[str] = None
+    batch_api_version: str = "2024-07-01-preview"
+    batch_dir: str = "docs/batch"
+    batch_poll_interval: int = 60
+
+    # Computer Vision（入库轮询的多个 endpoint，以及查询和 vectorizer 使用的 endpoint）
+    cv_endpoints: Tuple[CvEndpoint, ...] = ()
+    cv_endpoint: Optional[str] = None
+    cv_key: Optional[str] = None
+
+    # Document Intelligence
+    form_recognizer_endpoint: Optional[str] = None
+    form_recognizer_key: Optional[str] = None
+
+    # AI Search
+    search_service: Optional[str] = None
+    search_service_endpoint: Optional[str] = None
+    search_index: Optional[str] = None
+    search_key: Optional[str] = None
+
+    # 数据处理
+    pdf_dir: Optional[str] = None
+    lines_per_chunk: int = 100
+    # coordinator 模式下一个 chunk 最多处理几次（失败或者 lease 过期都算一次），之后标记为 failed
+    coordinator_max_attempts: int = 3
+    multi_models_file_path: Optional[str] = None
+    stage_concurrency: Dict[str, int] = field(default_factory=lambda: dict(DEFAULT_STAGE_CONCURRENCY))
+
+    # 截止时间和对冲请求: 超过该服务 hedge_percentile 分位耗时后，向池里的另一个 endpoint 再发一次请求
+    service_deadlines: Dict[str, float] = field(default_factory=lambda: dict(DEFAULT_SERVICE_DEADLINES))
+    hedge_services: Tuple[str, ...] = ("cv_vectorize", "cv_caption", "embedding")
+    hedge_percentile: float = 95
+    hedge_min_delay_ms: int = 100
+    hedge_initial_delay_ms: int = 3000
+
+    # 每个服务的自适应并发（AIMD）: 延迟正常时每成功 limit 次加 1，429 或超时时乘以 adaptive_backoff
+    adaptive_concurrency: bool = True
+    adaptive_initial_limit: int = 4
+    adaptive_min_limit: int = 1
+    adaptive_max_limit: int = 64
+    adaptive_backoff: float = 0.5
+    adaptive_latency_tolerance: float = 2.0
+
+    # embedding 后端: azure 调用 Azure OpenAI 和 Computer Vision，local 用本地 sentence-transformers 模型在 CPU 上计算
+    embedding_backend: str = "azure"
+    local_text_model_path: Optional[str] = None
+    # CLIP 类模型，图片向量和文本查图片
+    local_image_model_path: Optional[str] = None
+    # 可选，和 CLIP 图片空间对齐的文本模型（例如多语言版本），为空时使用 local_image_model_path
+    local_image_text_model_path: Optional[str] = None
+    local_embedding_workers: int = 2
+    local_embedding_batch_size: int = 32
+
+    # 增量索引
+    pipeline_version: str = "1"
+    index_state_path: str = "docs/index_state.db"
+
+    # 向量字段
+    vector_field_type: str = "Single"
+    vector_compression: str = "none"
+    vector_oversampling: float = 10.0
+    vector_stored: bool = True
+    text_vector_mode: str = "separate"
+    fused_text_max_tokens: int = 8000
+    hnsw_params_path: str = "docs/hnsw_params.json"
+
+    # 每个 gpt-4o 描述请求最多包含同一帖子的几张图片，1 表示每张图片单独请求
+    describe_images_per_request: int = 1
+
+    # 文本帖子入库: chunk 的 token 数和重叠 token 数，每个 embedding 请求的 chunk 数
+    text_chunk_tokens: int = 512
+    text_chunk_overlap: int = 64
+    text_embedding_batch_size: int = 64
+    # 为空时使用 <AZURE_SEARCH_INDEX>-posts
+    text_post_index: Optional[str] = None
+
+    # 下载图片的本地缓存，按 url 里的 etag 去重，超过上限按最近使用时间淘汰；置空则不缓存
+    image_cache_dir: str = "docs/image_cache"
+    image_cache_max_mb: int = 2048
+
+    # enrichment 结果的本地存储，reindex 从这里重建索引；置空则不保存
+    artifact_dir: str = "docs/artifacts"
+
+    # 上传: fast 自己序列化（float32 最短表示、可选有效数字、gzip 请求体），sdk 使用 SDK 默认的 encoder
+    upload_serializer: str = "fast"
+    upload_compression: bool = True
+    # 向量分量保留的有效数字，0 表示 float32 的最短表示（对 Edm.Single 字段无损）
+    upload_float_digits: int = 0
+    # fast 上传遇到 408/429/5xx 时的重试次数，和 SDK 一样优先按 Retry-After 等待
+    upload_max_retries: int = 3
+
+    # 按游戏分区: 入库时写 game 字段，filter 模式下查询只搜分类到的游戏（加上没有分类的文档），off 则搜整个索引
+    # 规则文件的格式: {"<游戏>": ["<关键词>", ...]}，为空时使用 gamePartition.DEFAULT_GAME_RULES
+    game_routing: str = "filter"
+    game_rules_path: Optional[str] = None
+
+    # --profile: 采样间隔，事件循环被阻塞超过多久算作阻塞，输出目录
+    profile_interval_ms: int = 5
+    profile_block_threshold_ms: int = 100
+    profile_dir: str = "docs/profile"
+
+    # 日志: text | json，单条消息最大长度，每个消息模板前 burst 条全部输出，之后每 every 条输出一条
+    log_format: str = "text"
+    log_max_chars: int = 2000
+    log_sample_burst: int = 10
+    log_sample_every: int = 100
+
+    @classmethod
+    def from_env(cls) -> "Settings":
+        env = os.environ
+        cv_endpoints = tuple(
+            CvEndpoint(env[f"AZURE_COMPUTER_VISION_ENDPOINT{i}"], env.get(f"AZURE_COMPUTER_VISION_KEY{i}"))
+            for i in (1, 2, 3)
+            if env.get(f"AZURE_COMPUTER_VISION_ENDPOINT{i}")
+        )
+        return cls(
+            azure_openai_endpoint=env.get("AZURE_OPENAI_ENDPOINT"),
+            azure_openai_api_key=env.get("AZURE_OPENAI_API_KEY"),
+            chat_deployments_json=env.get("AZURE_OPENAI_CHAT_DEPLOYMENTS"),
+            embedding_deployment=env.get("EMBEDDING_MODEL_DEPLOYMENT"),
+            embedding_deployments_json=env.get("AZURE_OPENAI_EMBEDDING_DEPLOYMENTS"),
+            batch_deployment=env.get("AZURE_OPENAI_BATCH_DEPLOYMENT", "gpt-4o-batch"),
+            batch_embedding_deployment=env.get("EMBEDDING_MODEL_BATCH_DEPLOYMENT", env.get("EMBEDDING_MODEL_DEPLOYMENT")),
+            batch_dir=env.get("batch_dir", "docs/batch"),
+            batch_poll_interval=int(env.get("batch_poll_interval", "60")),
+            cv_endpoints=cv_endpoints,
+            cv_endpoint=env.get("AZURE_COMPUTER_VISION_ENDPOINT"),
+            cv_key=env.get("AZURE_COMPUTER_VISION_KEY"),
+            form_recognizer_endpoint=env.get("FORM_RECOGNIZER_ENDPOINT"),
+            form_recognizer_key=env.get("FORM_RECOGNIZER_KEY"),
+            search_service=env.get("AZURE_SEARCH_SERVICE"),
+            search_service_endpoint=env.get("AZURE_SEARCH_SERVICE_ENDPOINT"),
+            search_index=env.get("AZURE_SEARCH_INDEX"),
+            search_key=env.get("AZURE_COGNITIVE_SEARCH_KEY"),
+            pdf_dir=env.get("pdf_dir"),
+            lines_per_chunk=int(env.get("lines_per_chunk", "100")),
+            coordinator_max_attempts=int(env.get("coordinator_max_attempts", "3")),
+            multi_models_file_path=env.get("multi_models_file_path"),
+            stage_concurrency={**DEFAULT_STAGE_CONCURRENCY, **parse_stage_concurrency(env.get("stage_concurrency"))},
+            service_deadlines={**DEFAULT_SERVICE_DEADLINES, **parse_key_values(env.get("service_deadlines"), float)},
+            hedge_services=tuple(name.strip() for name in env.get("hedge_services", "cv_vectorize,cv_caption,embedding").split(",") if name.strip()),
+            hedge_percentile=float(env.get("hedge_percentile", "95")),
+            hedge_min_delay_ms=int(env.get("hedge_min_delay_ms", "100")),
+            hedge_initial_delay_ms=int(env.get("hedge_initial_delay_ms", "3000")),
+            adaptive_concurrency=env.get("adaptive_concurrency", "true").lower() == "true",
+            adaptive_initial_limit=int(env.get("adaptive_initial_limit", "4")),
+            adaptive_min_limit=int(env.get("adaptive_min_limit", "1")),
+            adaptive_max_limit=int(env.get("adaptive_max_limit", "64")),
+            adaptive_backoff=float(env.get("adaptive_backoff", "0.5")),
+            adaptive_latency_tolerance=float(env.get("adaptive_latency_tolerance", "2.0")),
+            embedding_backend=env.get("embedding_backend", "azure"),
+            local_text_model_path=env.get("local_text_model_path"),
+            local_image_model_path=env.get("local_image_model_path"),
+            local_image_text_model_path=env.get("local_image_text_model_path"),
+            local_embedding_workers=int(env.get("local_embedding_workers", "2")),
+            local_embedding_batch_size=int(env.get("local_embedding_batch_size", "32")),
+            pipeline_version=env.get("pipeline_version", "1"),
+            index_state_path=env.get("index_state_path", "docs/index_state.db"),
+            vector_field_type=env.get("vector_field_type", "Single"),
+            vector_compression=env.get("vector_compression", "none"),
+            vector_oversampling=float(env.get("vector_oversampling", "10")),
+            vector_stored=env.get("vector_stored", "true").lower() == "true",
+            text_vector_mode=env.get("text_vector_mode", "separate"),
+            fused_text_max_tokens=int(env.get("fused_text_max_tokens", "8000")),
+            hnsw_params_path=env.get("hnsw_params_path", "docs/hnsw_params.json"),
+            describe_images_per_request=int(env.get("describe_images_per_request", "1")),
+            text_chunk_tokens=int(env.get("text_chunk_tokens", "512")),
+            text_chunk_overlap=int(env.get("text_chunk_overlap", "64")),
+            text_embedding_batch_size=int(env.get("text_embedding_batch_size", "64")),
+            text_post_index=env.get("text_post_index"),
+            image_cache_dir=env.get("image_cache_dir", "docs/image_cache"),
+            image_cache_max_mb=int(env.get("image_cache_max_mb", "2048")),
+            artifact_dir=env.get("artifact_dir", "docs/artifacts"),
+            upload_serializer=env.get("upload_serializer", "fast"),
+            upload_compression=env.get("upload_compression", "true").lower() == "true",
+            upload_float_digits=int(env.get("upload_float_digits", "0")),
+            upload_max_retries=int(env.get("upload_max_retries", "3")),
+            game_routing=env.get("game_routing", "filter"),
+            game_rules_path=env.get("game_rules_path"),
+            profile_interval_ms=int(env.get("profile_interval_ms", "5")),
+            profile_block_threshold_ms=int(env.get("profile_block_threshold_ms", "100")),
+            profile_dir=env.get("profile_dir", "docs/profile"),
+            log_format=env.get("log_format", "text"),
+            log_max_chars=int(env.get("log_max_chars", "2000")),
+            log_sample_burst=int(env.get("log_sample_burst", "10")),
+            log_sample_every=int(env.get("log_sample_every", "100")),
+        )
+
+    def validate(self):
+        # Single | Half。SByte 需要模型直接输出 int8 向量，AOAI/CV 的 embedding 都是 float，所以不提供
+        if self.vector_field_type not in ("Single", "Half"):
+            raise ValueError(f"Unsupported vector_field_type: {self.vector_field_type}")
+        if self.vector_compression not in ("none", "scalar"):
+            raise ValueError(f"Unsupported vector_compression: {self.vector_compression}")
+        if self.text_vector_mode not in ("separate", "fused"):
+            raise ValueError(f"Unsupported text_vector_mode: {self.text_vector_mode}")
+        if self.text_chunk_overlap >= self.text_chunk_tokens:
+            raise ValueError("text_chunk_overlap must be smaller than text_chunk_tokens")
+        if self.embedding_backend not in ("azure", "local"):
+            raise ValueError(f"Unsupported embedding_backend: {self.embedding_backend}")
+        if self.embedding_backend == "local" and not (self.local_text_model_path and self.local_image_model_path):
+            raise ValueError("embedding_backend=local needs local_text_model_path and local_image_model_path")
+        if self.upload_serializer not in ("fast", "sdk"):
+            raise ValueError(f"Unsupported upload_serializer: {self.upload_serializer}")
+        if self.upload_max_retries < 0:
+            raise ValueError("upload_max_retries must not be negative")
+        if self.game_routing not in ("filter", "off"):
+            raise ValueError(f"Unsupported game_routing: {self.game_routing}")
+        if self.log_format not in ("text", "json"):
+            raise ValueError(f"Unsupported log_format: {self.log_format}")
+
+    @property
+    def search_endpoint(self) -> str:
+        return self.search_service_endpoint or f"https://{self.search_service}.search.windows.net/"
+
+
+def parse_key_values(value: str, cast=int) -> Dict[str, float]:
+    # 格式: "describe=8,ocr=2"
+    values = {}
+    for pair in (value or "").split(","):
+        if "=" not in pair:
+            continue
+        name, item = pair.split("=", 1)
+        values[name.strip()] = cast(item)
+    return values
+
+def parse_stage_concurrency(value: str) -> Dict[str, int]:
+    return parse_key_values(value, int)
+
+@functools.lru_cache(maxsize=None)
+def get_settings() -> Settings:
+    # 整个进程只加载一次 .env
+    load_dotenv()
+    settings = Settings.from_env()
+    settings.validate()
+    return settings
+
+def configure_logging(level=logging.INFO):
+    # 只在入口脚本调用一次，库模块不再各自调用 basicConfig
+    # 日志经过队列由后台线程写出，热路径上的重复日志按模板采样
+    settings = get_settings()
+    setup_logging(level, settings.log_format, LOG_FORMAT, settings.log_max_chars, settings.log_sample_burst, settings.log_sample_every)
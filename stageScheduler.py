@@ -0,0 +1,88 @@
+"""Dependency-graph scheduler: every stage has its own concurrency limit and starts as soon as its inputs exist."""
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from structuredLogging import record_id_var
+
+
+@dataclass
+class Stage:
+    name: str
+    # 调用方式: func(item, **{dependency_name: dependency_result})
+    func: Callable[..., Awaitable[Any]]
+    dependencies: List[str] = field(default_factory=list)
+    concurrency: int = 4
+
+
+class StageScheduler:
+    def __init__(self, stages: List[Stage], max_items_in_flight: int = 100, item_id: Optional[Callable[[Any], str]] = None):
+        self.stages = {stage.name: stage for stage in stages}
+        if len(self.stages) != len(stages):
+            raise ValueError("Stage names must be unique")
+        self.order = self._topological_order()
+        self.max_items_in_flight = max_items_in_flight
+        # 每条记录的日志都带上 item_id(item)，方便按记录 grep 所有 stage 的日志
+        self.item_id = item_id
+        # 每个 stage 一个信号量，等待者按 FIFO 排队，相当于每个 stage 一个独立队列
+        self.semaphores = {stage.name: asyncio.Semaphore(stage.concurrency) for stage in stages}
+
+    def _topological_order(self) -> List[Stage]:
+        order = []
+        visiting = set()
+        visited = set()
+
+        def visit(name: str):
+            if name in visited:
+                return
+            if name in visiting:
+                raise ValueError(f"Stage dependency cycle detected at {name}")
+            if name not in self.stages:
+                raise ValueError(f"Unknown stage dependency: {name}")
+            visiting.add(name)
+            for dependency in self.stages[name].dependencies:
+                visit(dependency)
+            visiting.remove(name)
+            visited.add(name)
+            order.append(self.stages[name])
+
+        for name in self.stages:
+            visit(name)
+        return order
+
+    async def _run_stage(self, stage: Stage, item: Any, futures: Dict[str, asyncio.Future]) -> Any:
+        inputs = {dependency: await futures[dependency] for dependency in stage.dependencies}
+        async with self.semaphores[stage.name]:
+            return await stage.func(item, **inputs)
+
+    async def run_item(self, item: Any) -> Dict[str, Any]:
+        futures = {}
+        for stage in self.order:
+            futures[stage.name] = asyncio.ensure_future(self._run_stage(stage, item, futures))
+
+        try:
+            results = await asyncio.gather(*futures.values())
+        except Exception:
+            # 任意 stage 失败后，取消该记录剩余的 stage，释放并发名额
+            for future in futures.values():
+                future.cancel()
+            await asyncio.gather(*futures.values(), return_exceptions=True)
+            raise
+        return dict(zip(futures.keys(), results))
+
+    async def run(self, items: List[Any]) -> List[Tuple[Any, Any]]:
+        # 返回 (item, 结果字典或异常)，限制同时在途的记录数避免大文件占满内存
+        item_limit = asyncio.Semaphore(self.max_items_in_flight)
+
+        async def run_bounded(item):
+            # gather 为每条记录创建独立的 task，这里设置的 record_id 只对这条记录的 stage 可见
+            if self.item_id is not None:
+                record_id_var.set(self.item_id(item))
+            async with item_limit:
+                try:
+                    return item, await self.run_item(item)
+                except Exception as e:
+                    return item, e
+
+        return await asyncio.gather(*(run_bounded(item) for item in items))
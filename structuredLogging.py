@@ -0,0 +1,167 @@
+"""Logging for the enrichment hot path: queued, sampled, truncated and tagged with the record id.
+
+Records are put on an in-memory queue and written by a background thread, so the event loop
+never blocks on stderr. Messages use %-style arguments and are only formatted by the writer
+thread, after sampling has dropped the repetitive ones. Long arguments (post text, OCR
+output) go through `Truncated` and every line is capped at `max_chars`.
+"""
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import multiprocessing.util
+import os
+import queue
+from collections import Counter
+
+# 当前处理的记录 id，StageScheduler 为每条记录的 task 单独设置
+record_id_var = contextvars.ContextVar("record_id", default="-")
+
+_listener = None
+# setup_logging 的参数，fork 出来的子进程用同样的参数重新建立
+_setup_args = None
+
+
+class Truncated:
+    # 延迟截断：只有日志真正写出时才会调用 __str__
+    __slots__ = ("value", "limit")
+
+    def __init__(self, value, limit: int = 80):
+        self.value = value
+        self.limit = limit
+
+    def __str__(self) -> str:
+        text = str(self.value)
+        if len(text) <= self.limit:
+            return text
+        return f"{text[:self.limit]}...(+{len(text) - self.limit} chars)"
+
+
+class CorrelationFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.record_id = record_id_var.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    # 按消息模板计数：每个模板前 burst 条全部保留，之后每 every 条保留一条；WARNING 及以上不采样
+    def __init__(self, burst: int = 10, every: int = 100):
+        super().__init__()
+        self.burst = burst
+        self.every = max(every, 1)
+        self.counts = Counter()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        key = (record.name, record.msg)
+        self.counts[key] += 1
+        count = self.counts[key]
+        if count <= self.burst:
+            return True
+        if count % self.every == 0:
+            record.sampled = self.every
+            return True
+        return False
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    # 默认的 QueueHandler.prepare 会在调用线程里格式化消息，这里留给后台线程
+    # 同一进程内的队列不需要 pickle，参数对象直接传过去
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    def __init__(self, max_chars: int = 2000):
+        super().__init__()
+        self.max_chars = max_chars
+
+    def format(self, record: logging.LogRecord) -> str:
+        message = record.getMessage()
+        if len(message) > self.max_chars:
+            message = f"{message[:self.max_chars]}...(+{len(message) - self.max_chars} chars)"
+        entry = {
+            "ts": self.formatTime(record),
+            "level": record.levelname,
+            "pid": record.process,
+            "logger": record.name,
+            "record_id": getattr(record, "record_id", "-"),
+            "msg": message,
+        }
+        if getattr(record, "sampled", None):
+            entry["sampled"] = record.sampled
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        # 保留中文原文，方便 grep
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self, fmt: str, max_chars: int = 2000):
+        super().__init__(fmt)
+        self.max_chars = max_chars
+
+    def formatMessage(self, record: logging.LogRecord) -> str:
+        if len(record.message) > self.max_chars:
+            record.message = f"{record.message[:self.max_chars]}...(+{len(record.message) - self.max_chars} chars)"
+        return super().formatMessage(record)
+
+
+def setup_logging(level=logging.INFO, log_format: str = "text", text_format: str = None,
+                  max_chars: int = 2000, sample_burst: int = 10, sample_every: int = 100):
+    global _listener, _setup_args
+    if _listener is not None:
+        return
+    if _setup_args is None and hasattr(os, "register_at_fork"):
+        os.register_at_fork(after_in_child=_restart_in_child)
+    _setup_args = (level, log_format, text_format, max_chars, sample_burst, sample_every)
+
+    if log_format == "json":
+        formatter = JsonFormatter(max_chars)
+    else:
+        formatter = TextFormatter(text_format or "%(asctime)s - %(levelname)s - [%(record_id)s] %(message)s", max_chars)
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(formatter)
+
+    # 过滤器挂在 QueueHandler 上，被采样丢掉的记录不会进入队列，也不会被格式化
+    queue_handler = DeferredQueueHandler(queue.SimpleQueue())
+    queue_handler.addFilter(SamplingFilter(sample_burst, sample_every))
+    queue_handler.addFilter(CorrelationFilter())
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    _listener = logging.handlers.QueueListener(queue_handler.queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    # 进程退出前把队列里剩下的日志写完
+    atexit.register(stop_logging)
+
+def _restart_in_child():
+    # 子进程继承了 QueueHandler 但没有继承 listener 线程，不重建的话子进程的日志全部留在队列里
+    global _listener
+    if _setup_args is None or _listener is None:
+        return
+    _listener = None
+    setup_logging(*_setup_args)
+    # multiprocessing 的子进程用 os._exit 退出，不执行 atexit，由它的 finalizer 把队列写完
+    multiprocessing.util.Finalize(None, stop_logging, exitpriority=0)
+
+def stop_logging():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+if __name__ == "__main__":
+    # 示例调用
+    setup_logging(log_format=os.getenv("log_format", "json"), sample_burst=2, sample_every=5)
+    record_id_var.set("demo-1")
+    for i in range(12):
+        logging.info("Getting text embedding for %s", Truncated("这是一段很长的论坛帖子内容。" * 20))
+    logging.warning("Deployment %s returned %s", "gpt-4o", 429)
@@ -0,0 +1,99 @@
+import asyncio
+
+import pytest
+
+import adaptiveConcurrency
+from adaptiveConcurrency import AdaptiveLimiter, is_overload, is_rate_limited
+
+
+def make_limiter(initial_limit: int = 4) -> AdaptiveLimiter:
+    return AdaptiveLimiter("test", initial_limit, min_limit=1, max_limit=8, backoff=0.5, latency_tolerance=2.0)
+
+
+def test_limit_grows_by_about_one_per_limit_successes():
+    limiter = make_limiter()
+    # 1/4 + 1/4.25 + ... 第五次成功时超过 5
+    for _ in range(5):
+        limiter.on_success(0.1)
+    assert int(limiter.limit) == 5
+
+    for _ in range(100):
+        limiter.on_success(0.1)
+    assert limiter.limit == 8
+
+
+def test_slow_responses_do_not_grow_the_limit():
+    limiter = make_limiter()
+    limiter.on_success(0.1)
+    limit = limiter.limit
+    # 超过平均延迟的 latency_tolerance 倍
+    limiter.on_success(1.0)
+    assert limiter.limit == limit
+
+
+def test_overload_halves_the_limit_once_per_averaged_latency(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(adaptiveConcurrency.time, "monotonic", lambda: now[0])
+    limiter = make_limiter(8)
+    limiter.on_success(0.5)
+
+    limiter.on_overload("429")
+    limiter.on_overload("429")
+    assert limiter.limit == 4
+
+    now[0] += 1.0
+    limiter.on_overload("timeout")
+    assert limiter.limit == 2
+    now[0] += 1.0
+    limiter.on_overload("timeout")
+    now[0] += 1.0
+    limiter.on_overload("timeout")
+    assert limiter.limit == 1
+    assert [(entry["limit"], entry["reason"]) for entry in limiter.history] == [(4, "429"), (2, "timeout"), (1, "timeout")]
+
+
+def test_acquire_waits_for_a_free_slot():
+    async def main():
+        limiter = make_limiter(1)
+        await limiter.acquire()
+        waiting = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0)
+        assert not waiting.done() and len(limiter.waiters) == 1
+
+        limiter.release()
+        await waiting
+        assert limiter.in_flight == 1
+
+    asyncio.run(main())
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def main():
+        limiter = make_limiter(1)
+        await limiter.acquire()
+        waiting = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0)
+        waiting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+        assert not limiter.waiters
+
+    asyncio.run(main())
+
+
+class StatusError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"status {status_code}")
+        self.status_code = status_code
+
+
+def test_overload_detection():
+    wrapped = ValueError("upload failed")
+    wrapped.__cause__ = StatusError(429)
+
+    assert is_rate_limited(StatusError(429))
+    assert is_rate_limited(wrapped)
+    # 错误文本里的 429 不算
+    assert not is_rate_limited(Exception("429 bytes uploaded"))
+    assert not is_overload(StatusError(500))
+    assert is_overload(asyncio.TimeoutError())
@@ -0,0 +1,87 @@
+import itertools
+import os
+
+import pytest
+
+import artifactStore
+from artifactStore import ArtifactStore, shard_name_for
+from objectDefinition import Document
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    # shard 按 created_at 排序，每次保存都让时间前进一秒
+    clock = itertools.count(1000)
+    monkeypatch.setattr(artifactStore.time, "time", lambda: next(clock))
+    return ArtifactStore(str(tmp_path / "artifacts"))
+
+
+def make_document(record_id: str, caption: str = "caption", vector_value: float = 0.5) -> Document:
+    return Document(id=record_id, imageUrl=f"https://example.com/{record_id}.png", caption=caption, content="content", ocrContent="",
+                    captionVector=[vector_value, 1.0], contentVector=[0.25, vector_value], ocrContentVecotor=None,
+                    imageVecotor=[vector_value] * 3, fingerprint="f", game="genshin")
+
+
+def documents_by_id(store: ArtifactStore) -> dict:
+    return {document.id: document for document in store.iter_documents()}
+
+
+def test_documents_and_vectors_round_trip(store):
+    documents = [make_document("a"), make_document("b", vector_value=-2.0)]
+    store.save(documents, "chunk-0-10")
+
+    assert documents_by_id(store) == {document.id: document for document in documents}
+    assert store.count() == 2
+
+
+def test_newest_shard_wins(store):
+    store.save([make_document("a", "old"), make_document("b")], "chunk-0-10")
+    store.save([make_document("a", "new", vector_value=0.75)], "chunk-10-20")
+
+    documents = documents_by_id(store)
+    assert documents["a"] == make_document("a", "new", vector_value=0.75)
+    assert documents["b"] == make_document("b")
+
+
+def test_patch_overrides_fields_of_the_newest_full_record(store):
+    store.save([make_document("a", "old")], "full")
+    store.save_patches([{"id": "a", "caption": "patched", "fingerprint": "g"}], "patch-1")
+
+    patched = documents_by_id(store)["a"]
+    assert (patched.caption, patched.fingerprint, patched.captionVector) == ("patched", "g", [0.5, 1.0])
+
+    # 之后写入的完整记录覆盖更早的 patch
+    store.save([make_document("a", "reprocessed")], "full-2")
+    assert documents_by_id(store)["a"].caption == "reprocessed"
+
+
+def test_tombstone_hides_older_records_until_the_id_comes_back(store):
+    store.save([make_document("a"), make_document("b")], "full")
+    store.save_patches([{"id": "a", "caption": "patched"}], "patch-1")
+    store.save_tombstones(["a"], "deleted-1")
+
+    assert set(documents_by_id(store)) == {"b"}
+    assert store.count() == 1
+
+    store.save([make_document("a", "restored")], "full-2")
+    assert documents_by_id(store)["a"].caption == "restored"
+
+
+def test_unfinished_shards_are_ignored(store):
+    store.save([make_document("a")], "full")
+    # 写到一半的 shard 还没有重命名，也没有 manifest
+    os.makedirs(os.path.join(store.root, "full-2.tmp-123"))
+
+    assert store.shards() == ["full"]
+
+
+def test_mismatched_vector_dimensions_are_rejected(store):
+    broken = make_document("b")
+    broken.captionVector = [1.0]
+    with pytest.raises(ValueError):
+        store.save([make_document("a"), broken], "full")
+
+
+def test_shard_name_for_line_range():
+    assert shard_name_for("data/img_files.txt", 10, 20) == "img_files-10-20"
+    assert shard_name_for("data/img_files.txt") == "img_files-0-end"
@@ -0,0 +1,98 @@
+import asyncio
+import dataclasses
+import time
+
+import pytest
+
+import adaptiveConcurrency
+import callPolicy
+from callPolicy import LatencyTracker, call_with_policy
+from settings import get_settings
+
+
+@pytest.fixture(autouse=True)
+def policy_settings(monkeypatch):
+    settings = dataclasses.replace(get_settings(), service_deadlines={"svc": 0.5}, hedge_services=("svc",), hedge_initial_delay_ms=50,
+                                   adaptive_concurrency=True, adaptive_initial_limit=4)
+    monkeypatch.setattr(callPolicy, "get_settings", lambda: settings)
+    monkeypatch.setattr(adaptiveConcurrency, "get_settings", lambda: settings)
+    monkeypatch.setattr(adaptiveConcurrency, "LIMITERS", {})
+    callPolicy.get_latency_tracker.cache_clear()
+    return settings
+
+
+def make_attempt(delays):
+    # 第 n 次调用睡 delays[n] 秒后返回 n，记录被取消的调用
+    calls = {"started": 0, "cancelled": []}
+
+    async def attempt():
+        number = calls["started"]
+        calls["started"] += 1
+        try:
+            await asyncio.sleep(delays[number])
+        except asyncio.CancelledError:
+            calls["cancelled"].append(number)
+            raise
+        return number
+
+    return attempt, calls
+
+
+def test_fast_call_is_not_hedged():
+    attempt, calls = make_attempt([0.0])
+    assert asyncio.run(call_with_policy("svc", attempt)) == 0
+    assert calls["started"] == 1
+
+
+def test_slow_call_is_hedged_and_the_loser_cancelled():
+    attempt, calls = make_attempt([10, 0.0])
+
+    async def main():
+        result = await call_with_policy("svc", attempt)
+        await asyncio.sleep(0)
+        return result
+
+    assert asyncio.run(main()) == 1
+    assert calls["started"] == 2
+    assert calls["cancelled"] == [0]
+    assert adaptiveConcurrency.LIMITERS["svc"].in_flight == 0
+
+
+def test_only_one_hedge_is_sent():
+    attempt, calls = make_attempt([10, 10, 10])
+    with pytest.raises(TimeoutError):
+        asyncio.run(call_with_policy("svc", attempt))
+    assert calls["started"] == 2
+
+
+def test_deadline_bounds_the_call_and_counts_as_overload():
+    attempt, calls = make_attempt([10, 10])
+    start = time.monotonic()
+    with pytest.raises(TimeoutError):
+        asyncio.run(call_with_policy("svc", attempt))
+
+    assert time.monotonic() - start < 2
+    assert sorted(calls["cancelled"]) == [0, 1]
+    limiter = adaptiveConcurrency.LIMITERS["svc"]
+    assert limiter.overloads == 1 and limiter.in_flight == 0
+
+
+def test_errors_are_raised_without_retry():
+    calls = []
+
+    async def attempt():
+        calls.append(1)
+        raise ValueError("bad request")
+
+    with pytest.raises(ValueError):
+        asyncio.run(call_with_policy("svc", attempt))
+    assert len(calls) == 1
+
+
+def test_hedge_delay_follows_the_observed_percentile(policy_settings):
+    tracker = LatencyTracker()
+    # 样本不够时用 hedge_initial_delay_ms
+    assert tracker.hedge_delay() == 0.05
+    for i in range(100):
+        tracker.record(i / 100)
+    assert tracker.hedge_delay() == pytest.approx(0.95)
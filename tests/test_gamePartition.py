@@ -0,0 +1,28 @@
+from gamePartition import DEFAULT_GAME_RULES, GameClassifier, build_game_filter
+
+classifier = GameClassifier(DEFAULT_GAME_RULES)
+
+
+def test_keywords_and_aliases_pick_the_game():
+    assert classifier.classify("今天在匹诺康尼抽到了新角色") == "崩坏：星穹铁道"
+    assert classifier.classify("dnf 新版本搬砖攻略") == "DNF手游"
+
+
+def test_text_without_a_game_is_not_classified():
+    assert classifier.classify("今天天气不错") is None
+    assert classifier.classify("") is None
+
+
+def test_tie_is_not_classified():
+    # 两个游戏各提到一次，不归到任何分区
+    assert classifier.classify("原神和绝区零哪个好玩") is None
+
+
+def test_hashtag_outweighs_a_passing_mention():
+    assert classifier.classify("和原神比起来，星铁的剧情更好 #绝区零") == "绝区零"
+
+
+def test_game_filter_includes_unclassified_documents():
+    assert build_game_filter(None) is None
+    assert build_game_filter("原神") == "game eq '原神' or game eq null"
+    assert build_game_filter("it's") == "game eq 'it''s' or game eq null"
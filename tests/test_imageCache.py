@@ -0,0 +1,45 @@
+import asyncio
+import threading
+
+from imageCache import ImageCache
+
+URL = "https://img2.tapimg.com/moment/etag/FvhNYMQT78nnCjAvBqHvY40FcH46.jpeg"
+
+
+def test_round_trip_and_meta(tmp_path):
+    cache = ImageCache(str(tmp_path), 1024 * 1024)
+    cache.put("https://example.com/a.png", b"image", {"etag": "v1"})
+    assert cache.get("https://example.com/a.png") == (b"image", {"etag": "v1"})
+    assert cache.get("https://example.com/b.png") == (None, {})
+
+
+def test_etag_urls_share_an_entry_across_hosts(tmp_path):
+    cache = ImageCache(str(tmp_path), 1024 * 1024)
+    cache.put(URL, b"image")
+    assert cache.get(URL.replace("img2", "img3"))[0] == b"image"
+
+
+def test_put_async_evicts_in_the_background(tmp_path):
+    cache = ImageCache(str(tmp_path), 1000)
+    evicting = threading.Event()
+    release = threading.Event()
+    evict = cache.evict
+
+    def slow_evict():
+        evicting.set()
+        release.wait(5)
+        evict()
+
+    cache.evict = slow_evict
+
+    async def main():
+        for i in range(5):
+            # 淘汰还没结束时写入也不会被阻塞
+            await cache.put_async(f"https://example.com/{i}.png", b"x" * 400)
+        assert evicting.is_set() and not cache.eviction.done()
+        release.set()
+        await cache.eviction
+
+    asyncio.run(main())
+    total = sum(f.stat().st_size for f in tmp_path.rglob("*") if f.is_file() and not f.name.startswith("."))
+    assert total <= 1000
@@ -0,0 +1,62 @@
+"""Worker and entry-point modules must import quickly and without any credentials.
+
+Every chunk is processed by a fresh `python3 dataProcess.py` process, so import time is paid
+once per chunk. Each module is imported in its own interpreter with `-X importtime` and an
+environment without any Azure settings; an import that raises (a missing SDK class, a client
+built at import time) or whose cumulative import time exceeds the budget fails the test.
+"""
+import os
+import subprocess
+import sys
+from typing import Dict
+
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# 每个 chunk 都会启动 dataProcess.py，这些模块的 import 时间直接计入每个 chunk；
+# prepdocs 被 reindex、textPostProcess 和 capacityPlanner 引用，它 import 失败这些入口都不能用
+MODULES = [
+    "settings",
+    "stageScheduler",
+    "indexState",
+    "vectorFieldOptions",
+    "aoaiDeploymentPool",
+    "cvEndpointPool",
+    "multiModelsPictureProcess",
+    "textEmbeddingProcess",
+    "multiModelsEmbedding",
+    "pictureOcrProcess",
+    "data_utils",
+    "batchApiProcess",
+    "dataProcess",
+    "search_utils",
+    "prepdocs",
+    "reindex",
+    "textPostProcess",
+    "capacityPlanner",
+]
+BUDGET_MS = 1500
+
+
+def scrubbed_env() -> Dict[str, str]:
+    # 去掉所有服务配置，import 阶段不允许读取凭据或者创建 client
+    env = {k: v for k, v in os.environ.items() if not k.startswith(("AZURE_", "FORM_RECOGNIZER_", "EMBEDDING_"))}
+    env["PYTHONDONTWRITEBYTECODE"] = "1"
+    return env
+
+
+@pytest.mark.parametrize("module", MODULES)
+def test_module_imports_within_budget_without_credentials(module):
+    # .env 只在 get_settings() 第一次调用时加载，所以 import 阶段看不到它
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            cwd=REPO_ROOT, env=scrubbed_env(), capture_output=True, text=True)
+    assert result.returncode == 0, f"import {module} failed without credentials:\n{result.stderr.strip().splitlines()[-1]}"
+
+    # 格式: "import time: self [us] | cumulative | imported package"
+    cumulative_ms = None
+    for line in result.stderr.splitlines():
+        parts = [part.strip() for part in line.split("|")]
+        if len(parts) == 3 and parts[2] == module:
+            cumulative_ms = int(parts[1]) / 1000
+    assert cumulative_ms is not None, f"No import time reported for {module}"
+    assert cumulative_ms <= BUDGET_MS, f"import {module} took {cumulative_ms:.0f} ms, budget {BUDGET_MS} ms"
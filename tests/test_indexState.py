@@ -0,0 +1,56 @@
+import dataclasses
+
+import pytest
+
+import indexState
+from indexState import IndexStateStore, compute_fingerprint, find_deleted_ids, plan_incremental
+from objectDefinition import ImageData
+from settings import get_settings
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = IndexStateStore(str(tmp_path / "state.db"))
+    yield store
+    store.close()
+
+
+def make_item(record_id: str, caption: str = "caption", image_url: str = None) -> ImageData:
+    return ImageData(id=record_id, imageUrl=image_url or f"https://example.com/{record_id}.png", caption=caption)
+
+
+def test_plan_sorts_records_by_what_changed(store):
+    store.upsert([make_item("same"), make_item("caption"), make_item("image")])
+    items = [make_item("same"), make_item("caption", "new caption"), make_item("image", image_url="https://example.com/other.png"), make_item("new")]
+
+    plan = plan_incremental(items, store)
+
+    assert [item.id for item in plan.unchanged] == ["same"]
+    assert [item.id for item in plan.to_patch] == ["caption"]
+    assert [item.id for item in plan.to_enrich] == ["image", "new"]
+
+
+def test_pipeline_version_change_re_enriches_everything(store, monkeypatch):
+    store.upsert([make_item("a")])
+    settings = dataclasses.replace(get_settings(), pipeline_version=get_settings().pipeline_version + "-next")
+    monkeypatch.setattr(indexState, "get_settings", lambda: settings)
+
+    assert [item.id for item in plan_incremental([make_item("a")], store).to_enrich] == ["a"]
+
+
+def test_state_restored_from_the_index_re_enriches_changed_records(store):
+    # 从索引恢复的状态没有 image_hash，caption 变化也要完整处理
+    store.upsert_fingerprints({"a": compute_fingerprint(make_item("a")), "b": compute_fingerprint(make_item("b"))})
+
+    plan = plan_incremental([make_item("a"), make_item("b", "new caption")], store)
+
+    assert [item.id for item in plan.unchanged] == ["a"]
+    assert [item.id for item in plan.to_enrich] == ["b"]
+
+
+def test_deleted_ids_are_the_stored_ids_missing_from_the_input(store):
+    store.upsert([make_item("a"), make_item("b"), make_item("c")])
+    assert sorted(find_deleted_ids([make_item("b")], store)) == ["a", "c"]
+
+    store.delete(["a", "c"])
+    assert find_deleted_ids([make_item("b")], store) == []
@@ -0,0 +1,50 @@
+import pytest
+
+from lineIndex import INDEX_SUFFIX, LineIndex, read_line_range, split_lines
+
+# 含中文、空行、\u2028 和没有换行符的最后一行
+LINES = ["{'id': 1, 'caption': '原神'}", "", "caption with \u2028 inside", "四", "tail"]
+
+
+@pytest.fixture
+def input_file(tmp_path):
+    path = tmp_path / "img_files.txt"
+    path.write_bytes("\n".join(LINES).encode("utf-8"))
+    return str(path)
+
+
+@pytest.mark.parametrize("lines_per_chunk", [1, 2, 3, 5, 100])
+def test_shards_read_back_the_whole_file(input_file, lines_per_chunk):
+    index = LineIndex.build(input_file)
+    shards = index.shard_ranges(lines_per_chunk)
+
+    assert shards[0][0] == 0 and shards[-1][1] == index.line_count
+    assert all(previous[1] == current[0] for previous, current in zip(shards, shards[1:]))
+    assert [line for start, end in shards for line in index.read_lines(start, end)] == read_line_range(input_file) == LINES
+
+
+def test_read_line_range_matches_a_full_read(input_file):
+    for start in range(len(LINES) + 1):
+        for end in range(start, len(LINES) + 2):
+            assert read_line_range(input_file, start, end) == LINES[start:end]
+
+
+def test_saved_index_is_reused_until_the_file_changes(input_file):
+    LineIndex.load_or_build(input_file)
+    assert LineIndex.load(input_file).offsets == LineIndex.build(input_file).offsets
+
+    with open(input_file, "ab") as f:
+        f.write(b"\nappended")
+    # 大小变了，旧索引作废
+    assert LineIndex.load(input_file) is None
+    assert LineIndex.load_or_build(input_file).read_lines(len(LINES)) == ["appended"]
+
+
+def test_index_with_wrong_magic_is_ignored(input_file):
+    with open(input_file + INDEX_SUFFIX, "wb") as f:
+        f.write(b"garbage!" + b"\0" * 32)
+    assert LineIndex.load(input_file) is None
+
+
+def test_split_lines_only_splits_on_newline():
+    assert split_lines("a\u2028b\r\nc\n".encode("utf-8")) == ["a\u2028b\r", "c"]
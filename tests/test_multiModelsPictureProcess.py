@@ -0,0 +1,66 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+
+import multiModelsPictureProcess
+from multiModelsPictureProcess import get_contents_by_multi_model, parse_multi_image_response, post_id_of
+
+IMAGES = [("post_0", "https://example.com/0.png"), ("post_1", "https://example.com/1.png")]
+
+
+def test_parse_keeps_only_requested_ids_with_a_description():
+    content = json.dumps({"descriptions": [
+        {"id": "post_0", "description": "一张截图"},
+        {"id": "post_1", "description": ""},
+        {"id": "other_0", "description": "不在请求里"},
+    ]}, ensure_ascii=False)
+    assert parse_multi_image_response(content, ["post_0", "post_1"]) == {"post_0": "一张截图"}
+
+
+def test_parse_rejects_invalid_json():
+    with pytest.raises(ValueError):
+        parse_multi_image_response('{"descriptions": [', ["post_0"])
+
+
+def stub_services(monkeypatch, content):
+    single_requests = []
+
+    async def call_with_policy(service, attempt):
+        if isinstance(content, Exception):
+            raise content
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+    async def get_content_by_mulit_model(picture_url):
+        single_requests.append(picture_url)
+        return f"single {picture_url}"
+
+    monkeypatch.setattr(multiModelsPictureProcess, "call_with_policy", call_with_policy)
+    monkeypatch.setattr(multiModelsPictureProcess, "get_content_by_mulit_model", get_content_by_mulit_model)
+    return single_requests
+
+
+def test_missing_descriptions_fall_back_to_single_requests(monkeypatch):
+    single_requests = stub_services(monkeypatch, json.dumps({"descriptions": [{"id": "post_0", "description": "grouped"}]}))
+
+    descriptions = asyncio.run(get_contents_by_multi_model(IMAGES))
+
+    assert descriptions == {"post_0": "grouped", "post_1": "single https://example.com/1.png"}
+    assert single_requests == ["https://example.com/1.png"]
+
+
+@pytest.mark.parametrize("content", ['{"descriptions": [', RuntimeError("content filter")])
+def test_failed_group_request_falls_back_for_every_image(monkeypatch, content):
+    single_requests = stub_services(monkeypatch, content)
+
+    descriptions = asyncio.run(get_contents_by_multi_model(IMAGES))
+
+    assert set(descriptions) == {"post_0", "post_1"}
+    assert single_requests == [url for _, url in IMAGES]
+
+
+def test_post_id_of_image_id():
+    assert post_id_of("12345_2") == "12345"
+    assert post_id_of("a_b_3") == "a_b"
+    assert post_id_of("12345") == "12345"
@@ -0,0 +1,30 @@
+import os
+
+import pytest
+
+from qaDataset import load_qa_records
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "multiModelGameTestData")
+
+
+@pytest.mark.parametrize("file_name", ["qa_3.txt"])
+def test_loads_every_question_of_the_real_qa_file(file_name):
+    qa_path = os.path.join(DATA_DIR, file_name)
+    with open(qa_path, "r", encoding="utf-8") as f:
+        non_empty_lines = sum(1 for line in f if line.strip())
+
+    records = load_qa_records(qa_path)
+
+    # line 104 has a trailing "}", its record is still kept
+    assert len(records) == non_empty_lines
+    assert all(record["question"] and "answer" in record for record in records)
+
+
+def test_skips_lines_without_a_valid_object(tmp_path, caplog):
+    qa_path = tmp_path / "qa.txt"
+    qa_path.write_text('{"question": "q1", "answer": "a1"}}\nnot json\n\n{"question": "q2", "answer": "a2"}\n', encoding="utf-8")
+
+    records = load_qa_records(str(qa_path))
+
+    assert [record["question"] for record in records] == ["q1", "q2"]
+    assert "line 2" in caplog.text
@@ -0,0 +1,110 @@
+import asyncio
+import gzip
+import json
+
+import numpy as np
+import pytest
+
+import searchUpload
+from searchUpload import SearchUploader, get_retry_delay, serialize_batch
+
+
+def test_serialize_batch_writes_float32_vectors_and_keeps_other_fields():
+    vector = [0.1, -0.0123456789, 0.0]
+    body = json.loads(serialize_batch([{"@search.action": "mergeOrUpload", "id": "a", "caption": "原神", "captionVector": vector}]))
+
+    document = body["value"][0]
+    assert (document["@search.action"], document["id"], document["caption"]) == ("mergeOrUpload", "a", "原神")
+    assert document["captionVector"] == [float(str(value)) for value in np.asarray(vector, dtype=np.float32)]
+
+
+def test_serialize_batch_rounds_to_significant_digits():
+    body = json.loads(serialize_batch([{"id": "a", "contentVector": [0.123456, -0.000123456]}], digits=3))
+    assert body["value"][0]["contentVector"] == pytest.approx([0.123, -0.000123], rel=1e-6)
+
+
+def test_json_fallback_matches_orjson(monkeypatch):
+    batch = [{"id": "a", "captionVector": [0.1, 0.2, 1 / 3], "imageVecotor": None}]
+    with_orjson = json.loads(serialize_batch(batch))
+    monkeypatch.setattr(searchUpload, "orjson", None)
+    assert json.loads(serialize_batch(batch)) == with_orjson
+
+
+def test_retry_delay_prefers_the_service_headers():
+    assert get_retry_delay({"retry-after-ms": "250"}, 3) == 0.25
+    assert get_retry_delay({"Retry-After": "2"}, 3) == 2.0
+    assert get_retry_delay({}, 2) == searchUpload.RETRY_BACKOFF_SECONDS * 4
+
+
+class FakeResponse:
+    def __init__(self, status, payload=None):
+        self.status = status
+        self.payload = payload
+        self.headers = {"retry-after-ms": "0"}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    async def json(self):
+        return self.payload
+
+    async def text(self):
+        return "error"
+
+
+class FakeSession:
+    # 超过 max_documents 条文档的请求返回 413，statuses 里的状态码先依次返回
+    def __init__(self, max_documents, statuses=()):
+        self.max_documents = max_documents
+        self.statuses = list(statuses)
+        self.requests = []
+
+    def post(self, url, data, headers):
+        documents = json.loads(gzip.decompress(data))["value"]
+        self.requests.append([d["id"] for d in documents])
+        if self.statuses:
+            return FakeResponse(self.statuses.pop(0))
+        if len(documents) > self.max_documents:
+            return FakeResponse(413)
+        return FakeResponse(200, {"value": [{"key": d["id"], "status": True, "statusCode": 201} for d in documents]})
+
+
+def make_uploader(session) -> SearchUploader:
+    uploader = SearchUploader("https://search.example.com/", "index", "key")
+    uploader.session = session
+    return uploader
+
+
+def test_too_large_batch_is_split_in_halves():
+    session = FakeSession(max_documents=2)
+    uploader = make_uploader(session)
+    batch = [{"id": str(i)} for i in range(5)]
+
+    results = asyncio.run(uploader.upload(batch))
+
+    assert [result.key for result in results] == ["0", "1", "2", "3", "4"]
+    assert session.requests == [["0", "1", "2", "3", "4"], ["0", "1"], ["2", "3", "4"], ["2"], ["3", "4"]]
+    assert (uploader.stats.splits, uploader.stats.batches, uploader.stats.documents) == (2, 3, 5)
+
+
+def test_single_document_413_is_raised():
+    uploader = make_uploader(FakeSession(max_documents=0))
+    with pytest.raises(Exception) as error:
+        asyncio.run(uploader.upload([{"id": "a"}]))
+    assert error.value.status_code == 413
+
+
+def test_throttled_request_is_retried_until_max_retries():
+    session = FakeSession(max_documents=10, statuses=[503, 429])
+    uploader = make_uploader(session)
+
+    assert [result.key for result in asyncio.run(uploader.upload([{"id": "a"}]))] == ["a"]
+    assert uploader.stats.retries == 2
+
+    uploader = make_uploader(FakeSession(max_documents=10, statuses=[503] * 4))
+    with pytest.raises(Exception) as error:
+        asyncio.run(uploader.upload([{"id": "a"}]))
+    assert error.value.status_code == 503
@@ -0,0 +1,84 @@
+import asyncio
+
+import pytest
+
+from stageScheduler import Stage, StageScheduler
+
+
+def test_stages_run_after_their_dependencies_and_receive_their_results():
+    events = []
+
+    async def download(item):
+        events.append(("download", item))
+        return f"bytes-{item}"
+
+    async def caption(item, download):
+        events.append(("caption", item))
+        return f"caption of {download}"
+
+    async def ocr(item, download):
+        return f"ocr of {download}"
+
+    async def embed(item, caption, ocr):
+        return (caption, ocr)
+
+    stages = [Stage("embed", embed, ["caption", "ocr"]), Stage("caption", caption, ["download"]), Stage("ocr", ocr, ["download"]),
+              Stage("download", download)]
+    results = asyncio.run(StageScheduler(stages).run([1, 2]))
+
+    assert [item for item, _ in results] == [1, 2]
+    assert results[0][1]["embed"] == ("caption of bytes-1", "ocr of bytes-1")
+    for item in (1, 2):
+        assert events.index(("download", item)) < events.index(("caption", item))
+
+
+def test_stage_concurrency_is_enforced():
+    running = {"now": 0, "max": 0}
+
+    async def work(item):
+        running["now"] += 1
+        running["max"] = max(running["max"], running["now"])
+        await asyncio.sleep(0.01)
+        running["now"] -= 1
+
+    asyncio.run(StageScheduler([Stage("work", work, concurrency=2)]).run(list(range(10))))
+    assert running["max"] == 2
+
+
+def test_failed_stage_cancels_the_rest_of_the_item():
+    cancelled = []
+
+    async def fail(item):
+        if item == "bad":
+            raise ValueError("broken image")
+        return item
+
+    async def slow(item):
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(item)
+            raise
+
+    async def after(item, fail):
+        return fail
+
+    stages = [Stage("fail", fail), Stage("slow", slow), Stage("after", after, ["fail"])]
+
+    async def main():
+        scheduler = StageScheduler(stages)
+        return await asyncio.wait_for(scheduler.run(["bad"]), 2)
+
+    [(item, result)] = asyncio.run(main())
+    assert item == "bad" and isinstance(result, ValueError)
+    assert cancelled == ["bad"]
+
+
+@pytest.mark.parametrize("stages, message", [
+    ([Stage("a", None, ["b"]), Stage("b", None, ["a"])], "cycle"),
+    ([Stage("a", None, ["missing"])], "Unknown"),
+    ([Stage("a", None), Stage("a", None)], "unique"),
+])
+def test_invalid_graphs_are_rejected(stages, message):
+    with pytest.raises(ValueError, match=message):
+        StageScheduler(stages)
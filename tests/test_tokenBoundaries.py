@@ -0,0 +1,29 @@
+import fusedTextVector
+
+
+class ByteEncoding:
+    # 每个 UTF-8 字节一个 token，汉字一定会被截断在中间
+    def encode(self, text):
+        return list(text.encode("utf-8"))
+
+    def decode(self, tokens, errors="replace"):
+        return bytes(tokens).decode("utf-8", errors=errors)
+
+
+def test_build_fused_text_has_no_replacement_characters(monkeypatch):
+    monkeypatch.setattr(fusedTextVector, "_encoding", ByteEncoding())
+    fused = fusedTextVector.build_fused_text("崩坏星穹铁道", "开拓者来到了匹诺康尼", "星铁", max_tokens=20)
+    assert "�" not in fused
+    assert fused.startswith("崩")
+
+
+def test_split_into_chunks_keeps_every_character(monkeypatch):
+    import textPostProcess
+
+    monkeypatch.setattr(fusedTextVector, "_encoding", ByteEncoding())
+    text = "开拓者来到了匹诺康尼，星穹铁道新版本上线"
+    chunks = textPostProcess.split_into_chunks(text, 16, 6)
+    assert len(chunks) > 1
+    assert all("�" not in chunk for chunk in chunks)
+    # 每个字都完整地出现在某个 chunk 里
+    assert all(any(character in chunk for chunk in chunks) for character in text)
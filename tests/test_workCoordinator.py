@@ -0,0 +1,72 @@
+import pytest
+
+from workCoordinator import SqliteWorkCoordinator, WorkCoordinator
+
+
+@pytest.fixture
+def coordinator(tmp_path):
+    coordinator = SqliteWorkCoordinator(str(tmp_path / "coordinator.db"), max_attempts=2)
+    coordinator.create_job("job", "input.txt", [(0, 10), (10, 20)])
+    return coordinator
+
+
+def test_chunks_are_claimed_once_and_completed(coordinator):
+    first = coordinator.claim("job", "worker-1", 60)
+    second = coordinator.claim("job", "worker-2", 60)
+
+    assert (first.start_line, first.end_line) == (0, 10)
+    assert (second.start_line, second.end_line) == (10, 20)
+    assert coordinator.claim("job", "worker-3", 60) is None
+    assert coordinator.complete(first) and coordinator.complete(second)
+    assert coordinator.progress("job") == {"done": 2}
+
+
+def test_expired_lease_is_reclaimed_and_the_old_holder_cannot_complete(coordinator):
+    # lease_seconds 为负数，领取时就已经过期
+    stale = coordinator.claim("job", "worker-1", -1)
+    reclaimed = coordinator.claim("job", "worker-2", 60)
+
+    assert reclaimed.chunk_id == stale.chunk_id
+    assert not coordinator.heartbeat(stale, 60)
+    assert not coordinator.complete(stale)
+    assert coordinator.complete(reclaimed)
+
+
+def test_chunk_fails_after_max_attempts_of_expired_leases(coordinator):
+    coordinator.claim("job", "worker-1", -1)
+    coordinator.claim("job", "worker-2", -1)
+
+    # 第三次领取时 chunk 0 已经用完两次机会，改为 failed，交出的是 chunk 1
+    lease = coordinator.claim("job", "worker-3", 60)
+
+    assert lease.chunk_id == 1
+    assert coordinator.progress("job") == {"failed": 1, "leased": 1}
+
+
+def test_released_chunk_goes_back_to_pending_until_max_attempts(coordinator):
+    first = coordinator.claim("job", "worker-1", 60)
+    assert coordinator.release(first, "boom") == "pending"
+
+    second = coordinator.claim("job", "worker-2", 60)
+    assert second.chunk_id == first.chunk_id
+    assert coordinator.release(second, "boom") == "failed"
+    # 旧的 lease 已经失效
+    assert coordinator.release(first, "boom") is None
+    assert coordinator.claim("job", "worker-3", 60).chunk_id == 1
+
+
+def test_create_job_again_keeps_progress(coordinator):
+    coordinator.complete(coordinator.claim("job", "worker-1", 60))
+    coordinator.create_job("job", "input.txt", [(0, 10), (10, 20)])
+
+    assert coordinator.progress("job") == {"done": 1, "pending": 1}
+    assert coordinator.get_job_file("job") == "input.txt"
+
+
+def test_incomplete_backend_cannot_be_instantiated():
+    class ClaimOnly(WorkCoordinator):
+        def claim(self, job_id, worker_id, lease_seconds):
+            return None
+
+    with pytest.raises(TypeError):
+        ClaimOnly()
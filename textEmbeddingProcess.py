@@ -1,31 +1,44 @@
 import asyncio
+import functools
 import logging
-import os
+from typing import List
 
-from dotenv import load_dotenv
-from openai import AsyncAzureOpenAI
+from aoaiDeploymentPool import DeploymentPool, load_deployments
+from callPolicy import call_with_policy
+from settings import configure_logging, get_settings
+from structuredLogging import Truncated
 
-load_dotenv(verbose=True)
 
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-
-
-azureOpenAIClient = AsyncAzureOpenAI(
-  api_key = os.getenv("AZURE_OPENAI_API_KEY"),  
-  api_version = "2024-02-01",
-  azure_endpoint =os.getenv("AZURE_OPENAI_ENDPOINT") 
-)
-
-embedding_deployment = os.getenv("EMBEDDING_MODEL_DEPLOYMENT")
+@functools.lru_cache(maxsize=None)
+def get_embedding_deployment_pool() -> DeploymentPool:
+    # AZURE_OPENAI_EMBEDDING_DEPLOYMENTS 可以配置多个 embedding 部署，按配额加权路由
+    settings = get_settings()
+    return DeploymentPool(
+        "embedding",
+        load_deployments(settings.embedding_deployments_json, settings.azure_openai_endpoint, settings.azure_openai_api_key, settings.embedding_deployment, settings.embedding_api_version)
+    )
 
 
 async def get_text_embedding(text):
-    logging.info(f"Getting text embedding for {text}")
+    logging.info("Getting text embedding for %s", Truncated(text))
     
-    response = await azureOpenAIClient.embeddings.create(input = text,model = embedding_deployment)
+    # 对冲请求由部署池按权重重新选择部署
+    response = await call_with_policy("embedding", lambda: get_embedding_deployment_pool().call(
+        lambda client, deployment: client.embeddings.with_raw_response.create(input = text,model = deployment)
+    ))
     return response.data[0].embedding
 
+async def get_text_embeddings(texts: List[str]) -> List[List[float]]:
+    # 一个请求处理多段文本，文本帖子的 chunk 按批调用
+    logging.info("Getting text embeddings for %s texts", len(texts))
+
+    response = await call_with_policy("embedding", lambda: get_embedding_deployment_pool().call(
+        lambda client, deployment: client.embeddings.with_raw_response.create(input = texts,model = deployment)
+    ))
+    return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
 if __name__ == "__main__":
+    configure_logging()
     # 示例调用
     input = "hello world!"
     result = asyncio.run(get_text_embedding(input))
@@ -0,0 +1,197 @@
+"""Ingest text-only posts ({'title': ..., 'content': ...} per line) as token-bounded chunks.
+
+Each post is split into overlapping chunks of text_chunk_tokens tokens, the chunks are
+embedded text_embedding_batch_size at a time through the embedding deployment pool, and
+uploaded with a parentId pointing back to the post. By default chunks go to a sibling
+index (<AZURE_SEARCH_INDEX>-posts); --same-index writes them into the picture index instead.
+
+A post is keyed by its 'id' when the line has one, otherwise by a hash of title and content.
+After the upload, chunks of the processed posts that the new chunking no longer produces are
+deleted, so a post that shrinks leaves nothing behind. Without a source id an edited post
+gets a new key; --prune on a run over the whole file deletes the chunks of every post that
+is no longer in the file, which also removes the old version of edited posts.
+"""
+import argparse
+import ast
+import asyncio
+import dataclasses
+import hashlib
+import logging
+from typing import Dict, List, Optional
+
+from azure.core.credentials import AzureKeyCredential
+from azure.search.documents.aio import SearchClient
+from azure.search.documents.indexes import SearchIndexClient
+
+from dataProcess import delete_documents_from_index, index_documents_in_batches
+from embeddingBackend import get_embedding_backend
+from fusedTextVector import decode_tokens, get_encoding
+from gamePartition import get_game_classifier
+from lineIndex import read_line_range
+from objectDefinition import TextChunkDocument, TextPost
+from prepdocs import create_text_post_index
+from settings import configure_logging, get_settings
+from stageScheduler import Stage, StageScheduler
+from structuredLogging import Truncated
+from vectorFieldOptions import FUSED_TEXT_VECTOR_FIELD, round_vector_for_upload
+
+# 按 parentId 查询旧 chunk 时，每个 filter 里的帖子数
+PARENT_FILTER_BATCH = 100
+
+
+def parse_text_posts(file_path: str, start_line: int = 0, end_line: Optional[int] = None) -> List[TextPost]:
+    posts = []
+    for line_number, line in enumerate(read_line_range(file_path, start_line, end_line), start_line):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            # 每行是一个 Python dict 字面量，content 里有转义的换行和引号
+            record = ast.literal_eval(line)
+        except (ValueError, SyntaxError) as e:
+            logging.error("Error parsing line %s: %s (%s)", line_number, Truncated(line, 200), e)
+            continue
+        title = record.get("title") or ""
+        content = record.get("content") or ""
+        if record.get("id") is not None:
+            # 源数据的 id 不随编辑变化，修改后的帖子覆盖原来的 chunk
+            post_id = str(record["id"])
+        else:
+            post_id = hashlib.sha256(f"{title}\x1f{content}".encode("utf-8")).hexdigest()[:32]
+        posts.append(TextPost(id=post_id, title=title, content=content))
+    return posts
+
+def split_into_chunks(text: str, max_tokens: int, overlap: int) -> List[str]:
+    # 按 token 切分，相邻 chunk 重叠 overlap 个 token，避免一句话被切断后两边都检索不到
+    encoding = get_encoding()
+    tokens = encoding.encode(text)
+    if len(tokens) <= max_tokens:
+        return [text] if text.strip() else []
+    chunks = []
+    step = max_tokens - overlap
+    for start in range(0, len(tokens), step):
+        # 切在汉字中间时两端不完整的字节丢掉，这个字完整地出现在相邻 chunk 的重叠部分里
+        chunks.append(decode_tokens(tokens[start:start + max_tokens]))
+        if start + max_tokens >= len(tokens):
+            break
+    return chunks
+
+def build_text_chunks(posts: List[TextPost], max_tokens: int, overlap: int) -> List[TextChunkDocument]:
+    chunks = []
+    for post in posts:
+        # 标题也算在 token 预算里，每个 chunk 的 embedding 输入都带上标题
+        chunk_tokens = max(max_tokens - len(get_encoding().encode(post.title)), overlap + 1)
+        # 按整个帖子分类，同一个帖子的 chunk 在同一个分区
+        game = get_game_classifier().classify(f"{post.title}\n{post.content}")
+        for i, chunk in enumerate(split_into_chunks(post.content, chunk_tokens, overlap)):
+            chunks.append(TextChunkDocument(id=f"{post.id}-{i}", parentId=post.id, chunkIndex=i, title=post.title, content=chunk, game=game))
+    return chunks
+
+async def embed_text_chunks(chunks: List[TextChunkDocument], batch_size: int) -> List[TextChunkDocument]:
+    # 每个 item 是一批 chunk，并发由 stage_concurrency 里的 text_embedding 控制
+    async def embed_batch(batch):
+        vectors = await get_embedding_backend().embed_texts([f"{chunk.title}\n{chunk.content}" for chunk in batch])
+        for chunk, vector in zip(batch, vectors):
+            chunk.contentVector = vector
+        return batch
+
+    stages = [Stage("text_embedding", embed_batch, concurrency=get_settings().stage_concurrency["text_embedding"])]
+    scheduler = StageScheduler(stages, item_id=lambda batch: batch[0].parentId)
+    batches = [chunks[i : i + batch_size] for i in range(0, len(chunks), batch_size)]
+
+    embedded = []
+    for batch, result in await scheduler.run(batches):
+        if isinstance(result, Exception):
+            logging.error("Embedding batch starting at %s failed: %s", batch[0].id, result)
+            continue
+        embedded.extend(batch)
+    return embedded
+
+def to_upload_dict(chunk: TextChunkDocument, same_index: bool) -> dict:
+    d = dataclasses.asdict(chunk)
+    d["@search.action"] = "mergeOrUpload"
+    d["caption"] = d.pop("title")
+    d["contentVector"] = round_vector_for_upload(d["contentVector"])
+    if same_index:
+        # 图片索引没有 chunkIndex 字段；融合模式下文本向量只有 fusedTextVector 一个字段
+        del d["chunkIndex"]
+        if get_settings().text_vector_mode == "fused":
+            d[FUSED_TEXT_VECTOR_FIELD] = d.pop("contentVector")
+    return d
+
+def build_parent_filter(post_ids: List[str]) -> str:
+    # OData 字符串里的单引号写两次
+    escaped = "|".join(post_id.replace("'", "''") for post_id in post_ids)
+    return f"search.in(parentId, '{escaped}', '|')"
+
+async def find_chunk_parents(search_client: SearchClient, filter_text: str) -> Dict[str, str]:
+    # chunk id -> parentId
+    results = await search_client.search(search_text="*", filter=filter_text, select=["id", "parentId"])
+    return {result["id"]: result["parentId"] async for result in results}
+
+async def remove_stale_chunks(chunks: List[TextChunkDocument], uploaded_chunks: List[TextChunkDocument], search_client: SearchClient) -> int:
+    # 帖子变短后 chunk 变少，索引里多出来的旧 chunk 要删掉；有 chunk 上传失败的帖子保留旧 chunk
+    uploaded_ids = {chunk.id for chunk in uploaded_chunks}
+    failed_posts = {chunk.parentId for chunk in chunks if chunk.id not in uploaded_ids}
+    post_ids = sorted({chunk.parentId for chunk in chunks} - failed_posts)
+    stale_ids = []
+    for i in range(0, len(post_ids), PARENT_FILTER_BATCH):
+        existing = await find_chunk_parents(search_client, build_parent_filter(post_ids[i : i + PARENT_FILTER_BATCH]))
+        stale_ids.extend(chunk_id for chunk_id in existing if chunk_id not in uploaded_ids)
+    if stale_ids:
+        await delete_documents_from_index(stale_ids, search_client)
+    return len(stale_ids)
+
+async def prune_removed_posts(posts: List[TextPost], search_client: SearchClient) -> int:
+    # 只能在处理整个文件时调用：parentId 不在文件里的 chunk 属于删除或者修改过（没有源 id）的帖子
+    post_ids = {post.id for post in posts}
+    existing = await find_chunk_parents(search_client, "parentId ne null")
+    removed_ids = [chunk_id for chunk_id, parent_id in existing.items() if parent_id and parent_id not in post_ids]
+    if removed_ids:
+        await delete_documents_from_index(removed_ids, search_client)
+    return len(removed_ids)
+
+async def process_text_post_file(file_path: str, search_client: SearchClient, same_index: bool = False,
+                                 start_line: int = 0, end_line: Optional[int] = None, upload_batch_size: int = 100, prune: bool = False):
+    if prune and (start_line or end_line is not None):
+        raise ValueError("--prune needs the whole file, it deletes the chunks of every post missing from it")
+    settings = get_settings()
+    posts = parse_text_posts(file_path, start_line, end_line)
+    chunks = build_text_chunks(posts, settings.text_chunk_tokens, settings.text_chunk_overlap)
+    print(f"Processed file {file_path}: {len(posts)} posts, {len(chunks)} chunks")
+
+    embedded_chunks = await embed_text_chunks(chunks, settings.text_embedding_batch_size)
+    print(f"chunks with errors: {len(chunks) - len(embedded_chunks)}")
+
+    print("Uploading chunks to index...")
+    await index_documents_in_batches([to_upload_dict(chunk, same_index) for chunk in embedded_chunks], search_client, upload_batch_size)
+    print(f"stale chunks removed: {await remove_stale_chunks(chunks, embedded_chunks, search_client)}")
+    if prune:
+        print(f"chunks of removed posts deleted: {await prune_removed_posts(posts, search_client)}")
+    return embedded_chunks
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Chunk, embed and upload a file of text-only posts.")
+    parser.add_argument("file_path", help="posts file, e.g. multiModelGameTestData/noimg_files.txt")
+    parser.add_argument("--same-index", action="store_true", help="upload into AZURE_SEARCH_INDEX instead of the text post index")
+    parser.add_argument("--create", action="store_true", help="create the text post index first")
+    parser.add_argument("--start-line", type=int, default=0)
+    parser.add_argument("--end-line", type=int, default=None)
+    parser.add_argument("--prune", action="store_true", help="delete the chunks of posts that are no longer in the file, needs the whole file")
+    args = parser.parse_args()
+
+    configure_logging()
+    settings = get_settings()
+    search_creds = AzureKeyCredential(settings.search_key)
+    index_name = settings.search_index if args.same_index else (settings.text_post_index or f"{settings.search_index}-posts")
+    print("Preparing text posts for index:", index_name)
+
+    if args.create and not args.same_index:
+        create_text_post_index(index_name, SearchIndexClient(endpoint=settings.search_endpoint, credential=search_creds))
+
+    async def main():
+        async with SearchClient(endpoint=settings.search_endpoint, credential=search_creds, index_name=index_name) as search_client:
+            await process_text_post_file(args.file_path, search_client, args.same_index, args.start_line, args.end_line, prune=args.prune)
+
+    asyncio.run(main())
+    print("Text post ingestion for index", index_name, "completed")
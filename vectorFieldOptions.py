@@ -0,0 +1,30 @@
+"""Vector field layout shared by the index schema, the enrichment pipeline and the upload path.
+
+The options themselves (vector_field_type, vector_compression, vector_oversampling,
+vector_stored, text_vector_mode) live in settings.Settings.
+"""
+from typing import List
+
+from settings import get_settings
+
+VECTOR_FIELD_TYPES = {
+    "Single": "Edm.Single",
+    "Half": "Edm.Half",
+}
+
+SEPARATE_TEXT_VECTOR_FIELDS = ["captionVector", "contentVector", "ocrContentVecotor"]
+FUSED_TEXT_VECTOR_FIELD = "fusedTextVector"
+# Document 上所有的向量字段
+DOCUMENT_VECTOR_FIELDS = ["captionVector", "contentVector", "ocrContentVecotor", "imageVecotor", FUSED_TEXT_VECTOR_FIELD]
+
+
+def get_text_vector_fields() -> List[str]:
+    # separate: caption/content/ocr 三个 1536 维向量; fused: 一个融合文本向量，每条记录只调用一次 embedding
+    return [FUSED_TEXT_VECTOR_FIELD] if get_settings().text_vector_mode == "fused" else SEPARATE_TEXT_VECTOR_FIELDS
+
+
+def round_vector_for_upload(vector: List[float]) -> List[float]:
+    # Half 只有约 3 位有效数字，上传完整精度的 float 只会浪费带宽
+    if vector is None or get_settings().vector_field_type != "Half":
+        return vector
+    return [float(f"{value:.4g}") for value in vector]
@@ -0,0 +1,184 @@
+"""Lease-based chunk distribution so workers on several machines can share one ingestion job."""
+import logging
+import os
+import sqlite3
+import time
+import uuid
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+from lineIndex import LineIndex
+from settings import get_settings
+
+
+@dataclass
+class ChunkLease:
+    job_id: str
+    chunk_id: int
+    start_line: int
+    end_line: int
+    worker_id: str
+    lease_token: str
+    expires_at: float
+
+
+class WorkCoordinator(ABC):
+    """Backend interface. A chunk is completed at most once: only the holder of the current lease token can complete it.
+
+    A chunk that has been claimed max_attempts times without completing is marked failed and
+    is not handed out again, so one poison chunk cannot keep a job from finishing.
+    """
+
+    @abstractmethod
+    def create_job(self, job_id: str, file_path: str, chunk_ranges: List[Tuple[int, int]]):
+        ...
+
+    @abstractmethod
+    def claim(self, job_id: str, worker_id: str, lease_seconds: int) -> Optional[ChunkLease]:
+        ...
+
+    @abstractmethod
+    def heartbeat(self, lease: ChunkLease, lease_seconds: int) -> bool:
+        ...
+
+    @abstractmethod
+    def complete(self, lease: ChunkLease) -> bool:
+        ...
+
+    @abstractmethod
+    def release(self, lease: ChunkLease, error: str = "") -> Optional[str]:
+        # 返回 chunk 的新状态: pending 或者 failed；lease 已经失效时返回 None
+        ...
+
+    @abstractmethod
+    def get_job_file(self, job_id: str) -> str:
+        ...
+
+    @abstractmethod
+    def progress(self, job_id: str) -> Dict[str, int]:
+        ...
+
+
+class SqliteWorkCoordinator(WorkCoordinator):
+    """Single-host backend; SQLite locking is not reliable on network file systems."""
+
+    def __init__(self, db_path: str, max_attempts: int = 3):
+        self.max_attempts = max_attempts
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.connection = sqlite3.connect(db_path, timeout=60, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS jobs (job_id TEXT PRIMARY KEY, file_path TEXT NOT NULL)")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS chunks ("
+            "job_id TEXT NOT NULL, chunk_id INTEGER NOT NULL, start_line INTEGER NOT NULL, end_line INTEGER NOT NULL, "
+            "state TEXT NOT NULL DEFAULT 'pending', worker_id TEXT, lease_token TEXT, expires_at REAL, "
+            "attempts INTEGER NOT NULL DEFAULT 0, last_error TEXT, "
+            "PRIMARY KEY (job_id, chunk_id))"
+        )
+
+    def create_job(self, job_id: str, file_path: str, chunk_ranges: List[Tuple[int, int]]):
+        # 重复创建同一个 job 不会覆盖已有进度
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            self.connection.execute("INSERT OR IGNORE INTO jobs (job_id, file_path) VALUES (?, ?)", (job_id, file_path))
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO chunks (job_id, chunk_id, start_line, end_line) VALUES (?, ?, ?, ?)",
+                [(job_id, chunk_id, start, end) for chunk_id, (start, end) in enumerate(chunk_ranges)],
+            )
+            self.connection.execute("COMMIT")
+        except Exception:
+            self.connection.execute("ROLLBACK")
+            raise
+
+    def claim(self, job_id: str, worker_id: str, lease_seconds: int) -> Optional[ChunkLease]:
+        now = time.time()
+        # BEGIN IMMEDIATE 拿到写锁，保证同一个 chunk 不会被两个 worker 同时领取
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            # lease 过期的 chunk 也算一次失败，次数用完的不再领取
+            expired = self.connection.execute(
+                "UPDATE chunks SET state = 'failed', lease_token = NULL, expires_at = NULL, last_error = 'lease expired' "
+                "WHERE job_id = ? AND state = 'leased' AND expires_at < ? AND attempts >= ?",
+                (job_id, now, self.max_attempts),
+            ).rowcount
+            if expired:
+                logging.warning("Marked %s chunks of job %s failed after %s expired leases", expired, job_id, self.max_attempts)
+            row = self.connection.execute(
+                "SELECT chunk_id, start_line, end_line FROM chunks WHERE job_id = ? AND "
+                "(state = 'pending' OR (state = 'leased' AND expires_at < ?)) ORDER BY chunk_id LIMIT 1",
+                (job_id, now),
+            ).fetchone()
+            if row is None:
+                self.connection.execute("COMMIT")
+                return None
+
+            chunk_id, start_line, end_line = row
+            lease = ChunkLease(job_id, chunk_id, start_line, end_line, worker_id, uuid.uuid4().hex, now + lease_seconds)
+            self.connection.execute(
+                "UPDATE chunks SET state = 'leased', worker_id = ?, lease_token = ?, expires_at = ?, attempts = attempts + 1 "
+                "WHERE job_id = ? AND chunk_id = ?",
+                (worker_id, lease.lease_token, lease.expires_at, job_id, chunk_id),
+            )
+            self.connection.execute("COMMIT")
+            return lease
+        except Exception:
+            self.connection.execute("ROLLBACK")
+            raise
+
+    def _update_leased(self, lease: ChunkLease, assignments: str, values: tuple) -> bool:
+        cursor = self.connection.execute(
+            f"UPDATE chunks SET {assignments} WHERE job_id = ? AND chunk_id = ? AND state = 'leased' AND lease_token = ?",
+            values + (lease.job_id, lease.chunk_id, lease.lease_token),
+        )
+        return cursor.rowcount == 1
+
+    def heartbeat(self, lease: ChunkLease, lease_seconds: int) -> bool:
+        expires_at = time.time() + lease_seconds
+        if self._update_leased(lease, "expires_at = ?", (expires_at,)):
+            lease.expires_at = expires_at
+            return True
+        return False
+
+    def complete(self, lease: ChunkLease) -> bool:
+        return self._update_leased(lease, "state = 'done', expires_at = NULL", ())
+
+    def release(self, lease: ChunkLease, error: str = "") -> Optional[str]:
+        # 失败次数用完的 chunk 标记为 failed，不再交给其他 worker
+        if not self._update_leased(lease, "state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                                          "lease_token = NULL, expires_at = NULL, last_error = ?", (self.max_attempts, error)):
+            return None
+        row = self.connection.execute("SELECT state FROM chunks WHERE job_id = ? AND chunk_id = ?", (lease.job_id, lease.chunk_id)).fetchone()
+        return row[0]
+
+    def get_job_file(self, job_id: str) -> str:
+        row = self.connection.execute("SELECT file_path FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if row is None:
+            raise Exception(f"Job {job_id} does not exist")
+        return row[0]
+
+    def progress(self, job_id: str) -> Dict[str, int]:
+        rows = self.connection.execute("SELECT state, COUNT(*) FROM chunks WHERE job_id = ? GROUP BY state", (job_id,))
+        return dict(rows.fetchall())
+
+
+# 共享存储的 backend（例如 Redis、Azure Table）通过 register_coordinator_backend 注册
+_backends: Dict[str, Callable[[str], WorkCoordinator]] = {
+    # 和 SQLAlchemy 一样: sqlite:///relative.db, sqlite:////absolute/path.db
+    "sqlite": lambda location: SqliteWorkCoordinator(location[1:] if location.startswith("/") else location, get_settings().coordinator_max_attempts),
+}
+
+def register_coordinator_backend(scheme: str, factory: Callable[[str], WorkCoordinator]):
+    _backends[scheme] = factory
+
+def create_coordinator(url: str) -> WorkCoordinator:
+    # 例如 sqlite:///docs/coordinator.db
+    scheme, _, location = url.partition("://")
+    if scheme not in _backends:
+        raise ValueError(f"Unknown coordinator backend: {scheme}")
+    return _backends[scheme](location)
+
+def build_chunk_ranges(file_path: str, lines_per_chunk: int) -> List[Tuple[int, int]]:
+    # 顺便保存行偏移索引，worker 直接按字节范围读取自己的 chunk
+    return LineIndex.load_or_build(file_path).shard_ranges(lines_per_chunk)